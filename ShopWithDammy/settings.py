@@ -3,7 +3,7 @@ from pathlib import Path
 from datetime import timedelta
 import os
 from dotenv import load_dotenv
-from decouple import config
+from decouple import Csv, config
 import dj_database_url
 import cloudinary
 
@@ -51,6 +51,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "Shopping_App.metrics.RequestMetricsMiddleware",
+    "Shopping_App.routers.ReplicaRoutingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -102,6 +104,67 @@ else:
         }
     }
 
+# Read replicas: comma-separated URLs, used for catalog and cart reads
+# (Shopping_App.routers). Tests run everything against the primary.
+DATABASE_REPLICA_URLS = config("DATABASE_REPLICA_URLS", default="", cast=Csv())
+DATABASE_REPLICAS = []
+for index, replica_url in enumerate(DATABASE_REPLICA_URLS, start=1):
+    DATABASES[f"replica{index}"] = {
+        **dj_database_url.parse(replica_url, conn_max_age=600, ssl_require=(ENV_MODE == "production")),
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica{index}")
+DATABASE_ROUTERS = ["Shopping_App.routers.ReplicaRouter"]
+# after writing to its cart a client reads from the primary for this long
+REPLICA_STICKY_SECONDS = config("REPLICA_STICKY_SECONDS", default=10, cast=int)
+REPLICA_MAX_LAG_SECONDS = config("REPLICA_MAX_LAG_SECONDS", default=5.0, cast=float)
+REPLICA_HEALTH_CHECK_INTERVAL = config("REPLICA_HEALTH_CHECK_INTERVAL", default=10.0, cast=float)
+# Cache holding the sticky-primary pins; must be shared (Redis) when replicas are used.
+REPLICA_PIN_CACHE_ALIAS = config("REPLICA_PIN_CACHE_ALIAS", default="default")
+
+# Cache: shared Redis when REDIS_URL is set, otherwise per-process memory.
+REDIS_URL = config("REDIS_URL", default="")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "shopwithdammy",
+        }
+    }
+CATALOG_STREAM_CHUNK_SIZE = config("CATALOG_STREAM_CHUNK_SIZE", default=500, cast=int)
+# Product detail and similar-product cache. Invalidations come from every
+# web worker, the job workers and import_products, so like the cart cache it
+# is off unless a shared cache is available (a system check enforces it).
+PRODUCT_CACHE_ALIAS = config("PRODUCT_CACHE_ALIAS", default="default" if REDIS_URL else "")
+PRODUCT_CACHE_TIMEOUT = config("PRODUCT_CACHE_TIMEOUT", default=600, cast=int)
+
+# Cart cache (Shopping_App.cache). Web and job workers must all see the same
+# entries, so it is off unless a shared cache is available: the Redis cache
+# when REDIS_URL is set, or CART_CACHE_BACKEND/CART_CACHE_LOCATION (e.g.
+# PyMemcacheCache, which evicts least recently used entries itself).
+# A system check rejects process-local backends.
+CART_CACHE_BACKEND = config("CART_CACHE_BACKEND", default="")
+CART_CACHE_TIMEOUT = config("CART_CACHE_TIMEOUT", default=300, cast=int)
+if CART_CACHE_BACKEND:
+    CACHES["carts"] = {
+        "BACKEND": CART_CACHE_BACKEND,
+        "LOCATION": config("CART_CACHE_LOCATION", default="carts"),
+        "TIMEOUT": CART_CACHE_TIMEOUT,
+    }
+    if CART_CACHE_BACKEND.endswith(("FileBasedCache", "DatabaseCache")):
+        # memcached clients reject unknown options; they bound memory themselves
+        CACHES["carts"]["OPTIONS"] = {"MAX_ENTRIES": config("CART_CACHE_MAX_ENTRIES", default=10000, cast=int)}
+CART_CACHE_ALIAS = config(
+    "CART_CACHE_ALIAS", default="carts" if CART_CACHE_BACKEND else ("default" if REDIS_URL else "")
+)
+
 AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"},
     {"NAME": "django.contrib.auth.password_validation.MinimumLengthValidator"},
@@ -141,6 +204,42 @@ else:
     MEDIA_URL = "/media/"
     MEDIA_ROOT = BASE_DIR / "media"
 
+# Product image uploads (import_products, product create/update)
+PRODUCT_IMAGE_UPLOADER = config(
+    "PRODUCT_IMAGE_UPLOADER", default="Shopping_App.utils.CloudinaryImageUploader"
+)
+IMAGE_UPLOAD_WORKERS = config("IMAGE_UPLOAD_WORKERS", default=4, cast=int)
+IMAGE_UPLOAD_RETRIES = config("IMAGE_UPLOAD_RETRIES", default=3, cast=int)
+# run queued jobs inside enqueue() instead of in run_workers (tests)
+BACKGROUND_TASKS_INLINE = config("BACKGROUND_TASKS_INLINE", default=False, cast=bool)
+
+# Request metrics (Shopping_App.metrics, served at /metrics)
+# log requests slower than this many milliseconds with their SQL; 0 disables
+SLOW_REQUEST_LOG_MS = config("SLOW_REQUEST_LOG_MS", default=0, cast=float)
+# /metrics requires "Authorization: Bearer <token>"; without a token it is
+# only served when DEBUG is on
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
+# Database-backed job queue (Shopping_App.jobs, manage.py run_workers)
+JOB_WORKERS = config("JOB_WORKERS", default=2, cast=int)
+JOB_POLL_INTERVAL = config("JOB_POLL_INTERVAL", default=1.0, cast=float)
+JOB_MAX_ATTEMPTS = config("JOB_MAX_ATTEMPTS", default=5, cast=int)
+JOB_RETRY_BACKOFF = config("JOB_RETRY_BACKOFF", default=5.0, cast=float)
+JOB_MAX_BACKOFF = config("JOB_MAX_BACKOFF", default=600.0, cast=float)
+# a job running longer than this is stopped and retried
+JOB_TIMEOUT = config("JOB_TIMEOUT", default=300, cast=int)
+# running jobs older than this are assumed orphaned by a dead worker; keep
+# it above JOB_TIMEOUT so live jobs are never run twice
+JOB_LOCK_TIMEOUT = config("JOB_LOCK_TIMEOUT", default=600, cast=int)
+JOB_REQUEUE_INTERVAL = config("JOB_REQUEUE_INTERVAL", default=60.0, cast=float)
+# finished jobs are deleted this long after they ran (dead ones are kept)
+JOB_RETENTION_DAYS = config("JOB_RETENTION_DAYS", default=7, cast=int)
+JOB_PRUNE_BATCH_SIZE = config("JOB_PRUNE_BATCH_SIZE", default=1000, cast=int)
+
+# Abandoned cart expiry (manage.py purge_carts)
+CART_TTL_DAYS = config("CART_TTL_DAYS", default=30, cast=float)
+CART_PURGE_BATCH_SIZE = config("CART_PURGE_BATCH_SIZE", default=500, cast=int)
+
 AUTH_USER_MODEL = "coreUsers.CustomUsers"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
@@ -173,6 +272,22 @@ FLUTTERWAVE_PUBLIC_KEY = config("FLUTTERWAVE_PUBLIC_KEY", default="")
 PAYPAL_CLIENT_ID = config("PAYPAL_CLIENT_ID", default="")
 PAYPAL_SECRET_KEY = config("PAYPAL_SECRET_KEY", default="")
 PAYPAL_MODE = config("PAYPAL_MODE", default="sandbox")
+PAYPAL_BASE_URL = config(
+    "PAYPAL_BASE_URL",
+    default="https://api-m.paypal.com" if PAYPAL_MODE == "live" else "https://api-m.sandbox.paypal.com",
+)
+FLUTTERWAVE_BASE_URL = config("FLUTTERWAVE_BASE_URL", default="https://api.flutterwave.com")
+# "Secret hash" set on the Flutterwave dashboard; sent back in the verif-hash header
+FLUTTERWAVE_WEBHOOK_HASH = config("FLUTTERWAVE_WEBHOOK_HASH", default="")
+PAYPAL_WEBHOOK_ID = config("PAYPAL_WEBHOOK_ID", default="")
+
+# Outbound payment gateway calls (Shopping_App.payments)
+PAYMENT_CONNECT_TIMEOUT = config("PAYMENT_CONNECT_TIMEOUT", default=3.05, cast=float)
+PAYMENT_READ_TIMEOUT = config("PAYMENT_READ_TIMEOUT", default=10.0, cast=float)
+PAYMENT_MAX_RETRIES = config("PAYMENT_MAX_RETRIES", default=2, cast=int)
+PAYMENT_RETRY_BACKOFF = config("PAYMENT_RETRY_BACKOFF", default=0.3, cast=float)
+PAYMENT_BREAKER_THRESHOLD = config("PAYMENT_BREAKER_THRESHOLD", default=5, cast=int)
+PAYMENT_BREAKER_RESET_TIMEOUT = config("PAYMENT_BREAKER_RESET_TIMEOUT", default=30.0, cast=float)
 
 REACT_BASE_URL = config("REACT_BASE_URL", default="http://localhost:5173")
 
@@ -3,16 +3,16 @@ from django.contrib import admin
 from django.urls import path,include
 from django.conf import settings
 from django.conf.urls.static import static
-from rest_framework_simplejwt.views import(
-    TokenObtainPairView,
-    TokenRefreshView
-)
+from rest_framework_simplejwt.views import TokenRefreshView
+from Shopping_App.metrics import metrics_view
+from Shopping_App.views import CartMergingTokenObtainPairView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("",include("Shopping_App.urls")),
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('token/', CartMergingTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('metrics', metrics_view, name='metrics'),
 ] 
 
 if settings.DEBUG:
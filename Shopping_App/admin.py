@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import Products, Cart, CartItem, ProductImage
+from .models import Products, Cart, CartItem, ProductImage, Job
 
 
 class ProductImageInline(admin.TabularInline):
@@ -49,7 +49,8 @@ class CartItemAdmin(admin.ModelAdmin):
 
 @admin.register(ProductImage)
 class ProductImageAdmin(admin.ModelAdmin):
-    list_display = ("product", "image_preview")
+    list_display = ("product", "status", "image_preview")
+    list_filter = ("status",)
 
     def image_preview(self, obj):
         fallback_url = "https://res.cloudinary.com/dorjc6aib/image/upload/v1730468123/default.jpg"
@@ -68,3 +69,10 @@ class ProductImageAdmin(admin.ModelAdmin):
             image_url,
         )
     image_preview.short_description = "Preview"
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "status", "attempts", "run_at", "wait_ms", "duration_ms")
+    list_filter = ("status", "name")
+    readonly_fields = ("payload", "last_error", "started_at", "finished_at", "wait_ms", "duration_ms")
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ShoppingAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Shopping_App'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
@@ -0,0 +1,304 @@
+"""Helpers shared by the benchmark management commands.
+
+Benchmarks never touch the configured database: they run inside a throwaway
+test database created the same way `manage.py test` does.
+"""
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.contrib.auth import get_user_model
+from django.db import connection, connections
+from django.test import Client
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .metrics import QueryRecorder
+from .models import Cart, CartItem, Products, Transaction
+from .search import product_index
+
+WORDS = (
+    "wireless", "leather", "classic", "smart", "portable", "premium", "compact",
+    "vintage", "digital", "cotton", "steel", "organic", "ultra", "mini", "pro",
+    "phone", "case", "headphone", "camera", "perfume", "sneaker", "jacket",
+    "laptop", "watch", "speaker", "charger", "bag", "desk", "lamp", "bottle",
+)
+CATEGORIES = [code for code, _ in Products.CATEGORY]
+
+
+@contextmanager
+def benchmark_database(keepdb=False):
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+
+def fake_product(index, rng):
+    name = " ".join(rng.sample(WORDS, 3)).title()
+    return Products(
+        name=name,
+        slug=f"bench-{index}",
+        description=" ".join(rng.choice(WORDS) for _ in range(20)),
+        price=Decimal(rng.randint(100, 500000)) / 100,
+        category=rng.choice(CATEGORIES),
+    )
+
+
+def seed_products(total, batch_size=5000, seed=0):
+    """Top the Products table up to `total` rows using batched inserts."""
+    rng = random.Random(seed)
+    existing = Products.objects.count()
+    for start in range(existing, total, batch_size):
+        end = min(start + batch_size, total)
+        Products.objects.bulk_create(
+            [fake_product(i, rng) for i in range(start, end)], batch_size=batch_size
+        )
+    # bulk_create skips save() and its signals, so refresh search state here.
+    Products.objects.all().refresh_search_vector()
+    product_index.invalidate()
+    return total - max(existing, 0)
+
+
+def seed_users(total, batch_size=5000):
+    User = get_user_model()
+    existing = User.objects.count()
+    for start in range(existing, total, batch_size):
+        User.objects.bulk_create(
+            [
+                User(username=f"bench{i}", email=f"bench{i}@example.com", password="!")
+                for i in range(start, min(start + batch_size, total))
+            ],
+            batch_size=batch_size,
+        )
+    return list(User.objects.order_by("id").values_list("id", flat=True)[:total])
+
+
+def seed_carts(total, items_per_cart=5, paid_ratio=0.3, user_ids=(), batch_size=2000, seed=0):
+    """Create `total` carts with random lines, a share of them paid with a Transaction."""
+    rng = random.Random(seed)
+    product_ids = list(Products.objects.values_list("id", flat=True))
+    prices = dict(Products.objects.values_list("id", "price"))
+    user_ids = list(user_ids)
+    existing = Cart.objects.count()
+    now = timezone.now()
+    for start in range(existing, total, batch_size):
+        carts = []
+        for i in range(start, min(start + batch_size, total)):
+            paid = rng.random() < paid_ratio
+            carts.append(Cart(
+                cart_code=f"b{i:010d}",
+                user_id=rng.choice(user_ids) if user_ids and (paid or rng.random() < 0.5) else None,
+                paid=paid,
+            ))
+        carts = Cart.objects.bulk_create(carts)
+        # bulk_create honours auto_now, so spread modification times afterwards
+        for cart in carts:
+            cart.modified_at = now - timedelta(days=rng.randint(0, 120))
+
+        items, transactions = [], []
+        for cart in carts:
+            chosen = rng.sample(product_ids, min(items_per_cart, len(product_ids)))
+            lines = [(pid, rng.randint(1, 4)) for pid in chosen]
+            items.extend(CartItem(cart=cart, product_id=pid, quantity=q) for pid, q in lines)
+            cart.item_count = sum(q for _, q in lines)
+            cart.subtotal = sum(prices[pid] * q for pid, q in lines)
+            if cart.paid and cart.user_id:
+                transactions.append(Transaction(
+                    ref=f"ref-{cart.cart_code}", user_id=cart.user_id, cart=cart,
+                    amount=cart.subtotal, status="completed",
+                ))
+        Cart.objects.bulk_update(carts, ["modified_at", "item_count", "subtotal"])
+        CartItem.objects.bulk_create(items, batch_size=batch_size)
+        Transaction.objects.bulk_create(transactions, batch_size=batch_size)
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3) if samples else 0.0,
+    }
+
+
+def time_calls(func, args_list):
+    samples = []
+    for args in args_list:
+        started = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def dump_json(data, path=None, stdout=None):
+    payload = json.dumps(data, indent=2, default=str)
+    if path:
+        with open(path, "w") as handle:
+            handle.write(payload)
+    elif stdout is not None:
+        stdout.write(payload)
+    return payload
+
+
+class StubImageUploader:
+    """Stands in for Cloudinary: returns a stored value without any network call."""
+
+    def __call__(self, source):
+        name = getattr(source, "name", None) or str(source)
+        return f"image/upload/v1/bench/{name.rsplit('/', 1)[-1]}"
+
+
+# Canned gateway answers, keyed by (method, path)
+STUB_GATEWAY_RESPONSES = {
+    ("POST", "/v3/payments"): (200, {"status": "success", "data": {"link": "https://checkout.example/pay"}}),
+    ("POST", "/v1/oauth2/token"): (200, {"access_token": "bench", "expires_in": 3600}),
+    ("POST", "/v1/payments/payment"): (
+        201, {"id": "PAY-BENCH", "links": [{"rel": "approval_url", "href": "https://paypal.example/ok"}]},
+    ),
+}
+
+
+@contextmanager
+def stub_gateway():
+    """Serve canned Flutterwave/PayPal responses on localhost; yields the base URL."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # otherwise delayed ACKs add ~40ms to every keep-alive POST
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            status, payload = STUB_GATEWAY_RESPONSES.get((self.command, self.path), (404, {}))
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def api_scenarios(seed=0):
+    """name -> callable(client, rng) issuing one request against the seeded data."""
+    rng = random.Random(seed)
+    slugs = list(Products.objects.order_by("?").values_list("slug", flat=True)[:1000])
+    product_ids = list(Products.objects.order_by("?").values_list("id", flat=True)[:1000])
+    open_carts = list(
+        Cart.objects.filter(paid=False).order_by("?").values_list("cart_code", flat=True)[:1000]
+    )
+    users = list(get_user_model().objects.order_by("?")[:100])
+    tokens = [f"Bearer {AccessToken.for_user(user)}" for user in users]
+    pages = max(1, min(Products.objects.count() // 10, 100))
+    rng.shuffle(open_carts)
+
+    def authed(client, rng, method, path, data=None):
+        return getattr(client, method)(path, data, HTTP_AUTHORIZATION=rng.choice(tokens))
+
+    return {
+        "products_list": lambda client, rng: client.get(
+            "/Products-list/", {"page": rng.randint(1, pages)}
+        ),
+        "product_detail": lambda client, rng: client.get(f"/product-detail/{rng.choice(slugs)}/"),
+        "add_item": lambda client, rng: client.post(
+            "/add_item/",
+            {"cart_code": rng.choice(open_carts), "product_id": rng.choice(product_ids), "quantity": 1},
+        ),
+        "get_cart": lambda client, rng: client.get("/get_cart/", {"cart_code": rng.choice(open_carts)}),
+        "get_cart_stat": lambda client, rng: client.get(
+            "/get_cart_stat/", {"cart_code": rng.choice(open_carts)}
+        ),
+        "user_info": lambda client, rng: authed(client, rng, "get", "/user_info/"),
+        "initiate_payment": lambda client, rng: authed(
+            client, rng, "post", "/initiate_payment/", {"cart_code": rng.choice(open_carts)}
+        ),
+    }
+
+
+def run_load(request, total, concurrency=1, seed=0):
+    """Issue `total` requests split over `concurrency` threads, each with its own client.
+
+    Returns throughput, latency percentiles, status codes and queries per request.
+    """
+    def worker(index, count):
+        client = Client()
+        rng = random.Random(seed * 1000 + index)
+        samples, queries, statuses = [], [], {}
+        try:
+            for _ in range(count):
+                recorder = QueryRecorder()
+                with ExitStack() as stack:
+                    for conn in connections.all():
+                        stack.enter_context(conn.execute_wrapper(recorder))
+                    started = time.perf_counter()
+                    try:
+                        status = request(client, rng).status_code
+                    except Exception:
+                        status = "exception"
+                    samples.append(time.perf_counter() - started)
+                queries.append(recorder.count)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            if concurrency > 1:
+                connections.close_all()
+        return samples, queries, statuses
+
+    shares = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+    started = time.perf_counter()
+    if concurrency == 1:
+        outcomes = [worker(0, total)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(worker, range(concurrency), shares))
+    elapsed = time.perf_counter() - started
+
+    samples = [s for outcome in outcomes for s in outcome[0]]
+    queries = [q for outcome in outcomes for q in outcome[1]]
+    statuses = {}
+    for outcome in outcomes:
+        for status, n in outcome[2].items():
+            statuses[str(status)] = statuses.get(str(status), 0) + n
+    errors = sum(n for status, n in statuses.items() if not status.isdigit() or int(status) >= 500)
+    return {
+        "requests": len(samples),
+        "concurrency": concurrency,
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "latency": summarize(samples),
+        "queries": {
+            "mean": round(sum(queries) / len(queries), 2) if queries else 0.0,
+            "max": max(queries, default=0),
+        },
+        "status_codes": statuses,
+        "errors": errors,
+    }
@@ -0,0 +1,242 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .metrics import CART_CACHE_LOOKUPS
+from .routers import read_from_primary
+
+CART_CATALOG_VERSION_KEY = "cart:catalog-version"
+
+
+def catalog_state():
+    """Current catalog version as {"etag", "last_modified"}: one primary-key read.
+
+    Kept in the database rather than a cache so a bump from any process
+    (web worker, job worker, import command) is seen by all of them.
+    """
+    from .models import CatalogVersion
+
+    version, _ = CatalogVersion.objects.get_or_create(pk=CatalogVersion.SINGLETON_ID)
+    # HTTP dates have one-second resolution
+    return {"etag": version.token.hex, "last_modified": version.modified_at.replace(microsecond=0)}
+
+
+def bump_catalog_version():
+    from .models import CatalogVersion
+
+    CatalogVersion.objects.update_or_create(
+        pk=CatalogVersion.SINGLETON_ID, defaults={"token": uuid.uuid4(), "modified_at": timezone.now()}
+    )
+    cache = cart_cache()
+    if cache is not None:
+        # after commit, or a concurrent get_cart could cache pre-commit product
+        # rows under the new version
+        transaction.on_commit(
+            lambda: cache.set(CART_CATALOG_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        )
+
+
+def _request_catalog_state(request):
+    # the condition decorator asks for the ETag and Last-Modified separately
+    if not hasattr(request, "_catalog_state"):
+        request._catalog_state = catalog_state()
+    return request._catalog_state
+
+
+def catalog_etag(request, *args, **kwargs):
+    return _request_catalog_state(request)["etag"]
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    return _request_catalog_state(request)["last_modified"]
+
+
+# ---- product detail and similar-product lists ----
+
+SIMILAR_PRODUCTS_LIMIT = 5
+
+
+def product_cache():
+    """The shared product cache, or None when PRODUCT_CACHE_ALIAS is empty."""
+    alias = settings.PRODUCT_CACHE_ALIAS
+    return caches[alias] if alias else None
+
+
+def _version(key):
+    cache = product_cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(cache, keys):
+    cache.set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+
+
+def product_version(slug):
+    return _version(f"product:version:{slug}")
+
+
+def category_version(category):
+    return _version(f"category:version:{category}")
+
+
+def invalidate_products(slugs=(), categories=()):
+    """Drop cached details and similar lists once the current transaction commits."""
+    cache = product_cache()
+    keys = [f"product:version:{slug}" for slug in slugs if slug]
+    keys += [f"category:version:{category}" for category in categories]
+    if cache is not None and keys:
+        # as with carts, bumping before commit would let a concurrent read
+        # cache the old rows under the new version
+        transaction.on_commit(lambda: _bump(cache, keys))
+
+
+def similar_product_ids(category):
+    """Ids of the first products in `category`, precomputed once per category version.
+
+    One more than the display limit is kept so the product being viewed can
+    be dropped from the list.
+    """
+    from .models import Products
+
+    if not category:
+        return []
+    cache = product_cache()
+    if cache is None:
+        return list(_similar_ids_query(Products, category))
+    key = f"similar:{category}:{category_version(category)}"
+    ids = cache.get(key)
+    if ids is None:
+        with read_from_primary():
+            ids = list(_similar_ids_query(Products, category))
+        cache.set(key, ids, timeout=settings.PRODUCT_CACHE_TIMEOUT)
+    return ids
+
+
+def _similar_ids_query(model, category):
+    return (
+        model.objects.filter(category=category)
+        .order_by("id")
+        .values_list("id", flat=True)[: SIMILAR_PRODUCTS_LIMIT + 1]
+    )
+
+
+def cached_product_detail(slug, build):
+    """Return the detail payload for `slug`, calling `build()` on a miss.
+
+    `build` returns (data, category). Entries are keyed by the product
+    version and remember the category version they embed, so a change to
+    any product in the category refreshes the similar-products block too.
+    """
+    cache = product_cache()
+    if cache is None:
+        return build()[0]
+    key = f"product-detail:{slug}:{product_version(slug)}"
+    entry = cache.get(key)
+    if entry is not None and entry["category_version"] == category_version(entry["category"]):
+        return entry["data"]
+
+    with read_from_primary():
+        data, category = build()
+    cache.set(
+        key,
+        {"data": data, "category": category, "category_version": category_version(category)},
+        timeout=settings.PRODUCT_CACHE_TIMEOUT,
+    )
+    return data
+
+
+# ---- carts ----
+#
+# Write-through: the cart views store the payload they just built under a
+# fresh version, so the next read is a hit; reads fill in on a miss. Cart
+# payloads embed product data, so they are also keyed by the catalog ETag.
+# Two writers racing on one cart can leave the older payload cached until
+# the next write or CART_CACHE_TIMEOUT. With no CART_CACHE_ALIAS (no shared
+# cache configured) every read goes to the database.
+
+
+def cart_cache():
+    alias = settings.CART_CACHE_ALIAS
+    return caches[alias] if alias else None
+
+
+def cart_version(cart_code):
+    key = f"cart:version:{cart_code}"
+    cache = cart_cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=settings.CART_CACHE_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def _cart_catalog_version(cache):
+    # a copy of the catalog version in the shared cart cache, so hits need no query
+    version = cache.get(CART_CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CART_CATALOG_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(CART_CATALOG_VERSION_KEY)
+    return version
+
+
+def _cart_keys(cart_code, version):
+    return {
+        "cart": f"cart:{cart_code}:{version}:{_cart_catalog_version(cart_cache())}",
+        "stat": f"cart-stat:{cart_code}:{version}",
+    }
+
+
+def cached_cart(cart_code, kind, build):
+    """Cached "cart" or "stat" payload for `cart_code`, calling `build()` on a miss.
+
+    `build` returns None for a missing cart, which is not cached.
+    """
+    cache = cart_cache()
+    if cache is None:
+        return build()
+    key = _cart_keys(cart_code, cart_version(cart_code))[kind]
+    data = cache.get(key)
+    CART_CACHE_LOOKUPS.labels(kind, "miss" if data is None else "hit").inc()
+    if data is None:
+        with read_from_primary():
+            data = build()
+        if data is not None:
+            cache.set(key, data, timeout=settings.CART_CACHE_TIMEOUT)
+    return data
+
+
+def store_cart(cart_code, cart=None, stat=None):
+    """Write through a cart the caller just changed: new version, fresh payloads."""
+    cache = cart_cache()
+    if cache is None:
+        return
+    version = uuid.uuid4().hex
+    keys = _cart_keys(cart_code, version)
+    entries = {f"cart:version:{cart_code}": version}
+    if cart is not None:
+        entries[keys["cart"]] = cart
+    if stat is not None:
+        entries[keys["stat"]] = stat
+    cache.set_many(entries, timeout=settings.CART_CACHE_TIMEOUT)
+
+
+def invalidate_carts(*cart_codes):
+    """Drop the cached payloads of these carts once the current transaction commits."""
+    cache = cart_cache()
+    if cache is None:
+        return
+
+    def bump():
+        cache.set_many(
+            {f"cart:version:{code}": uuid.uuid4().hex for code in cart_codes},
+            timeout=settings.CART_CACHE_TIMEOUT,
+        )
+    # bumping before commit would let a concurrent read cache the old rows
+    transaction.on_commit(bump)
@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+# backends whose entries one process cannot see from another
+PROCESS_LOCAL_BACKENDS = ("LocMemCache", "DummyCache")
+
+
+def is_shared_cache(alias):
+    backend = settings.CACHES.get(alias, {}).get("BACKEND", "")
+    return bool(backend) and not backend.endswith(PROCESS_LOCAL_BACKENDS)
+
+
+@register(Tags.caches)
+def check_cart_cache(app_configs, **kwargs):
+    alias = settings.CART_CACHE_ALIAS
+    if alias and not is_shared_cache(alias):
+        return [Error(
+            f"CART_CACHE_ALIAS {alias!r} is not a cache shared between processes.",
+            hint="Invalidations from other web or job workers would never reach this one. "
+                 "Point it at Redis or memcached, or leave CART_CACHE_ALIAS empty.",
+            id="Shopping_App.E001",
+        )]
+    return []
+
+
+@register(Tags.caches)
+def check_product_cache(app_configs, **kwargs):
+    alias = settings.PRODUCT_CACHE_ALIAS
+    if alias and not is_shared_cache(alias):
+        return [Error(
+            f"PRODUCT_CACHE_ALIAS {alias!r} is not a cache shared between processes.",
+            hint="Product edits, image uploads and imports in other processes would leave "
+                 "this one serving stale pages. Point it at Redis or memcached, or leave "
+                 "PRODUCT_CACHE_ALIAS empty.",
+            id="Shopping_App.E004",
+        )]
+    return []
+
+
+@register(Tags.caches)
+def check_replica_pin_cache(app_configs, **kwargs):
+    alias = settings.REPLICA_PIN_CACHE_ALIAS
+    if settings.DATABASE_REPLICAS and not is_shared_cache(alias):
+        return [Error(
+            f"REPLICA_PIN_CACHE_ALIAS {alias!r} is not a cache shared between processes.",
+            hint="A client pinned after a write by one web worker would read a stale replica "
+                 "from the next. Set REDIS_URL or point REPLICA_PIN_CACHE_ALIAS at a shared cache.",
+            id="Shopping_App.E003",
+        )]
+    return []
+
+
+@register(Tags.security)
+def check_metrics_token(app_configs, **kwargs):
+    if not settings.DEBUG and not settings.METRICS_TOKEN:
+        return [Warning(
+            "METRICS_TOKEN is not set, so /metrics is not served.",
+            hint="Set METRICS_TOKEN and send it as \"Authorization: Bearer <token>\" when scraping.",
+            id="Shopping_App.W001",
+        )]
+    return []
+
+
+@register()
+def check_job_timeouts(app_configs, **kwargs):
+    if settings.JOB_TIMEOUT and settings.JOB_TIMEOUT >= settings.JOB_LOCK_TIMEOUT:
+        return [Error(
+            "JOB_TIMEOUT must be shorter than JOB_LOCK_TIMEOUT.",
+            hint="Otherwise a job that is still running is requeued and runs twice.",
+            id="Shopping_App.E002",
+        )]
+    return []
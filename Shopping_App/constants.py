@@ -1,3 +1,19 @@
+from decimal import Decimal
 
 
-BASE_URL = "http://127.0.0.1:8000"
\ No newline at end of file
+BASE_URL = "http://127.0.0.1:8000"
+
+# Named Cloudinary transformations for image URLs (?image_preset=thumbnail)
+IMAGE_PRESETS = {
+    "original": {},
+    "thumbnail": {"width": 300, "height": 300, "crop": "fill", "quality": "auto", "fetch_format": "auto"},
+    "detail": {"width": 1200, "crop": "limit", "quality": "auto", "fetch_format": "auto"},
+}
+DEFAULT_IMAGE_PRESET = "original"
+# Bound on memoized (image, version, preset) -> URL entries per process
+IMAGE_URL_CACHE_SIZE = 4096
+# Flat tax added at checkout, per charge currency
+TAX_BY_CURRENCY = {
+    "NGN": Decimal("1500.00"),
+    "USD": Decimal("1000.00"),
+}
@@ -0,0 +1,278 @@
+"""Database-backed job queue.
+
+Work is stored as `Job` rows and run by `manage.py run_workers`, so no
+broker is needed. Jobs are claimed with a conditional UPDATE (only one
+worker can flip a row from queued to running), failures are retried with
+exponential backoff, and jobs that run out of attempts are left as "dead"
+for inspection and `run_workers --retry-dead`.
+
+Each job may run for JOB_TIMEOUT seconds. Jobs left running by a worker
+that died are requeued once they are older than JOB_LOCK_TIMEOUT (or
+marked dead if that was their last attempt), and
+`supervise` restarts worker processes that exit. Done jobs are deleted
+after JOB_RETENTION_DAYS; dead ones stay until retried or removed.
+"""
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Avg, Count, F, Max
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class JobTimeout(Exception):
+    pass
+
+
+def job(func=None, *, name=None, max_attempts=None):
+    """Register `func` as a job handler; use `enqueue(func, ...)` to schedule it."""
+    def register(func):
+        func.job_name = name or f"{func.__module__}.{func.__name__}"
+        func.max_attempts = max_attempts
+        _registry[func.job_name] = func
+        return func
+    return register(func) if func is not None else register
+
+
+def enqueue(func, *args, run_at=None, **kwargs):
+    """Queue a call to a registered job. Arguments must be JSON serializable.
+
+    With BACKGROUND_TASKS_INLINE enabled (tests) the job is run immediately.
+    """
+    job_row = Job.objects.create(
+        name=func.job_name,
+        payload={"args": list(args), "kwargs": kwargs},
+        max_attempts=func.max_attempts or settings.JOB_MAX_ATTEMPTS,
+        run_at=run_at or timezone.now(),
+    )
+    if settings.BACKGROUND_TASKS_INLINE:
+        claimed = claim_job(worker_id="inline", job_id=job_row.id)
+        if claimed is not None:
+            run_job(claimed)
+            return claimed
+    return job_row
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_job(worker_id, job_id=None):
+    """Claim the next due job (or `job_id`) for this worker; None if there is none."""
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now)
+    if job_id is not None:
+        candidates = [job_id]
+    else:
+        candidates = due.order_by("run_at", "id").values_list("id", flat=True)[:10]
+    for candidate in candidates:
+        claimed = due.filter(id=candidate).update(
+            status=Job.RUNNING, locked_by=worker_id, started_at=now, attempts=F("attempts") + 1
+        )
+        if claimed:
+            return Job.objects.get(id=candidate)
+    return None
+
+
+def retry_delay(attempts):
+    return min(settings.JOB_RETRY_BACKOFF * 2 ** (attempts - 1), settings.JOB_MAX_BACKOFF)
+
+
+@contextmanager
+def time_limit(seconds):
+    """Raise JobTimeout in the block after `seconds`.
+
+    Needs SIGALRM, so it only applies on Unix in the main thread (as in
+    run_workers); elsewhere the block runs unbounded.
+    """
+    in_main_thread = threading.current_thread() is threading.main_thread()
+    if not seconds or not hasattr(signal, "setitimer") or not in_main_thread:
+        yield
+        return
+
+    def expire(signum, frame):
+        raise JobTimeout(f"Job exceeded its {seconds}s time limit")
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def run_job(job_row, timeout=None):
+    """Run a claimed job and record its outcome and timings.
+
+    A job still running after `timeout` seconds is stopped and counts as
+    a failed attempt.
+    """
+    started = time.perf_counter()
+    job_row.wait_ms = max(int((job_row.started_at - job_row.run_at).total_seconds() * 1000), 0)
+    try:
+        # handlers register on import; a fresh worker may not have imported them yet
+        func = _registry.get(job_row.name) or import_string(job_row.name)
+        with time_limit(timeout):
+            func(*job_row.payload.get("args", []), **job_row.payload.get("kwargs", {}))
+    except Exception:
+        job_row.last_error = traceback.format_exc()
+        if job_row.attempts >= job_row.max_attempts:
+            job_row.status = Job.DEAD
+            logger.error("Job %s (%s) is dead after %s attempts", job_row.id, job_row.name, job_row.attempts)
+        else:
+            job_row.status = Job.QUEUED
+            job_row.run_at = timezone.now() + timedelta(seconds=retry_delay(job_row.attempts))
+            logger.warning("Job %s (%s) failed, retrying at %s", job_row.id, job_row.name, job_row.run_at)
+    else:
+        job_row.status = Job.DONE
+        job_row.last_error = ""
+
+    job_row.duration_ms = int((time.perf_counter() - started) * 1000)
+    job_row.finished_at = timezone.now()
+    job_row.locked_by = None
+    job_row.save(update_fields=[
+        "status", "run_at", "last_error", "locked_by", "finished_at", "wait_ms", "duration_ms",
+    ])
+    logger.info(
+        "Job %s (%s) %s in %sms after waiting %sms",
+        job_row.id, job_row.name, job_row.status, job_row.duration_ms, job_row.wait_ms,
+    )
+    return job_row
+
+
+def requeue_stale_jobs():
+    """Put back jobs whose worker died mid-run (running longer than JOB_LOCK_TIMEOUT).
+
+    A job that already used its last attempt is marked dead instead, so one
+    that kills its worker every time (out of memory, a crash in C code)
+    stops being retried. Returns the number requeued.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT)
+    stale = Job.objects.filter(status=Job.RUNNING, started_at__lt=cutoff)
+    dead = stale.filter(attempts__gte=F("max_attempts")).update(
+        status=Job.DEAD, locked_by=None, finished_at=now,
+        last_error="Worker stopped during the last attempt (crashed or was killed).",
+    )
+    if dead:
+        logger.error("%s job(s) are dead after their worker stopped on the last attempt", dead)
+    return stale.update(status=Job.QUEUED, locked_by=None, run_at=now)
+
+
+def prune_done_jobs(retention_days=None, batch_size=None):
+    """Delete done jobs finished more than `retention_days` ago, in short batches."""
+    retention_days = settings.JOB_RETENTION_DAYS if retention_days is None else retention_days
+    batch_size = batch_size or settings.JOB_PRUNE_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    done = Job.objects.filter(status=Job.DONE, finished_at__lt=cutoff)
+    pruned = 0
+    while True:
+        ids = list(done.values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return pruned
+        pruned += Job.objects.filter(id__in=ids).delete()[0]
+
+
+def housekeeping():
+    """Periodic queue upkeep: requeue stale jobs and prune old done ones.
+
+    Returns the number of jobs requeued.
+    """
+    stale = requeue_stale_jobs()
+    prune_done_jobs()
+    return stale
+
+
+def work(worker_id=None, burst=False, poll_interval=1.0, should_stop=lambda: False, timeout=None,
+         requeue_interval=None):
+    """Claim and run jobs until stopped; with `burst`, return once the queue is drained.
+
+    `timeout` bounds each job; with `requeue_interval`, `housekeeping`
+    runs that often (run_workers does it in the supervisor instead when
+    it runs several processes).
+    """
+    worker_id = worker_id or worker_name()
+    processed = 0
+    next_requeue = time.monotonic()
+    while not should_stop():
+        if requeue_interval and time.monotonic() >= next_requeue:
+            housekeeping()
+            next_requeue = time.monotonic() + requeue_interval
+        job_row = claim_job(worker_id)
+        if job_row is None:
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        run_job(job_row, timeout=timeout)
+        processed += 1
+    return processed
+
+
+def supervise(spawn, count, burst=False, should_stop=lambda: False, check_interval=1.0,
+              requeue_interval=60.0, before_spawn=lambda: None):
+    """Keep `count` worker processes running until `should_stop()`.
+
+    `spawn(index)` starts and returns a process. Processes that exit are
+    restarted, except ones that finished cleanly in `burst` mode.
+    `housekeeping` runs every `requeue_interval` seconds. `before_spawn`
+    runs before each start (run_workers closes database connections so
+    children do not inherit them). Returns the number of restarts.
+    """
+    before_spawn()
+    processes = {index: spawn(index) for index in range(count)}
+    restarts = 0
+    next_requeue = time.monotonic() + requeue_interval
+    while processes and not should_stop():
+        for index, process in list(processes.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            if burst and process.exitcode == 0:
+                del processes[index]
+                continue
+            logger.error("Worker %s exited with code %s; restarting it", index, process.exitcode)
+            before_spawn()
+            processes[index] = spawn(index)
+            restarts += 1
+        if time.monotonic() >= next_requeue:
+            stale = housekeeping()
+            if stale:
+                logger.warning("Requeued %s job(s) left running by a dead worker", stale)
+            next_requeue = time.monotonic() + requeue_interval
+        time.sleep(check_interval)
+
+    for process in processes.values():
+        process.terminate()
+    for process in processes.values():
+        process.join()
+    return restarts
+
+
+def job_stats():
+    """Counts and timings per job name and status."""
+    return list(
+        Job.objects.values("name", "status")
+        .annotate(
+            count=Count("id"),
+            avg_wait_ms=Avg("wait_ms"),
+            avg_duration_ms=Avg("duration_ms"),
+            max_duration_ms=Max("duration_ms"),
+        )
+        .order_by("name", "status")
+    )
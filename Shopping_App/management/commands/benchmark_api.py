@@ -0,0 +1,90 @@
+import subprocess
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from Shopping_App.benchmarks import (
+    api_scenarios, benchmark_database, dump_json, run_load, seed_carts, seed_products, seed_users,
+    stub_gateway,
+)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database and drive the shopping API in-process, sequentially and under "
+        "concurrent load, reporting throughput, latency percentiles and queries per request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=10_000)
+        parser.add_argument("--users", type=int, default=1_000)
+        parser.add_argument("--carts", type=int, default=5_000)
+        parser.add_argument("--items-per-cart", type=int, default=5)
+        parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and concurrency level.")
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+        parser.add_argument("--endpoints", nargs="+", help="Only run these scenarios.")
+        parser.add_argument("--json", dest="json_path", help="Write results to this file as JSON.")
+        parser.add_argument("--keepdb", action="store_true", help="Reuse the benchmark database.")
+
+    def handle(self, *args, **options):
+        report = {
+            "revision": git_revision(),
+            "started_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "dataset": {
+                "products": options["products"],
+                "users": options["users"],
+                "carts": options["carts"],
+                "items_per_cart": options["items_per_cart"],
+            },
+            "results": [],
+        }
+
+        with benchmark_database(keepdb=options["keepdb"]), stub_gateway() as gateway_url:
+            self.stdout.write("Seeding...")
+            seed_products(options["products"])
+            user_ids = seed_users(options["users"])
+            seed_carts(options["carts"], options["items_per_cart"], user_ids=user_ids)
+
+            stubs = override_settings(
+                ALLOWED_HOSTS=["*"],
+                PRODUCT_IMAGE_UPLOADER="Shopping_App.benchmarks.StubImageUploader",
+                FLUTTERWAVE_BASE_URL=gateway_url,
+                PAYPAL_BASE_URL=gateway_url,
+                SLOW_REQUEST_LOG_MS=0,
+            )
+            with stubs:
+                scenarios = api_scenarios()
+                names = options["endpoints"] or list(scenarios)
+                unknown = set(names) - set(scenarios)
+                if unknown:
+                    raise CommandError(f"Unknown endpoint(s): {', '.join(sorted(unknown))}")
+
+                for name in names:
+                    for concurrency in options["concurrency"]:
+                        # every run starts cold so results do not depend on run order
+                        for cache in caches.all():
+                            cache.clear()
+                        result = {"endpoint": name, **run_load(scenarios[name], options["requests"], concurrency)}
+                        report["results"].append(result)
+                        latency = result["latency"]
+                        self.stdout.write(
+                            f"{name:<17} c={concurrency:<3} {result['throughput_rps']:>8} req/s  "
+                            f"p50={latency['p50_ms']}ms p95={latency['p95_ms']}ms p99={latency['p99_ms']}ms  "
+                            f"queries={result['queries']['mean']}  errors={result['errors']}"
+                        )
+
+        if options["json_path"]:
+            dump_json(report, options["json_path"])
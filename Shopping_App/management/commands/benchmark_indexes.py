@@ -0,0 +1,111 @@
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from Shopping_App.benchmarks import (
+    WORDS, benchmark_database, dump_json, seed_carts, seed_products, seed_users, summarize, time_calls,
+)
+from Shopping_App.models import Cart, CartItem, Products, Transaction
+from Shopping_App.search import search_products
+
+# Indexes added for the hot query patterns (migration 0015) and the search
+# GIN index (0020; a plain index off Postgres, where search does not use it).
+# The benchmark database is dropped afterwards, so they are simply removed
+# for the "before" run and recreated for the "after" run.
+QUERY_PATTERN_INDEXES = {
+    Cart: ["cart_user_paid_idx", "cart_unpaid_modified_idx"],
+    Products: ["products_category_id_idx", "products_search_gin"],
+}
+
+
+def query_pattern_indexes():
+    for model, names in QUERY_PATTERN_INDEXES.items():
+        for index in model._meta.indexes:
+            if index.name in names:
+                yield model, index
+
+
+def hot_queries(rng):
+    """(name, queryset factory) for each lookup the views run on every request."""
+    cart_codes = list(Cart.objects.values_list("cart_code", flat=True)[:500])
+    lines = list(CartItem.objects.values_list("cart_id", "product_id")[:500])
+    slugs = list(Products.objects.values_list("slug", flat=True)[:500])
+    refs = list(Transaction.objects.values_list("ref", flat=True)[:500]) or ["missing"]
+    users = list(Cart.objects.exclude(user=None).values_list("user_id", flat=True)[:500]) or [0]
+    categories = [code for code, _ in Products.CATEGORY]
+    cutoff = timezone.now() - timedelta(days=30)
+
+    return [
+        ("get_cart", lambda: Cart.objects.filter(cart_code=rng.choice(cart_codes), paid=False)),
+        ("check_product_in_cart", lambda: CartItem.objects.filter(
+            **dict(zip(("cart_id", "product_id"), rng.choice(lines))))),
+        ("similar_products", lambda: Products.objects.filter(
+            category=rng.choice(categories)).order_by("id")[:6]),
+        ("product_by_slug", lambda: Products.objects.filter(slug=rng.choice(slugs))),
+        ("product_search", lambda: search_products(Products.objects.all(), rng.choice(WORDS))[:20]),
+        ("transaction_by_ref", lambda: Transaction.objects.filter(ref=rng.choice(refs))),
+        ("paid_items_for_user", lambda: CartItem.objects.filter(
+            cart__user_id=rng.choice(users), cart__paid=True).order_by("-cart__modified_at")[:10]),
+        ("open_carts_for_user", lambda: Cart.objects.filter(user_id=rng.choice(users), paid=False)),
+        ("idle_unpaid_carts", lambda: Cart.objects.filter(
+            paid=False, modified_at__lt=cutoff).order_by("modified_at")[:1000]),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Seed large tables and report EXPLAIN plans and timings with and without the query-pattern indexes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=50_000)
+        parser.add_argument("--carts", type=int, default=100_000)
+        parser.add_argument("--users", type=int, default=10_000)
+        parser.add_argument("--items-per-cart", type=int, default=5)
+        parser.add_argument("--repeat", type=int, default=200)
+        parser.add_argument("--json", dest="json_path", help="Write results to this file as JSON.")
+        parser.add_argument("--keepdb", action="store_true")
+
+    def handle(self, *args, **options):
+        with benchmark_database(keepdb=options["keepdb"]):
+            self.stdout.write("Seeding...")
+            seed_products(options["products"])
+            user_ids = seed_users(options["users"])
+            seed_carts(options["carts"], options["items_per_cart"], user_ids=user_ids)
+
+            with connection.schema_editor() as editor:
+                for model, index in query_pattern_indexes():
+                    editor.remove_index(model, index)
+            before = self._measure(options["repeat"])
+
+            with connection.schema_editor() as editor:
+                for model, index in query_pattern_indexes():
+                    editor.add_index(model, index)
+            after = self._measure(options["repeat"])
+
+        results = []
+        for name in after:
+            results.append({"query": name, "before": before[name], "after": after[name]})
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label in ("before", "after"):
+                timing = results[-1][label]["timing"]
+                self.stdout.write(f"  {label:<6} p50={timing['p50_ms']}ms p99={timing['p99_ms']}ms")
+                for line in results[-1][label]["plan"].splitlines():
+                    self.stdout.write(f"         {line}")
+
+        if options["json_path"]:
+            dump_json(results, options["json_path"])
+
+    def _measure(self, repeat):
+        # Start from a fresh connection and up-to-date planner statistics.
+        connection.close()
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        rng = random.Random(7)
+        measured = {}
+        for name, build in hot_queries(rng):
+            plan = build().explain()
+            samples = time_calls(lambda: list(build()), [()] * repeat)
+            measured[name] = {"plan": plan, "timing": summarize(samples)}
+        return measured
@@ -0,0 +1,59 @@
+import random
+from functools import reduce
+from operator import and_, or_
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from Shopping_App.benchmarks import WORDS, benchmark_database, dump_json, seed_products, summarize, time_calls
+from Shopping_App.models import Products
+from Shopping_App.search import search_products, tokenize
+
+
+def legacy_search(queryset, term):
+    # What DRF's SearchFilter over name/description/category produces.
+    fields = ("name", "description", "category")
+    clauses = [
+        reduce(or_, (Q(**{f"{field}__icontains": token}) for field in fields))
+        for token in tokenize(term)
+    ]
+    return queryset.filter(reduce(and_, clauses)) if clauses else queryset
+
+
+class Command(BaseCommand):
+    help = "Compare p50/p99 search latency of the legacy ILIKE filter and the full-text index."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--page-size", type=int, default=10)
+        parser.add_argument("--json", dest="json_path", help="Write results to this file as JSON.")
+        parser.add_argument("--keepdb", action="store_true", help="Reuse the benchmark database.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        terms = [" ".join(rng.sample(WORDS, rng.choice((1, 2)))) for _ in range(options["queries"])]
+        page = options["page_size"]
+        results = []
+
+        with benchmark_database(keepdb=options["keepdb"]):
+            for size in sorted(options["sizes"]):
+                seed_products(size)
+                base = Products.objects.order_by("id")
+                row = {"products": size}
+                for label, search in (("legacy", legacy_search), ("fulltext", search_products)):
+                    # Warm caches (and the in-process index on SQLite) first.
+                    list(search(base, terms[0])[:page])
+                    samples = time_calls(
+                        lambda term: list(search(base, term)[:page]), [(t,) for t in terms]
+                    )
+                    row[label] = summarize(samples)
+                results.append(row)
+                self.stdout.write(
+                    f"{size:>9} products  legacy p50={row['legacy']['p50_ms']}ms "
+                    f"p99={row['legacy']['p99_ms']}ms  fulltext p50={row['fulltext']['p50_ms']}ms "
+                    f"p99={row['fulltext']['p99_ms']}ms"
+                )
+
+        if options["json_path"]:
+            dump_json(results, options["json_path"])
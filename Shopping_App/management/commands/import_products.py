@@ -0,0 +1,208 @@
+import csv
+import json
+import os
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from typing import NamedTuple
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from Shopping_App.cache import bump_catalog_version, invalidate_products
+from Shopping_App.models import Products, ProductImage
+from Shopping_App.utils import get_image_uploader, upload_images
+
+CATEGORY_CODES = {}
+for code, label in Products.CATEGORY:
+    CATEGORY_CODES[code.lower()] = code
+    CATEGORY_CODES[label.lower()] = code
+
+
+class UnreadableRow(NamedTuple):
+    """A JSON line that is not an object; reported as a failed row."""
+
+    line: int
+    text: str
+    error: str
+
+
+def read_rows(path, fmt):
+    """Yield dicts from a CSV or JSON-lines file without loading it into memory.
+
+    Malformed JSON lines are yielded as `UnreadableRow` so they count as
+    rows: the import reports them and resumes past them.
+    """
+    with open(path, newline="", encoding="utf-8") as handle:
+        if fmt == "csv":
+            for row in csv.DictReader(handle):
+                extras = row.get("extra_images") or ""
+                row["extra_images"] = [s.strip() for s in extras.split("|") if s.strip()]
+                yield row
+        else:
+            for number, line in enumerate(handle, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as exc:
+                    yield UnreadableRow(number, line.rstrip("\n"), f"line {number}: invalid JSON: {exc}")
+                    continue
+                if isinstance(row, dict):
+                    yield row
+                else:
+                    yield UnreadableRow(number, line.rstrip("\n"), f"line {number}: expected a JSON object")
+
+
+def parse_row(row):
+    name = (row.get("name") or "").strip()
+    if not name:
+        raise ValueError("name is required")
+    try:
+        price = Decimal(str(row.get("price")))
+    except (InvalidOperation, TypeError):
+        raise ValueError(f"invalid price {row.get('price')!r}")
+    category = row.get("category")
+    if category:
+        category = CATEGORY_CODES.get(category.strip().lower())
+        if category is None:
+            raise ValueError(f"unknown category {row.get('category')!r}")
+    return {
+        "name": name,
+        "description": row.get("description") or None,
+        "price": price,
+        "category": category or None,
+        "image": (row.get("image") or "").strip() or None,
+        "extra_images": list(row.get("extra_images") or []),
+    }
+
+
+class Command(BaseCommand):
+    help = "Import products from a CSV or JSON-lines file in batches, uploading images in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="Defaults to the file extension.")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=None, help="Parallel image uploads.")
+        parser.add_argument("--retries", type=int, default=3)
+        parser.add_argument(
+            "--progress-file",
+            help="Where committed progress is recorded (default: <path>.progress). "
+            "Re-running the command resumes after the last committed batch.",
+        )
+        parser.add_argument("--restart", action="store_true", help="Ignore saved progress.")
+        parser.add_argument(
+            "--failed-file",
+            help="Rows that could not be imported are appended here as JSON lines "
+            "(default: <path>.failed.jsonl).",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+        fmt = options["format"] or ("csv" if path.lower().endswith(".csv") else "jsonl")
+        progress_file = options["progress_file"] or f"{path}.progress"
+        failed_file = options["failed_file"] or f"{path}.failed.jsonl"
+        batch_size = options["batch_size"]
+
+        done = 0 if options["restart"] else self._read_progress(progress_file)
+        if done:
+            self.stdout.write(f"Resuming after {done} row(s).")
+
+        self.uploader = get_image_uploader()
+        self.upload_options = {"max_workers": options["workers"], "retries": options["retries"]}
+
+        rows = islice(read_rows(path, fmt), done, None)
+        imported = failed = 0
+        self.categories = set()
+        started = time.perf_counter()
+        try:
+            with open(failed_file, "a", encoding="utf-8") as failures:
+                while True:
+                    batch = list(islice(rows, batch_size))
+                    if not batch:
+                        break
+                    ok, errors = self._import_batch(batch)
+                    for row, error in errors:
+                        failures.write(json.dumps({"row": row, "error": error}, default=str) + "\n")
+                    done += len(batch)
+                    imported += ok
+                    failed += len(errors)
+                    self._write_progress(progress_file, done)
+
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f"{done} rows processed, {imported} imported, {failed} failed "
+                        f"({imported / elapsed if elapsed else 0:.1f} rows/sec)"
+                    )
+        finally:
+            # once per run rather than per batch; also after a failure, for the
+            # batches that were committed
+            if imported:
+                bump_catalog_version()
+                invalidate_products(categories=self.categories)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {imported} product(s) in {elapsed:.2f}s "
+                f"({imported / elapsed if elapsed else 0:.1f} rows/sec); {failed} failed."
+            )
+        )
+        if failed:
+            self.stdout.write(f"Failed rows were written to {failed_file}.")
+
+    def _import_batch(self, batch):
+        parsed, errors = [], []
+        for row in batch:
+            if isinstance(row, UnreadableRow):
+                errors.append((row.text, row.error))
+                continue
+            try:
+                parsed.append((row, parse_row(row)))
+            except ValueError as exc:
+                errors.append((row, str(exc)))
+
+        sources = [s for _, data in parsed for s in [data["image"], *data["extra_images"]] if s]
+        uploaded, upload_errors = upload_images(sources, uploader=self.uploader, **self.upload_options)
+
+        products, extras = [], []
+        for row, data in parsed:
+            broken = [s for s in [data["image"], *data["extra_images"]] if s in upload_errors]
+            if broken:
+                errors.append((row, f"image upload failed: {upload_errors[broken[0]]}"))
+                continue
+            product = Products(
+                name=data["name"],
+                description=data["description"],
+                price=data["price"],
+                category=data["category"],
+                image=uploaded.get(data["image"]),
+            )
+            products.append(product)
+            extras.append([uploaded[s] for s in data["extra_images"]])
+
+        with transaction.atomic():
+            created = Products.objects.bulk_create_with_slugs(products, invalidate_caches=False)
+            ProductImage.objects.bulk_create(
+                ProductImage(product=product, image=image)
+                for product, images in zip(created, extras)
+                for image in images
+            )
+        self.categories.update(p.category for p in created if p.category)
+        return len(created), errors
+
+    def _read_progress(self, progress_file):
+        try:
+            with open(progress_file) as handle:
+                return int(handle.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_progress(self, progress_file, done):
+        tmp = f"{progress_file}.tmp"
+        with open(tmp, "w") as handle:
+            handle.write(str(done))
+        os.replace(tmp, progress_file)
@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.utils import timezone
+
+from Shopping_App.retention import abandoned_carts, compact, purge_abandoned_carts
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete unpaid carts idle for longer than the TTL in small batches, optionally archiving "
+        "them to a gzip JSON-lines file. Safe to interrupt and rerun."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ttl-days", type=float, default=None, help="Idle days before a cart expires (default: CART_TTL_DAYS)."
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=None, help="Carts per transaction (default: CART_PURGE_BATCH_SIZE)."
+        )
+        parser.add_argument("--archive", dest="archive_path", help="Append purged carts to this .jsonl.gz file.")
+        parser.add_argument("--max-batches", type=int, default=None, help="Stop after this many batches.")
+        parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches.")
+        parser.add_argument("--dry-run", action="store_true", help="Only count the carts that would be purged.")
+        parser.add_argument("--vacuum", action="store_true", help="VACUUM the cart tables afterwards.")
+
+    def handle(self, *args, **options):
+        ttl_days = settings.CART_TTL_DAYS if options["ttl_days"] is None else options["ttl_days"]
+        batch_size = options["batch_size"] or settings.CART_PURGE_BATCH_SIZE
+        if ttl_days <= 0 or batch_size <= 0:
+            raise CommandError("--ttl-days and --batch-size must be positive.")
+        cutoff = timezone.now() - timedelta(days=ttl_days)
+
+        if options["dry_run"]:
+            totals = abandoned_carts(cutoff).aggregate(carts=Count("id", distinct=True), items=Count("items"))
+            self.stdout.write(
+                f"{totals['carts']} cart(s) with {totals['items']} item(s) idle since before "
+                f"{cutoff:%Y-%m-%d %H:%M} would be purged."
+            )
+            return
+
+        def progress(carts, items):
+            self.stdout.write(f"Purged {carts} cart(s), {items} item(s)")
+
+        report = purge_abandoned_carts(
+            cutoff,
+            batch_size=batch_size,
+            archive_path=options["archive_path"],
+            max_batches=options["max_batches"],
+            pause=options["pause"],
+            on_batch=progress if options["verbosity"] > 1 else None,
+        )
+        summary = (
+            f"Purged {report.carts} cart(s) and {report.items} item(s) in {report.batches} batch(es), "
+            f"{report.seconds:.1f}s ({report.rows_per_second:.0f} rows/s)."
+        )
+        if report.bytes_reclaimed is not None:
+            summary += f" Reclaimed ~{_mb(report.bytes_reclaimed)} of {_mb(report.bytes_before)}."
+        self.stdout.write(self.style.SUCCESS(summary))
+        if options["archive_path"] and report.carts:
+            self.stdout.write(f"Archived to {options['archive_path']}.")
+
+        if options["vacuum"]:
+            compact()
+            self.stdout.write("Vacuumed cart tables.")
+
+
+def _mb(size):
+    return f"{size / 1024 / 1024:.1f} MB"
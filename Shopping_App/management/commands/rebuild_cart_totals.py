@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+
+from Shopping_App.models import Cart
+
+
+class Command(BaseCommand):
+    help = "Recompute Cart.item_count and Cart.subtotal from cart items and report drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report drifted carts; exit with an error if any are found.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--include-paid",
+            action="store_true",
+            help="Also rebuild carts that have already been paid.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        carts = Cart.objects.all() if options["include_paid"] else Cart.objects.filter(paid=False)
+        drifted = (
+            carts.with_computed_totals()
+            .filter(
+                ~Q(item_count=F("computed_item_count")) | ~Q(subtotal=F("computed_subtotal"))
+            )
+            .only("id", "cart_code", "item_count", "subtotal")
+            .order_by("id")
+        )
+
+        fixed = 0
+        batch = []
+        for cart in drifted.iterator(chunk_size=batch_size):
+            self.stdout.write(
+                f"{cart.cart_code}: item_count {cart.item_count} -> {cart.computed_item_count}, "
+                f"subtotal {cart.subtotal} -> {cart.computed_subtotal}"
+            )
+            fixed += 1
+            if options["check"]:
+                continue
+            cart.item_count = cart.computed_item_count
+            cart.subtotal = cart.computed_subtotal
+            batch.append(cart)
+            if len(batch) >= batch_size:
+                Cart.objects.bulk_update(batch, ["item_count", "subtotal"])
+                batch = []
+        if batch:
+            Cart.objects.bulk_update(batch, ["item_count", "subtotal"])
+
+        if options["check"]:
+            if fixed:
+                raise CommandError(f"{fixed} cart(s) have drifted totals.")
+            self.stdout.write(self.style.SUCCESS("No drift detected."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt totals for {fixed} cart(s)."))
@@ -0,0 +1,107 @@
+import multiprocessing
+import signal
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from Shopping_App.jobs import job_stats, prune_done_jobs, requeue_stale_jobs, supervise, work, worker_name
+from Shopping_App.models import Job
+
+
+@contextmanager
+def stop_on_signals():
+    """Yield a should_stop() that turns true on SIGTERM or SIGINT; the current job finishes first."""
+    stopping = []
+    previous = {
+        signum: signal.signal(signum, lambda *_: stopping.append(True))
+        for signum in (signal.SIGTERM, signal.SIGINT)
+    }
+    try:
+        yield lambda: bool(stopping)
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+
+def worker_main(index, burst, poll_interval):
+    import django
+
+    # spawned children (Windows, macOS) start without Django configured
+    django.setup()
+    with stop_on_signals() as should_stop:
+        work(
+            f"{worker_name()}/{index}", burst=burst, poll_interval=poll_interval,
+            should_stop=should_stop, timeout=settings.JOB_TIMEOUT,
+        )
+
+
+class Command(BaseCommand):
+    help = "Run background job workers against the database-backed queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: JOB_WORKERS).")
+        parser.add_argument("--burst", action="store_true", help="Exit once the queue is empty.")
+        parser.add_argument("--poll-interval", type=float, default=None)
+        parser.add_argument("--retry-dead", action="store_true", help="Requeue dead jobs and exit.")
+        parser.add_argument("--stats", action="store_true", help="Print per-job counts and timings and exit.")
+        parser.add_argument("--prune-done", action="store_true", help="Delete old done jobs and exit.")
+        parser.add_argument(
+            "--retention-days", type=int, default=None, help="With --prune-done (default: JOB_RETENTION_DAYS)."
+        )
+
+    def handle(self, *args, **options):
+        if options["stats"]:
+            for row in job_stats():
+                self.stdout.write(
+                    f"{row['name']} [{row['status']}] count={row['count']} "
+                    f"avg_wait={_ms(row['avg_wait_ms'])} avg_run={_ms(row['avg_duration_ms'])} "
+                    f"max_run={_ms(row['max_duration_ms'])}"
+                )
+            return
+        if options["prune_done"]:
+            pruned = prune_done_jobs(options["retention_days"])
+            self.stdout.write(self.style.SUCCESS(f"Deleted {pruned} done job(s)."))
+            return
+        if options["retry_dead"]:
+            requeued = Job.objects.filter(status=Job.DEAD).update(
+                status=Job.QUEUED, attempts=0, run_at=timezone.now()
+            )
+            self.stdout.write(self.style.SUCCESS(f"Requeued {requeued} dead job(s)."))
+            return
+
+        workers = options["workers"] or settings.JOB_WORKERS
+        poll_interval = options["poll_interval"] or settings.JOB_POLL_INTERVAL
+        stale = requeue_stale_jobs()
+        if stale:
+            self.stdout.write(f"Requeued {stale} job(s) left running by a dead worker.")
+
+        if workers == 1:
+            with stop_on_signals() as should_stop:
+                processed = work(
+                    burst=options["burst"], poll_interval=poll_interval, should_stop=should_stop,
+                    timeout=settings.JOB_TIMEOUT, requeue_interval=settings.JOB_REQUEUE_INTERVAL,
+                )
+            self.stdout.write(self.style.SUCCESS(f"Processed {processed} job(s)."))
+            return
+
+        def spawn(index):
+            process = multiprocessing.Process(target=worker_main, args=(index, options["burst"], poll_interval))
+            process.start()
+            return process
+
+        self.stdout.write(f"Starting {workers} worker(s).")
+        with stop_on_signals() as should_stop:
+            restarts = supervise(
+                spawn, workers, burst=options["burst"], should_stop=should_stop,
+                requeue_interval=settings.JOB_REQUEUE_INTERVAL,
+                # children must not share the parent's database connections
+                before_spawn=connections.close_all,
+            )
+        self.stdout.write(f"Workers stopped after {restarts} restart(s).")
+
+
+def _ms(value):
+    return "-" if value is None else f"{value:.0f}ms"
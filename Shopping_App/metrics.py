@@ -0,0 +1,141 @@
+"""Prometheus metrics for requests, database work and outbound HTTP.
+
+`RequestMetricsMiddleware` times every request and, through a database
+execute wrapper, counts its queries and their time, labelled by the
+resolved URL name. `observe_outbound` times calls to the payment gateways
+and Cloudinary, and the cart cache counts its hits and misses here.
+`metrics_view` serves everything in the Prometheus text format; under a
+multi-process server set PROMETHEUS_MULTIPROC_DIR so the workers' samples
+are aggregated.
+"""
+import hmac
+import logging
+import os
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+# keep label cardinality bounded for 404s and other unrouted paths
+UNRESOLVED_VIEW = "<unresolved>"
+# statements kept for the slow-request log
+MAX_LOGGED_QUERIES = 50
+
+REQUEST_LATENCY = Histogram(
+    "shop_request_duration_seconds", "Wall time per request.",
+    ["view", "method", "status"], buckets=LATENCY_BUCKETS,
+)
+REQUEST_QUERIES = Histogram(
+    "shop_request_db_queries", "Database queries per request.",
+    ["view"], buckets=QUERY_COUNT_BUCKETS,
+)
+REQUEST_DB_TIME = Histogram(
+    "shop_request_db_duration_seconds", "Time spent in database queries per request.",
+    ["view"], buckets=LATENCY_BUCKETS,
+)
+OUTBOUND_LATENCY = Histogram(
+    "shop_outbound_http_duration_seconds", "Time per outbound call to an external service.",
+    ["service", "outcome"], buckets=LATENCY_BUCKETS,
+)
+# hit ratio: rate(...{result="hit"}) / rate(...)
+CART_CACHE_LOOKUPS = Counter(
+    "shop_cart_cache_lookups", "Cart cache lookups by payload kind and result.",
+    ["kind", "result"],
+)
+
+
+class QueryRecorder:
+    """Database execute wrapper that counts and times queries, optionally keeping the SQL."""
+
+    def __init__(self, capture_sql=False):
+        self.count = 0
+        self.duration = 0.0
+        self.capture_sql = capture_sql
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            if self.capture_sql and len(self.statements) < MAX_LOGGED_QUERIES:
+                self.statements.append((elapsed, sql))
+
+
+class RequestMetricsMiddleware:
+    """Records wall time, query count and query time per resolved URL name.
+
+    Queries run while a StreamingHttpResponse is consumed happen after this
+    middleware returns and are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        slow_ms = settings.SLOW_REQUEST_LOG_MS
+        recorder = QueryRecorder(capture_sql=slow_ms > 0)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, "resolver_match", None)
+        view = (match.view_name if match else None) or UNRESOLVED_VIEW
+        REQUEST_LATENCY.labels(view, request.method, str(response.status_code)).observe(elapsed)
+        REQUEST_QUERIES.labels(view).observe(recorder.count)
+        REQUEST_DB_TIME.labels(view).observe(recorder.duration)
+
+        if slow_ms > 0 and elapsed * 1000 >= slow_ms:
+            logger.warning(
+                "Slow request %s %s (%s): %.0fms, %s queries in %.0fms\n%s",
+                request.method, request.get_full_path(), view, elapsed * 1000,
+                recorder.count, recorder.duration * 1000,
+                "\n".join(f"  [{t * 1000:.1f}ms] {sql}" for t, sql in recorder.statements),
+            )
+        return response
+
+
+@contextmanager
+def observe_outbound(service):
+    """Time an outbound call. Set `.status_code` on the yielded dict to label the outcome."""
+    result = {"status_code": None}
+    started = time.perf_counter()
+    try:
+        yield result
+    except Exception:
+        OUTBOUND_LATENCY.labels(service, "error").observe(time.perf_counter() - started)
+        raise
+    status_code = result["status_code"]
+    outcome = f"{status_code // 100}xx" if status_code else "ok"
+    OUTBOUND_LATENCY.labels(service, outcome).observe(time.perf_counter() - started)
+
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if not token:
+        # open only in development; production needs METRICS_TOKEN
+        if not settings.DEBUG:
+            return HttpResponse(status=404)
+    elif not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return HttpResponse(status=401)
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
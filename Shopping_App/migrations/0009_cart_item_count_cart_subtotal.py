@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:30
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_cart_totals(apps, schema_editor):
+    Cart = apps.get_model('Shopping_App', 'Cart')
+    carts = Cart.objects.annotate(
+        real_count=Coalesce(Sum('items__quantity'), 0),
+        real_subtotal=Coalesce(
+            Sum(F('items__quantity') * F('items__product__price')),
+            Value(0),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+    )
+    batch = []
+    for cart in carts.iterator(chunk_size=1000):
+        cart.item_count = cart.real_count
+        cart.subtotal = cart.real_subtotal
+        batch.append(cart)
+        if len(batch) >= 1000:
+            Cart.objects.bulk_update(batch, ['item_count', 'subtotal'])
+            batch = []
+    if batch:
+        Cart.objects.bulk_update(batch, ['item_count', 'subtotal'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shopping_App', '0008_alter_productimage_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_cart_totals, migrations.RunPython.noop),
+    ]
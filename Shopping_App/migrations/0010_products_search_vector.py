@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:42
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # GIN indexes and tsvector backfills are Postgres-only; SQLite keeps the
+    # plain column and searches through the in-process index instead.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS shopping_app_products_search_gin "
+        'ON "Shopping_App_products" USING gin (search_vector)'
+    )
+    schema_editor.execute(
+        'UPDATE "Shopping_App_products" SET search_vector = '
+        "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(category, '')), 'B') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'C')"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS shopping_app_products_search_gin")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shopping_App', '0009_cart_item_count_cart_subtotal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='products',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shopping_App', '0010_products_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='products',
+            index=models.Index(fields=['price', 'id'], name='products_price_id_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:35
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def dedupe_slugs(apps, schema_editor):
+    # Earlier saves could race to the same slug; give every duplicate after
+    # the first a free numeric suffix so the unique index can be built.
+    Products = apps.get_model('Shopping_App', 'Products')
+    Products.objects.filter(slug='').update(slug=None)
+    duplicated = (
+        Products.objects.exclude(slug=None)
+        .values('slug')
+        .annotate(n=Count('id'))
+        .filter(n__gt=1)
+        .values_list('slug', flat=True)
+    )
+    taken = set(Products.objects.exclude(slug=None).values_list('slug', flat=True))
+    for slug in list(duplicated):
+        counter = 1
+        for product in Products.objects.filter(slug=slug).order_by('id')[1:]:
+            while f"{slug}-{counter}" in taken:
+                counter += 1
+            product.slug = f"{slug}-{counter}"
+            taken.add(product.slug)
+            product.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shopping_App', '0011_products_price_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='products',
+            name='slug',
+            field=models.SlugField(blank=True, max_length=120, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:36
+
+import cloudinary.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shopping_App', '0012_products_unique_slug'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending upload'), ('ready', 'Ready'), ('failed', 'Upload failed')], default='ready', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=cloudinary.models.CloudinaryField(blank=True, max_length=255, null=True, verbose_name='image'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:38
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    # Racing get_or_create calls could leave two lines for one product;
+    # fold them into the oldest line before adding the constraint.
+    CartItem = apps.get_model('Shopping_App', 'CartItem')
+    duplicates = (
+        CartItem.objects.values('cart_id', 'product_id')
+        .annotate(n=Count('id'), keep=Min('id'), total=Sum('quantity'))
+        .filter(n__gt=1)
+    )
+    for row in duplicates:
+        CartItem.objects.filter(id=row['keep']).update(quantity=row['total'])
+        CartItem.objects.filter(
+            cart_id=row['cart_id'], product_id=row['product_id']
+        ).exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shopping_App', '0013_productimage_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shopping_App', '0014_cartitem_unique_cart_product'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['user', 'paid'], name='cart_user_paid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(condition=models.Q(('paid', False)), fields=['modified_at'], name='cart_unpaid_modified_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='products',
+            index=models.Index(fields=['category', 'id'], name='products_category_id_idx'),
+        ),
+    ]
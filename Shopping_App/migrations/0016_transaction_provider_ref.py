@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:48
+
+from django.db import migrations, models
+
+
+def normalize_status(apps, schema_editor):
+    # Flutterwave confirmations used to be stored as "Completed"
+    Transaction = apps.get_model('Shopping_App', 'Transaction')
+    Transaction.objects.filter(status='Completed').update(status='completed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shopping_App', '0015_query_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_status, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='transaction',
+            name='provider_ref',
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:11
+
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shopping_App', '0017_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.UUIDField(default=uuid.uuid4)),
+                ('modified_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:31
+
+import Shopping_App.search
+from django.db import migrations
+
+# 0010 created the GIN index with raw SQL, under a name longer than
+# Meta.indexes allows; on Postgres it is renamed rather than rebuilt.
+LEGACY_INDEX = "shopping_app_products_search_gin"
+
+
+def search_index():
+    return Shopping_App.search.SearchVectorIndex(fields=['search_vector'], name='products_search_gin')
+
+
+def adopt_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [LEGACY_INDEX])
+            legacy_exists = cursor.fetchone()[0] is not None
+        if legacy_exists:
+            schema_editor.execute(f"ALTER INDEX {LEGACY_INDEX} RENAME TO products_search_gin")
+            return
+    schema_editor.add_index(apps.get_model('Shopping_App', 'Products'), search_index())
+
+
+def release_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f"ALTER INDEX products_search_gin RENAME TO {LEGACY_INDEX}")
+        return
+    schema_editor.remove_index(apps.get_model('Shopping_App', 'Products'), search_index())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shopping_App', '0019_imageupload'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='products', index=search_index()),
+            ],
+            database_operations=[
+                migrations.RunPython(adopt_search_index, release_search_index),
+            ],
+        ),
+    ]
@@ -1,8 +1,96 @@
-from django.db import models
+import re
+import uuid
+
+from django.db import IntegrityError, models, router, transaction
+from django.db.models.functions import Cast, Coalesce, Substr
 from django.utils.text import slugify
 from django.conf import settings
+from django.utils import timezone
+from django.contrib.postgres.search import SearchVectorField
 from cloudinary.models import CloudinaryField
 
+from .search import (
+    SEARCH_FIELD_WEIGHTS, SearchVectorIndex, product_search_document, product_search_vector,
+    uses_postgres_search,
+)
+
+SLUG_MAX_LENGTH = 120
+# leave room for a "-<n>" suffix when the base slug is already taken
+SLUG_BASE_MAX_LENGTH = SLUG_MAX_LENGTH - 10
+# longer numeric tails ("watch-20240101123456") are part of a product's name,
+# not a suffix we allocated, and would overflow the integer cast
+SLUG_SUFFIX_MAX_DIGITS = 9
+SLUG_ALLOCATION_RETRIES = 5
+
+
+def base_slug_for(name):
+    return slugify(name)[:SLUG_BASE_MAX_LENGTH].strip("-") or "product"
+
+
+class ProductsQuerySet(models.QuerySet):
+    def refresh_search_vector(self):
+        # tsvector columns only exist in a meaningful form on Postgres; other
+        # backends are served by the in-process index in search.py.
+        if uses_postgres_search(self.db):
+            self.update(search_vector=product_search_vector())
+
+    def next_slug_suffix(self, base):
+        """Return (base_taken, highest_suffix) for `base` in a single query."""
+        suffix = models.Case(
+            models.When(slug=base, then=models.Value(0)),
+            default=Cast(Substr("slug", len(base) + 2), models.IntegerField()),
+        )
+        pattern = rf"^{re.escape(base)}(-[0-9]{{1,{SLUG_SUFFIX_MAX_DIGITS}}})?$"
+        result = self.filter(slug__startswith=base, slug__regex=pattern).aggregate(
+            base_taken=models.Count("id", filter=models.Q(slug=base)),
+            highest=models.Max(suffix),
+        )
+        return bool(result["base_taken"]), result["highest"] or 0
+
+    def allocate_slugs(self, names):
+        """Unique slugs for `names`, one query per distinct base slug."""
+        bases = [base_slug_for(name) for name in names]
+        next_free = {}
+        slugs = []
+        for base in bases:
+            if base not in next_free:
+                base_taken, highest = self.next_slug_suffix(base)
+                next_free[base] = highest + 1 if base_taken else 0
+            suffix = next_free[base]
+            slugs.append(f"{base}-{suffix}" if suffix else base)
+            next_free[base] = suffix + 1
+        return slugs
+
+    def bulk_create_with_slugs(self, products, batch_size=None, invalidate_caches=True):
+        """bulk_create that fills missing slugs, retrying when a concurrent writer wins.
+
+        Callers inserting many batches can pass `invalidate_caches=False` and
+        bump the catalog caches once when done.
+        """
+        from .cache import bump_catalog_version, invalidate_products
+        from .search import product_index
+
+        pending = [p for p in products if not p.slug]
+        for attempt in range(SLUG_ALLOCATION_RETRIES):
+            for product, slug in zip(pending, self.allocate_slugs([p.name for p in pending])):
+                product.slug = slug
+            try:
+                with transaction.atomic(using=self.db):
+                    created = self.bulk_create(products, batch_size=batch_size)
+                break
+            except IntegrityError:
+                if not pending or attempt == SLUG_ALLOCATION_RETRIES - 1:
+                    raise
+
+        # bulk_create bypasses save() and the model signals
+        self.filter(pk__in=[p.pk for p in created]).refresh_search_vector()
+        product_index.invalidate()
+        if invalidate_caches:
+            bump_catalog_version()
+            invalidate_products(categories={p.category for p in created if p.category})
+        return created
+
+
 class Products(models.Model):
     CATEGORY = [
         ("ELECTRONICS", "Electronics"),
@@ -15,25 +103,66 @@ class Products(models.Model):
     ]
 
     name = models.CharField(max_length=100)
-    slug = models.SlugField(blank=True, null=True)
+    slug = models.SlugField(max_length=SLUG_MAX_LENGTH, unique=True, blank=True, null=True)
     image = CloudinaryField('image', blank=True, null=True)
     description = models.TextField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     category = models.CharField(max_length=15, choices=CATEGORY, blank=True, null=True)
+    # Precomputed full-text document, GIN-indexed on Postgres; written by
+    # save() and refresh_search_vector(), left empty on other databases.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ProductsQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # serves price-ordered cursor pages (price >= cursor ORDER BY price, id)
+            models.Index(fields=["price", "id"], name="products_price_id_idx"),
+            # similar products: first ids within a category
+            models.Index(fields=["category", "id"], name="products_category_id_idx"),
+            SearchVectorIndex(fields=["search_vector"], name="products_search_gin"),
+        ]
 
     def __str__(self):
         return self.name
 
     def save(self, *args, **kwargs):
-        if not self.slug:
-            base_slug = slugify(self.name)
-            unique_slug = base_slug
-            counter = 1
-            while Products.objects.filter(slug=unique_slug).exists():
-                unique_slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = unique_slug
-        super().save(*args, **kwargs)
+        document = self._set_search_document(kwargs)
+        if self.slug:
+            super().save(*args, **kwargs)
+        else:
+            self._save_with_new_slug(*args, **kwargs)
+        if document:
+            # the column now holds the computed document; load it on access
+            del self.search_vector
+
+    def _set_search_document(self, kwargs):
+        """Compute the search document into this save's write, on Postgres only."""
+        using = kwargs.get("using") or router.db_for_write(Products, instance=self)
+        if not uses_postgres_search(using):
+            return False
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            if not {field for field, _ in SEARCH_FIELD_WEIGHTS} & set(update_fields):
+                return False
+            kwargs["update_fields"] = {*update_fields, "search_vector"}
+        self.search_vector = product_search_document(self)
+        return True
+
+    def _save_with_new_slug(self, *args, **kwargs):
+        # The unique index settles races between concurrent saves of the same
+        # name; the loser allocates again and retries.
+        for attempt in range(SLUG_ALLOCATION_RETRIES):
+            self.slug = Products.objects.allocate_slugs([self.name])[0]
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                slug_conflict = Products.objects.filter(slug=self.slug).exclude(pk=self.pk).exists()
+                self.slug = None
+                if not slug_conflict or attempt == SLUG_ALLOCATION_RETRIES - 1:
+                    raise
 
     @property
     def formatted_price(self):
@@ -41,15 +170,81 @@ class Products(models.Model):
 
 
 class ProductImage(models.Model):
+    PENDING = "pending"
+    READY = "ready"
+    FAILED = "failed"
+    STATUS = [
+        (PENDING, "Pending upload"),
+        (READY, "Ready"),
+        (FAILED, "Upload failed"),
+    ]
+
     product = models.ForeignKey(
         Products, on_delete=models.CASCADE, related_name='extra_images'
     )
-    image = CloudinaryField('image')
+    # empty until a pending upload finishes
+    image = CloudinaryField('image', blank=True, null=True)
+    status = models.CharField(max_length=10, choices=STATUS, default=READY)
 
     def __str__(self):
         return f"Extra Image for {self.product.name}"
 
 
+class ImageUpload(models.Model):
+    """The file of a pending ProductImage, kept until its upload job runs.
+
+    Stored in the database because the job worker may run on another
+    machine than the web process that received the file.
+    """
+
+    image = models.OneToOneField(ProductImage, on_delete=models.CASCADE, related_name="upload")
+    name = models.CharField(max_length=255)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class CartQuerySet(models.QuerySet):
+    def with_items(self):
+        # Load items -> product -> extra_images in a fixed number of queries
+        # so cart serialization does not scale with the number of lines.
+        return self.prefetch_related(
+            models.Prefetch(
+                "items",
+                queryset=CartItem.objects.select_related("product")
+                .prefetch_related("product__extra_images")
+                .order_by("id"),
+            )
+        )
+
+    def paid_orders(self, user):
+        # A user's paid carts, newest first, with lines and the settling
+        # payment loaded up front for order history.
+        return (
+            self.filter(user=user, paid=True)
+            .order_by("-modified_at", "-id")
+            .with_items()
+            .prefetch_related(
+                models.Prefetch(
+                    "transactions",
+                    queryset=Transaction.objects.filter(status=Transaction.COMPLETED).order_by("-created_at"),
+                    to_attr="completed_transactions",
+                )
+            )
+        )
+
+    def with_computed_totals(self):
+        # Totals derived from CartItem rows, used to rebuild and audit the
+        # denormalized item_count/subtotal columns.
+        return self.annotate(
+            computed_item_count=Coalesce(models.Sum("items__quantity"), 0),
+            computed_subtotal=Coalesce(
+                models.Sum(models.F("items__quantity") * models.F("items__product__price")),
+                models.Value(0),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+
+
 class Cart(models.Model):
     cart_code = models.CharField(max_length=11, unique=True)
     user = models.ForeignKey(
@@ -59,29 +254,72 @@ class Cart(models.Model):
         null=True
     )
     paid = models.BooleanField(default=False)
+    # Denormalized totals, kept in step with CartItem rows by the cart views.
+    # `manage.py rebuild_cart_totals` recomputes them and reports drift.
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
 
+    objects = CartQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # purchase history and a user's open carts
+            models.Index(fields=["user", "paid"], name="cart_user_paid_idx"),
+            # idle unpaid carts, oldest first; paid carts never enter the index
+            models.Index(
+                fields=["modified_at"],
+                condition=models.Q(paid=False),
+                name="cart_unpaid_modified_idx",
+            ),
+        ]
+
     def __str__(self):
         return self.cart_code
 
+    def adjust_totals(self, quantity_delta, amount_delta):
+        """Atomically shift the stored totals without a read-modify-write."""
+        Cart.objects.filter(pk=self.pk).update(
+            item_count=models.F("item_count") + quantity_delta,
+            subtotal=models.F("subtotal") + amount_delta,
+            modified_at=timezone.now(),
+        )
+
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Products, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            # one line per product; add_item upserts against it
+            models.UniqueConstraint(fields=["cart", "product"], name="unique_cart_product"),
+        ]
+
     def __str__(self):
         return f"{self.quantity} x {self.product.name} in cart {self.cart.id}"
 
 
 class Transaction(models.Model):
+    PENDING = "pending"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    STATUS = [
+        (PENDING, "Pending"),
+        (COMPLETED, "Completed"),
+        (FAILED, "Failed"),
+    ]
+
     ref = models.CharField(max_length=225, unique=True)
+    # the gateway's own id for the payment (PayPal payment id), used by webhooks
+    provider_ref = models.CharField(max_length=255, blank=True, null=True, db_index=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     cart = models.ForeignKey('Cart', on_delete=models.CASCADE, related_name='transactions')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=10, default='NGN')
-    status = models.CharField(max_length=20, default='pending')
+    status = models.CharField(max_length=20, choices=STATUS, default=PENDING)
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
 
@@ -92,3 +330,57 @@ class Transaction(models.Model):
     def formatted_amount(self):
         """Returns amount with comma formatting, e.g., 67,000,000.00"""
         return "{:,.2f}".format(self.amount)
+
+
+class Job(models.Model):
+    """A unit of background work, claimed and run by `manage.py run_workers`."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    DEAD = "dead"
+    STATUS = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (DEAD, "Dead (retries exhausted)"),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, null=True)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    # timings of the latest attempt, in milliseconds
+    wait_ms = models.PositiveIntegerField(blank=True, null=True)
+    duration_ms = models.PositiveIntegerField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_at"], name="job_status_run_at_idx"),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} {self.name} - {self.status}"
+
+
+class CatalogVersion(models.Model):
+    """Single row naming the current state of the catalog.
+
+    Replaced whenever products or their images change. The catalog ETag and
+    Last-Modified are read from it, so every process agrees on them.
+    """
+
+    SINGLETON_ID = 1
+
+    token = models.UUIDField(default=uuid.uuid4)
+    modified_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Catalog {self.token.hex} at {self.modified_at}"
@@ -0,0 +1,284 @@
+"""HTTP clients for the payment gateways.
+
+Every client keeps one pooled keep-alive session, applies connect/read
+timeouts to every call, retries transient failures with exponential backoff
+and trips a circuit breaker when the gateway keeps failing, so a slow or
+down provider fails fast instead of pinning request workers.
+"""
+import threading
+import time
+from functools import lru_cache
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from .metrics import observe_outbound
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+class PaymentGatewayError(Exception):
+    pass
+
+
+class GatewayUnavailable(PaymentGatewayError):
+    """The gateway timed out, kept failing, or its circuit breaker is open."""
+
+
+def never_sent(exc):
+    """True if the request failed before a connection to the gateway existed.
+
+    Only then is it safe to resend a POST: a reset or disconnect after the
+    connection was made may come after the gateway acted on the request.
+    """
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    if not isinstance(exc, requests.ConnectionError) or isinstance(exc, requests.Timeout):
+        return False
+    # requests wraps urllib3's MaxRetryError, whose `reason` is the cause;
+    # refused connections and DNS failures are NewConnectionErrors
+    cause = exc.args[0] if exc.args else None
+    return isinstance(getattr(cause, "reason", cause), NewConnectionError)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_started_at = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if self.clock() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """Closed circuits let calls through, open ones do not, and a half-open
+        one admits a single trial call until that call's outcome is recorded."""
+        with self._lock:
+            state = self._state()
+            if state != "half-open":
+                return state == "closed"
+            now = self.clock()
+            # a trial that never reported back (e.g. its caller crashed) expires
+            if self._trial_started_at is not None and now - self._trial_started_at < self.reset_timeout:
+                return False
+            self._trial_started_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_started_at = None
+            # a failed trial call in half-open re-opens immediately
+            if self._failures >= self.failure_threshold or self._opened_at is not None:
+                self._opened_at = self.clock()
+
+
+class GatewayClient:
+    name = "gateway"
+
+    def __init__(self, base_url, connect_timeout=3.05, read_timeout=10.0, max_retries=2,
+                 backoff=0.3, breaker=None, pool_size=10):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def auth_headers(self):
+        return {}
+
+    def request(self, method, path, authenticate=True, **kwargs):
+        """Send a request and return the `requests.Response`.
+
+        Failures to connect (connect timeouts, refused connections, DNS
+        errors) are retried for any method, since nothing was sent. Every
+        other failure (read timeouts, resets, dropped connections, 5xx) is
+        retried only for idempotent methods, so a payment is never created
+        twice.
+        `authenticate=False` skips `auth_headers()` (used to fetch tokens).
+        """
+        method = method.upper()
+        if not self.breaker.allow():
+            raise GatewayUnavailable(f"{self.name} circuit is open")
+
+        headers = {**(self.auth_headers() if authenticate else {}), **kwargs.pop("headers", {})}
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.max_retries + 1):
+            retry_allowed = attempt < self.max_retries
+            try:
+                with observe_outbound(self.name) as outcome:
+                    response = self.session.request(method, url, headers=headers, timeout=self.timeout, **kwargs)
+                    outcome["status_code"] = response.status_code
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                self.breaker.record_failure()
+                if retry_allowed and (never_sent(exc) or method in IDEMPOTENT_METHODS) and self.breaker.allow():
+                    self._sleep(attempt)
+                    continue
+                raise GatewayUnavailable(f"{self.name} request failed: {exc}") from exc
+
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+                if retry_allowed and method in IDEMPOTENT_METHODS and self.breaker.allow():
+                    self._sleep(attempt)
+                    continue
+            else:
+                self.breaker.record_success()
+            return response
+
+    async def arequest(self, method, path, **kwargs):
+        # requests is blocking; run it off the event loop so ASGI views stay responsive
+        return await sync_to_async(self.request, thread_sensitive=False)(method, path, **kwargs)
+
+    def _sleep(self, attempt):
+        time.sleep(self.backoff * (2 ** attempt))
+
+
+class FlutterwaveClient(GatewayClient):
+    name = "flutterwave"
+
+    def __init__(self, secret_key, **kwargs):
+        super().__init__(**kwargs)
+        self.secret_key = secret_key
+
+    def auth_headers(self):
+        return {"Authorization": f"Bearer {self.secret_key}"}
+
+    def create_payment(self, payload):
+        return self.request("POST", "/v3/payments", json=payload)
+
+    def verify_transaction(self, transaction_id):
+        return self.request("GET", f"/v3/transactions/{transaction_id}/verify")
+
+    async def acreate_payment(self, payload):
+        return await self.arequest("POST", "/v3/payments", json=payload)
+
+    async def averify_transaction(self, transaction_id):
+        return await self.arequest("GET", f"/v3/transactions/{transaction_id}/verify")
+
+
+class PayPalClient(GatewayClient):
+    """PayPal REST (v1 payments) over the pooled session, replacing paypalrestsdk."""
+
+    name = "paypal"
+
+    def __init__(self, client_id, secret, **kwargs):
+        super().__init__(**kwargs)
+        self.client_id = client_id
+        self.secret = secret
+        self._token = None
+        self._token_expires = 0.0
+        self._token_lock = threading.Lock()
+
+    def auth_headers(self):
+        return {"Authorization": f"Bearer {self.access_token()}"}
+
+    def access_token(self):
+        with self._token_lock:
+            if self._token is None or time.monotonic() >= self._token_expires:
+                response = self.request(
+                    "POST",
+                    "/v1/oauth2/token",
+                    authenticate=False,
+                    auth=(self.client_id, self.secret),
+                    data={"grant_type": "client_credentials"},
+                    headers={"Accept": "application/json"},
+                )
+                if response.status_code != 200:
+                    raise PaymentGatewayError(f"PayPal authentication failed ({response.status_code})")
+                data = response.json()
+                self._token = data["access_token"]
+                # refresh a minute early
+                self._token_expires = time.monotonic() + max(int(data.get("expires_in", 0)) - 60, 0)
+            return self._token
+
+    def create_payment(self, body):
+        return self.request("POST", "/v1/payments/payment", json=body)
+
+    def get_payment(self, payment_id):
+        return self.request("GET", f"/v1/payments/payment/{payment_id}")
+
+    def execute_payment(self, payment_id, payer_id):
+        return self.request("POST", f"/v1/payments/payment/{payment_id}/execute", json={"payer_id": payer_id})
+
+    def verify_webhook_signature(self, webhook_id, headers, event):
+        """Ask PayPal whether a webhook delivery is genuine; True if it is."""
+        response = self.request("POST", "/v1/notifications/verify-webhook-signature", json={
+            "auth_algo": headers.get("PAYPAL-AUTH-ALGO"),
+            "cert_url": headers.get("PAYPAL-CERT-URL"),
+            "transmission_id": headers.get("PAYPAL-TRANSMISSION-ID"),
+            "transmission_sig": headers.get("PAYPAL-TRANSMISSION-SIG"),
+            "transmission_time": headers.get("PAYPAL-TRANSMISSION-TIME"),
+            "webhook_id": webhook_id,
+            "webhook_event": event,
+        })
+        return response.status_code == 200 and response.json().get("verification_status") == "SUCCESS"
+
+    async def acreate_payment(self, body):
+        return await self.arequest("POST", "/v1/payments/payment", json=body)
+
+    async def aexecute_payment(self, payment_id, payer_id):
+        return await self.arequest(
+            "POST", f"/v1/payments/payment/{payment_id}/execute", json={"payer_id": payer_id}
+        )
+
+
+def _client_options():
+    return {
+        "connect_timeout": settings.PAYMENT_CONNECT_TIMEOUT,
+        "read_timeout": settings.PAYMENT_READ_TIMEOUT,
+        "max_retries": settings.PAYMENT_MAX_RETRIES,
+        "backoff": settings.PAYMENT_RETRY_BACKOFF,
+    }
+
+
+def _breaker():
+    return CircuitBreaker(settings.PAYMENT_BREAKER_THRESHOLD, settings.PAYMENT_BREAKER_RESET_TIMEOUT)
+
+
+@lru_cache(maxsize=None)
+def _flutterwave_client(base_url, secret_key, options):
+    return FlutterwaveClient(secret_key, base_url=base_url, breaker=_breaker(), **dict(options))
+
+
+@lru_cache(maxsize=None)
+def _paypal_client(base_url, client_id, secret, options):
+    return PayPalClient(client_id, secret, base_url=base_url, breaker=_breaker(), **dict(options))
+
+
+def flutterwave_client():
+    """Shared client for the configured Flutterwave account (one pool per process)."""
+    options = tuple(sorted(_client_options().items()))
+    return _flutterwave_client(settings.FLUTTERWAVE_BASE_URL, settings.FLUTTERWAVE_SECRET_KEY, options)
+
+
+def paypal_client():
+    options = tuple(sorted(_client_options().items()))
+    return _paypal_client(
+        settings.PAYPAL_BASE_URL, settings.PAYPAL_CLIENT_ID, settings.PAYPAL_SECRET_KEY, options
+    )
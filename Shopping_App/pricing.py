@@ -0,0 +1,47 @@
+from decimal import Decimal
+from typing import NamedTuple
+
+from django.db.models import DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .constants import TAX_BY_CURRENCY
+from .models import CartItem
+
+
+class CartPrice(NamedTuple):
+    subtotal: Decimal
+    tax: Decimal
+    total: Decimal
+    currency: str
+
+
+def cart_subtotal(cart):
+    """Sum of quantity * price over the cart's lines.
+
+    Uses the prefetched items when the caller already loaded them (as the
+    cart views do), otherwise one aggregate query.
+    """
+    prefetched = getattr(cart, "_prefetched_objects_cache", {}).get("items")
+    if prefetched is not None:
+        return sum((item.product.price * item.quantity for item in prefetched), Decimal("0.00"))
+    return CartItem.objects.filter(cart=cart).aggregate(
+        subtotal=Coalesce(
+            Sum(F("quantity") * F("product__price")),
+            Value(Decimal("0.00")),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+    )["subtotal"]
+
+
+def tax_for(currency):
+    try:
+        return TAX_BY_CURRENCY[currency]
+    except KeyError:
+        raise ValueError(f"No tax configured for currency {currency!r}")
+
+
+def price_cart(cart, currency):
+    """Subtotal, tax and total to charge for `cart` in `currency`."""
+    subtotal = cart_subtotal(cart)
+    tax = tax_for(currency)
+    return CartPrice(subtotal, tax, subtotal + tax, currency)
@@ -0,0 +1,153 @@
+"""Expiry of abandoned carts.
+
+Every visitor who adds an item gets a Cart row, and unpaid carts are never
+used again once the visitor leaves. `purge_abandoned_carts` deletes unpaid
+carts idle for longer than a TTL in small batches, each in its own short
+transaction, walking the partial `cart_unpaid_modified_idx` oldest first.
+An interrupted run loses nothing: committed batches are gone and the next
+run starts from the oldest cart left.
+
+Carts with a transaction are kept whatever their age; they are payment
+records. With an archive path each batch is appended to a gzip JSON-lines
+file as its own gzip member, written before the batch is deleted, so the
+archive holds every purged cart at least once.
+"""
+import gzip
+import json
+import time
+from typing import NamedTuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connections, router, transaction
+from django.db.models import Exists, OuterRef
+
+from .models import Cart, CartItem, Transaction
+
+
+class PurgeReport(NamedTuple):
+    carts: int
+    items: int
+    batches: int
+    seconds: float
+    bytes_before: int | None
+    bytes_reclaimed: int | None
+
+    @property
+    def rows_per_second(self):
+        return (self.carts + self.items) / self.seconds if self.seconds else 0.0
+
+
+def abandoned_carts(cutoff):
+    """Unpaid carts last modified before `cutoff` that never reached payment."""
+    return Cart.objects.filter(paid=False, modified_at__lt=cutoff).exclude(
+        Exists(Transaction.objects.filter(cart=OuterRef("pk")))
+    )
+
+
+def table_stats(connection, model):
+    """(bytes on disk including indexes, row estimate) for `model`'s table, or (None, None)."""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                "SELECT pg_total_relation_size(oid), reltuples FROM pg_class WHERE oid = %s::regclass",
+                [connection.ops.quote_name(table)],
+            )
+            size, rows = cursor.fetchone()
+            return size, max(int(rows), 0)
+        if connection.vendor == "sqlite":
+            try:
+                cursor.execute(
+                    "SELECT SUM(pgsize) FROM dbstat"
+                    " WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name = %s)",
+                    [table],
+                )
+            except DatabaseError:
+                # SQLite built without the dbstat virtual table
+                return None, None
+            size = cursor.fetchone()[0] or 0
+            cursor.execute("SELECT COUNT(*) FROM %s" % connection.ops.quote_name(table))
+            return size, cursor.fetchone()[0]
+    return None, None
+
+
+def _archive(path, carts, items):
+    lines_by_cart = {}
+    for cart_id, product_id, quantity in items:
+        lines_by_cart.setdefault(cart_id, []).append({"product_id": product_id, "quantity": quantity})
+    # one gzip member per batch; concatenated members read back as one stream
+    with gzip.open(path, "at", encoding="utf-8") as archive:
+        for cart in carts:
+            cart["items"] = lines_by_cart.get(cart.pop("id"), [])
+            archive.write(json.dumps(cart, cls=DjangoJSONEncoder) + "\n")
+
+
+def purge_batch(cutoff, batch_size, archive_path=None):
+    """Archive and delete up to `batch_size` abandoned carts. Returns (carts, items) deleted."""
+    with transaction.atomic():
+        ids = list(
+            abandoned_carts(cutoff)
+            .select_for_update(skip_locked=True)
+            .order_by("modified_at", "id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            return 0, 0
+        if archive_path:
+            carts = list(
+                Cart.objects.filter(id__in=ids).values(
+                    "id", "cart_code", "user_id", "item_count", "subtotal", "created_at", "modified_at"
+                )
+            )
+            items = CartItem.objects.filter(cart_id__in=ids).values_list("cart_id", "product_id", "quantity")
+            _archive(archive_path, carts, items)
+        _, deleted = Cart.objects.filter(id__in=ids).delete()
+    return deleted.get(Cart._meta.label, 0), deleted.get(CartItem._meta.label, 0)
+
+
+def purge_abandoned_carts(cutoff, batch_size=500, archive_path=None, max_batches=None, pause=0.0,
+                          on_batch=None):
+    """Purge abandoned carts in batches until none are left or `max_batches` ran.
+
+    `pause` sleeps between batches to leave room for other writers;
+    `on_batch(carts, items)` is called after each committed batch.
+    """
+    connection = connections[router.db_for_write(Cart)]
+    before = [table_stats(connection, model) for model in (Cart, CartItem)]
+
+    carts = items = batches = 0
+    started = time.perf_counter()
+    while max_batches is None or batches < max_batches:
+        batch_carts, batch_items = purge_batch(cutoff, batch_size, archive_path)
+        if not batch_carts:
+            break
+        carts += batch_carts
+        items += batch_items
+        batches += 1
+        if on_batch:
+            on_batch(batch_carts, batch_items)
+        if pause:
+            time.sleep(pause)
+    seconds = time.perf_counter() - started
+
+    bytes_before = bytes_reclaimed = None
+    if all(size is not None for size, _ in before):
+        bytes_before = sum(size for size, _ in before)
+        # deleted rows are freed for reuse rather than returned to the OS, so
+        # estimate from each table's average row size (indexes included)
+        bytes_reclaimed = sum(
+            int(size * min(deleted / rows, 1)) if rows else 0
+            for (size, rows), deleted in zip(before, (carts, items))
+        )
+    return PurgeReport(carts, items, batches, seconds, bytes_before, bytes_reclaimed)
+
+
+def compact(models=(Cart, CartItem)):
+    """Run VACUUM so freed pages are returned (SQLite) or marked reusable (PostgreSQL)."""
+    connection = connections[router.db_for_write(Cart)]
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            for model in models:
+                cursor.execute("VACUUM (ANALYZE) %s" % connection.ops.quote_name(model._meta.db_table))
+        elif connection.vendor == "sqlite":
+            cursor.execute("VACUUM")
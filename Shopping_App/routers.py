@@ -0,0 +1,190 @@
+"""Send catalog and cart reads to read replicas.
+
+Replicas are the aliases in settings.DATABASE_REPLICAS (built from
+DATABASE_REPLICA_URLS). Reads of the replicated models go to a healthy
+replica unless the request must see its own writes:
+
+* anything inside a transaction on the primary, or after this request
+  wrote to the primary, reads from the primary;
+* a client (cart code or bearer token) that wrote recently is pinned to
+  the primary for REPLICA_STICKY_SECONDS, so the next page load sees the
+  item it just added. Pins live in the REPLICA_PIN_CACHE_ALIAS cache, which
+  must be shared by every web worker (a system check enforces it): the
+  next request may land on another process.
+
+Replica health and lag are checked at most every
+REPLICA_HEALTH_CHECK_INTERVAL seconds; a replica that errors or lags more
+than REPLICA_MAX_LAG_SECONDS is skipped until the next check.
+"""
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+REPLICATED_MODELS = {
+    "Shopping_App.Products",
+    "Shopping_App.ProductImage",
+    "Shopping_App.Cart",
+    "Shopping_App.CartItem",
+}
+PIN_KEY = "replica-pin:{}"
+
+_pinned = ContextVar("replica_pinned", default=False)
+_wrote = ContextVar("replica_wrote", default=False)
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+def measure_lag(connection):
+    """Seconds the replica is behind its primary (0 when not measurable)."""
+    if connection.vendor != "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT CASE"
+            " WHEN NOT pg_is_in_recovery() THEN 0"
+            " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+            " ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+            " END"
+        )
+        return float(cursor.fetchone()[0])
+
+
+def replica_is_healthy(alias):
+    now = time.monotonic()
+    with _health_lock:
+        checked_at, healthy = _health.get(alias, (None, False))
+        if checked_at is not None and now - checked_at < settings.REPLICA_HEALTH_CHECK_INTERVAL:
+            return healthy
+        # claim the check so concurrent requests use the old verdict meanwhile
+        _health[alias] = (now, healthy)
+
+    try:
+        lag = measure_lag(connections[alias])
+        healthy = lag <= settings.REPLICA_MAX_LAG_SECONDS
+        if not healthy:
+            logger.warning("Replica %s is %.1fs behind; reading from the primary", alias, lag)
+    except DatabaseError:
+        logger.warning("Replica %s is unavailable; reading from the primary", alias, exc_info=True)
+        healthy = False
+    with _health_lock:
+        _health[alias] = (time.monotonic(), healthy)
+    return healthy
+
+
+def reset_replica_health():
+    with _health_lock:
+        _health.clear()
+
+
+def choose_replica():
+    healthy = [alias for alias in settings.DATABASE_REPLICAS if replica_is_healthy(alias)]
+    return random.choice(healthy) if healthy else None
+
+
+@contextmanager
+def read_from_primary():
+    """Route replicated reads in this block to the primary.
+
+    Used when filling long-lived caches, which must not capture a lagging
+    replica's view just after an invalidation.
+    """
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def client_identities(request):
+    """Keys identifying the client: its cart code and its bearer token, if sent."""
+    identities = []
+    auth = request.headers.get("Authorization")
+    if auth:
+        identities.append("auth:" + hashlib.sha256(auth.encode()).hexdigest()[:32])
+
+    cart_code = request.GET.get("cart_code")
+    if not cart_code and request.method not in ("GET", "HEAD", "OPTIONS"):
+        content_type = request.content_type or ""
+        try:
+            # reading the body here is fine: Django keeps it for the view
+            if content_type == "application/json":
+                data = json.loads(request.body or b"{}")
+                cart_code = data.get("cart_code") if isinstance(data, dict) else None
+            elif content_type == "application/x-www-form-urlencoded":
+                cart_code = request.POST.get("cart_code")
+        except ValueError:
+            cart_code = None
+    if cart_code:
+        identities.append(f"cart:{cart_code}")
+    return identities
+
+
+def pin_to_primary(identities):
+    caches[settings.REPLICA_PIN_CACHE_ALIAS].set_many({PIN_KEY.format(i): True for i in identities}, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(identities):
+    return bool(caches[settings.REPLICA_PIN_CACHE_ALIAS].get_many([PIN_KEY.format(i) for i in identities]))
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS or model._meta.label not in REPLICATED_MODELS:
+            return None
+        if _pinned.get() or _wrote.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # explicit, so objects loaded from a replica do not drag reads back to it
+            return DEFAULT_DB_ALIAS
+        return choose_replica() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema from the primary
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """Applies sticky-primary reads per request and pins clients that write."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        identities = client_identities(request)
+        pinned = _pinned.set(bool(identities) and is_pinned(identities))
+        wrote = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if _wrote.get() and identities:
+                pin_to_primary(identities)
+        finally:
+            _pinned.reset(pinned)
+            _wrote.reset(wrote)
+        return response
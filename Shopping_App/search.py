@@ -0,0 +1,149 @@
+import re
+import threading
+from collections import defaultdict
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections
+from django.db.models import Case, F, Index, IntegerField, Value, When
+from rest_framework.filters import BaseFilterBackend
+
+SEARCH_CONFIG = "english"
+
+# name matches outrank category matches, which outrank description matches
+SEARCH_FIELD_WEIGHTS = (("name", "A"), ("category", "B"), ("description", "C"))
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_INDEX_WEIGHTS = {"A": 1.0, "B": 0.4, "C": 0.2}
+
+# The fallback orders results with a CASE over matching ids, so keep it to
+# the best matches; nobody pages past this on a development database.
+FALLBACK_MAX_RESULTS = 1000
+
+
+def uses_postgres_search(using="default"):
+    return connections[using].vendor == "postgresql"
+
+
+def product_search_vector():
+    vector = None
+    for field, weight in SEARCH_FIELD_WEIGHTS:
+        part = SearchVector(field, weight=weight, config=SEARCH_CONFIG)
+        vector = part if vector is None else vector + part
+    return vector
+
+
+def product_search_document(product):
+    """`product_search_vector()` built from the instance's values instead of its columns.
+
+    Holds no column references, so save() can write it in the same INSERT
+    or UPDATE as the rest of the row.
+    """
+    vector = None
+    for field, weight in SEARCH_FIELD_WEIGHTS:
+        part = SearchVector(Value(getattr(product, field) or ""), weight=weight, config=SEARCH_CONFIG)
+        vector = part if vector is None else vector + part
+    return vector
+
+
+class SearchVectorIndex(GinIndex):
+    """GIN index on PostgreSQL, a plain index elsewhere.
+
+    Other databases cannot build GIN indexes; there the column stays empty
+    and searches go through the in-process index, so a plain index keeps
+    migrations and SQLite table rebuilds working.
+    """
+
+    def create_sql(self, model, schema_editor, using="", **kwargs):
+        if schema_editor.connection.vendor != "postgresql":
+            return Index.create_sql(self, model, schema_editor, **kwargs)
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+class InvertedIndex:
+    """In-process token index used when the database has no full-text search.
+
+    Built lazily from the Products table and dropped whenever a product
+    changes, so it is only suitable for SQLite development and tests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = None
+
+    def invalidate(self):
+        with self._lock:
+            self._postings = None
+
+    def _build(self):
+        from .models import Products
+
+        postings = defaultdict(lambda: defaultdict(float))
+        rows = Products.objects.values_list("id", *(f for f, _ in SEARCH_FIELD_WEIGHTS))
+        for row in rows.iterator(chunk_size=2000):
+            product_id, values = row[0], row[1:]
+            for (_, weight), value in zip(SEARCH_FIELD_WEIGHTS, values):
+                for token in tokenize(value):
+                    postings[token][product_id] += _INDEX_WEIGHTS[weight]
+        return postings
+
+    def search(self, term):
+        """Return product ids matching every token in `term`, best match first."""
+        tokens = tokenize(term)
+        if not tokens:
+            return []
+        with self._lock:
+            if self._postings is None:
+                self._postings = self._build()
+            postings = self._postings
+
+        scores = None
+        for token in tokens:
+            matches = postings.get(token)
+            if not matches:
+                return []
+            if scores is None:
+                scores = dict(matches)
+            else:
+                scores = {pid: s + matches[pid] for pid, s in scores.items() if pid in matches}
+        return sorted(scores, key=lambda pid: (-scores[pid], pid))
+
+
+product_index = InvertedIndex()
+
+
+def search_products(queryset, term):
+    """Filter `queryset` to products matching `term`, ordered by relevance."""
+    term = (term or "").strip()
+    if not term:
+        return queryset
+
+    if uses_postgres_search(queryset.db):
+        query = SearchQuery(term, search_type="websearch", config=SEARCH_CONFIG)
+        return (
+            queryset.filter(search_vector=query)
+            .annotate(rank=SearchRank(F("search_vector"), query))
+            .order_by("-rank", "id")
+        )
+
+    ids = product_index.search(term)[:FALLBACK_MAX_RESULTS]
+    if not ids:
+        return queryset.none()
+    ranking = Case(
+        *(When(id=pid, then=pos) for pos, pid in enumerate(ids)),
+        output_field=IntegerField(),
+    )
+    return queryset.filter(id__in=ids).order_by(ranking, "id")
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """Drop-in replacement for SearchFilter backed by the full-text index."""
+
+    search_param = "search"
+
+    def filter_queryset(self, request, queryset, view):
+        return search_products(queryset, request.query_params.get(self.search_param, ""))
@@ -1,25 +1,35 @@
 from rest_framework import serializers
-from rest_framework.pagination import PageNumberPagination
-from .models import Products, Cart, CartItem, ProductImage
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from .models import Products, Cart, CartItem, ImageUpload, ProductImage, Transaction
+from .cache import SIMILAR_PRODUCTS_LIMIT, similar_product_ids
+from .pricing import cart_subtotal
+from .jobs import enqueue
+from .services import merge_user_carts
+from .tasks import upload_product_images
+from .utils import image_url
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
 User = get_user_model()
 
 
 # ✅ Extra images for a product
 class ProductImageSerializer(serializers.ModelSerializer):
-    image = serializers.ImageField(use_url=True)  # ensures full Cloudinary URL
+    image = serializers.SerializerMethodField()  # full Cloudinary URL
 
     class Meta:
         model = ProductImage
         fields = ["id", "image"]
 
+    def get_image(self, obj):
+        return image_url(obj.image, self.context.get("image_preset"))
+
 
 # ✅ Main Product Serializer
 class ProductsSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()  # show image URL properly
-    extra_images = ProductImageSerializer(many=True, read_only=True)
+    extra_images = serializers.SerializerMethodField()
     uploaded_images = serializers.ListField(
         child=serializers.ImageField(
             max_length=100000, allow_empty_file=False, use_url=False
@@ -49,12 +59,18 @@ class ProductsSerializer(serializers.ModelSerializer):
     def get_image(self, obj):
         if getattr(obj, "image", None):
             try:
-                return obj.image.url  # ✅ Cloudinary gives full URL
+                # ✅ Cloudinary URL, memoized per image and preset
+                return image_url(obj.image, self.context.get("image_preset"))
             except Exception:
                 return None
         # Fallback default image
         return "https://res.cloudinary.com/dorjc6aib/image/upload/v123456/default.jpg"
 
+    def get_extra_images(self, obj):
+        # filtered in Python so a prefetched extra_images list is reused
+        ready = [image for image in obj.extra_images.all() if image.status == ProductImage.READY]
+        return ProductImageSerializer(ready, many=True, context=self.context).data
+
     def get_category_display(self, obj):
         return obj.get_category_display()
 
@@ -70,8 +86,7 @@ class ProductsSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         uploaded_images = validated_data.pop("uploaded_images", [])
         product = Products.objects.create(**validated_data)
-        for image in uploaded_images:
-            ProductImage.objects.create(product=product, image=image)
+        self.queue_extra_images(product, uploaded_images)
         return product
 
     def update(self, instance, validated_data):
@@ -80,16 +95,71 @@ class ProductsSerializer(serializers.ModelSerializer):
             setattr(instance, attr, value)
         instance.save()
 
-        for image in uploaded_images:
-            ProductImage.objects.create(product=instance, image=image)
+        self.queue_extra_images(instance, uploaded_images)
         return instance
 
-
-# ✅ Pagination
+    def queue_extra_images(self, product, uploaded_images):
+        # Persist pending rows with their files and upload from a job, so the
+        # response does not wait on Cloudinary and a restart loses nothing.
+        if not uploaded_images:
+            return
+        pending = ProductImage.objects.bulk_create(
+            ProductImage(product=product, status=ProductImage.PENDING) for _ in uploaded_images
+        )
+        uploads = []
+        for image, uploaded in zip(pending, uploaded_images):
+            uploaded.seek(0)
+            uploads.append(ImageUpload(image=image, name=uploaded.name, data=uploaded.read()))
+        ImageUpload.objects.bulk_create(uploads)
+        enqueue(upload_product_images, [image.id for image in pending])
+
+
+# ✅ Keyset pagination: no OFFSET and no COUNT(*), cursors are opaque
+class ProductsCursorPagination(CursorPagination):
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering_query_param = "order"
+    # DRF's cursor holds only the first field's value plus an offset past rows
+    # sharing it; the trailing "id" fixes the order of those ties so the offset
+    # skips the same rows on every page. Long runs of equal prices are scanned
+    # through the offset, not seeked past.
+    orderings = {
+        "id": ("id",),
+        "-id": ("-id",),
+        "price": ("price", "id"),
+        "-price": ("-price", "-id"),
+    }
+    ordering = orderings["id"]
+
+    def get_ordering(self, request, queryset, view):
+        return self.orderings.get(request.query_params.get(self.ordering_query_param), self.ordering)
+
+
+# ✅ Pagination (page numbers by default, cursors on request)
 class ProductsPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = "page_size"
     max_page_size = 100
+    mode_query_param = "pagination"
+    cursor_class = ProductsCursorPagination
+
+    def use_cursor(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == "cursor"
+            or self.cursor_class.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = self.cursor_class() if self.use_cursor(request) else None
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
 
 
 # ✅ Detail view with similar products
@@ -112,7 +182,8 @@ class DetailProductSerializer(serializers.ModelSerializer):
         ]
 
     def get_similar_products(self, obj):
-        similar = Products.objects.filter(category=obj.category).exclude(id=obj.id)[:5]
+        ids = [pk for pk in similar_product_ids(obj.category) if pk != obj.id][:SIMILAR_PRODUCTS_LIMIT]
+        similar = Products.objects.filter(id__in=ids).order_by("id").prefetch_related("extra_images")
         return ProductsSerializer(similar, many=True).data
 
     def get_category_display(self, obj):
@@ -152,46 +223,71 @@ class CartSerializer(serializers.ModelSerializer):
         ]
 
     def get_sum_total(self, cart):
-        # use numeric price field to compute totals
-        return sum(item.product.price * item.quantity for item in cart.items.all())
+        return cart_subtotal(cart)
 
     def get_num_of_items(self, cart):
         return sum(item.quantity for item in cart.items.all())
 
 
+# ✅ Batch cart mutations
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=["add", "set", "remove"])
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, required=False, default=1)
+
+    def validate(self, data):
+        if data["op"] == "add" and data["quantity"] < 1:
+            raise serializers.ValidationError("Quantity must be at least 1.")
+        return data
+
+
+class CartBatchSerializer(serializers.Serializer):
+    cart_code = serializers.CharField(max_length=11)
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=100)
+
+
 # ✅ Lightweight cart
 class SimpleCartSerializer(serializers.ModelSerializer):
-    num_of_items = serializers.SerializerMethodField()
+    # read the stored counter instead of walking the cart items
+    num_of_items = serializers.IntegerField(source="item_count", read_only=True)
 
     class Meta:
         model = Cart
         fields = ["id", "cart_code", "num_of_items"]
 
-    def get_num_of_items(self, cart):
-        return sum(item.quantity for item in cart.items.all())
 
+# ✅ Order history
+class OrderTransactionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Transaction
+        fields = ["ref", "amount", "currency", "status", "created_at"]
 
-# ✅ Paid items for a user
-class NewCartItemSerializer(serializers.ModelSerializer):
-    product = ProductsSerializer(read_only=True)
-    order_id = serializers.SerializerMethodField()
-    order_date = serializers.SerializerMethodField()
+
+class OrderSerializer(serializers.ModelSerializer):
+    order_id = serializers.CharField(source="cart_code", read_only=True)
+    order_date = serializers.DateTimeField(source="modified_at", read_only=True)
+    items = CartItemSerializer(read_only=True, many=True)
+    num_of_items = serializers.IntegerField(source="item_count", read_only=True)
+    transaction = serializers.SerializerMethodField()
 
     class Meta:
-        model = CartItem
-        fields = ["id", "product", "quantity", "order_id", "order_date"]
+        model = Cart
+        fields = ["id", "order_id", "order_date", "items", "num_of_items", "subtotal", "transaction"]
+
+    def get_transaction(self, cart):
+        # prefetched by Cart.objects.paid_orders()
+        transactions = cart.completed_transactions
+        return OrderTransactionSerializer(transactions[0]).data if transactions else None
 
-    def get_order_id(self, obj):
-        return obj.cart.cart_code
 
-    def get_order_date(self, obj):
-        return obj.cart.modified_at
+class OrderHistoryPagination(PageNumberPagination):
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 50
 
 
-# ✅ Full User + purchase history
+# ✅ User profile
 class UserSerializer(serializers.ModelSerializer):
-    items = serializers.SerializerMethodField()
-
     class Meta:
         model = User
         fields = [
@@ -204,13 +300,8 @@ class UserSerializer(serializers.ModelSerializer):
             "state",
             "address",
             "phone",
-            "items",
         ]
 
-    def get_items(self, user):
-        cart_items = CartItem.objects.filter(cart__user=user, cart__paid=True)[:10]
-        return NewCartItemSerializer(cart_items, many=True).data
-
 
 # ✅ Signup serializer
 class CustomUsersSerializer(serializers.ModelSerializer):
@@ -237,6 +328,19 @@ class CustomUsersSerializer(serializers.ModelSerializer):
         return user
 
 
+# ✅ Login: token pair, merging the user's carts into one
+class CartMergingTokenObtainPairSerializer(TokenObtainPairSerializer):
+    cart_code = serializers.CharField(max_length=11, required=False, allow_blank=True)
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        cart = merge_user_carts(self.user, attrs.get("cart_code") or None)
+        # the frontend switches to this code; it differs from the one sent
+        # when another device's cart was kept
+        data["cart_code"] = cart.cart_code if cart else None
+        return data
+
+
 # OTP serializers required by views
 class OTPRequestSerializer(serializers.Serializer):
     email = serializers.EmailField()
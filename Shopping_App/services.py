@@ -0,0 +1,218 @@
+from decimal import Decimal
+
+from django.db import connections, router, transaction
+from django.db.models import Exists, F, OuterRef, Q, Sum
+from django.utils import timezone
+
+from .cache import invalidate_carts
+from .models import Cart, CartItem, Products, Transaction
+
+
+class CartAlreadyPaid(Exception):
+    """The cart is a completed order and can no longer be changed."""
+
+
+def _names(connection, model, *fields):
+    """Quoted table name plus quoted column names for `fields`."""
+    quote = connection.ops.quote_name
+    columns = {name: quote(model._meta.get_field(name).column) for name in fields}
+    return quote(model._meta.db_table), columns
+
+
+def add_to_cart(cart_code, product, quantity, user=None):
+    """Add `quantity` of `product` to the cart, creating cart and line as needed.
+
+    Two upserts in one transaction: the cart row (totals and owner included)
+    and the cart line, whose quantity is incremented in the database. Neither
+    statement reads before it writes, so concurrent adds cannot lose updates.
+    Returns the cart id.
+    """
+    using = router.db_for_write(Cart)
+    connection = connections[using]
+    ops = connection.ops
+
+    cart, c = _names(
+        connection, Cart,
+        "id", "cart_code", "user", "paid", "item_count", "subtotal", "created_at", "modified_at",
+    )
+    item, i = _names(connection, CartItem, "cart", "product", "quantity")
+
+    cart_sql = (
+        f"INSERT INTO {cart} ({c['cart_code']}, {c['user']}, {c['paid']}, {c['item_count']}, "
+        f"{c['subtotal']}, {c['created_at']}, {c['modified_at']}) "
+        f"VALUES (%s, %s, %s, %s, %s, %s, %s) "
+        f"ON CONFLICT ({c['cart_code']}) DO UPDATE SET "
+        f"{c['item_count']} = {cart}.{c['item_count']} + EXCLUDED.{c['item_count']}, "
+        f"{c['subtotal']} = {cart}.{c['subtotal']} + EXCLUDED.{c['subtotal']}, "
+        f"{c['user']} = COALESCE({cart}.{c['user']}, EXCLUDED.{c['user']}), "
+        f"{c['modified_at']} = EXCLUDED.{c['modified_at']} "
+        f"RETURNING {c['id']}"
+    )
+    item_sql = (
+        f"INSERT INTO {item} ({i['cart']}, {i['product']}, {i['quantity']}) "
+        f"VALUES (%s, %s, %s) "
+        f"ON CONFLICT ({i['cart']}, {i['product']}) DO UPDATE SET "
+        f"{i['quantity']} = {item}.{i['quantity']} + EXCLUDED.{i['quantity']}"
+    )
+
+    now = ops.adapt_datetimefield_value(timezone.now())
+    amount = ops.adapt_decimalfield_value(quantity * product.price, 12, 2)
+    user_id = user.pk if user is not None and user.is_authenticated else None
+    with transaction.atomic(using=using):
+        with connection.cursor() as cursor:
+            cursor.execute(cart_sql, [cart_code, user_id, False, quantity, amount, now, now])
+            cart_id = cursor.fetchone()[0]
+            cursor.execute(item_sql, [cart_id, product.pk, quantity])
+    return cart_id
+
+
+def apply_cart_operations(cart_code, operations, user=None):
+    """Apply a list of add/set/remove operations to one cart in a single transaction.
+
+    Each operation is a dict with "op", "product_id" and, for add/set,
+    "quantity" (set to 0 removes the line). Operations run in order against
+    the cart loaded once, then the result is written back with one
+    bulk_create, one bulk_update and one delete. Returns the cart id.
+    Raises Products.DoesNotExist if any product id is unknown and
+    CartAlreadyPaid if the cart has been paid for.
+    """
+    product_ids = {operation["product_id"] for operation in operations}
+    with transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(cart_code=cart_code)
+        cart = Cart.objects.select_for_update().get(pk=cart.pk)
+        # checked under the lock, so a payment confirmed meanwhile is seen
+        if cart.paid:
+            raise CartAlreadyPaid(f"Cart {cart_code} is already paid.")
+        if user is not None and user.is_authenticated and cart.user_id is None:
+            cart.user = user
+
+        lines = {
+            item.product_id: item
+            for item in cart.items.select_for_update(of=("self",)).select_related("product")
+        }
+        products = Products.objects.only("id", "price").in_bulk(product_ids - set(lines))
+        missing = product_ids - set(lines) - set(products)
+        if missing:
+            raise Products.DoesNotExist(f"Unknown product id(s): {sorted(missing)}")
+        prices = {pid: item.product.price for pid, item in lines.items()}
+        prices.update({pid: product.price for pid, product in products.items()})
+
+        quantities = {pid: item.quantity for pid, item in lines.items()}
+        for operation in operations:
+            pid = operation["product_id"]
+            if operation["op"] == "add":
+                quantities[pid] = quantities.get(pid, 0) + operation["quantity"]
+            elif operation["op"] == "set" and operation["quantity"] > 0:
+                quantities[pid] = operation["quantity"]
+            else:
+                quantities.pop(pid, None)
+
+        created = [
+            CartItem(cart=cart, product_id=pid, quantity=quantity)
+            for pid, quantity in quantities.items()
+            if pid not in lines
+        ]
+        changed = []
+        for pid, item in lines.items():
+            if pid in quantities and quantities[pid] != item.quantity:
+                item.quantity = quantities[pid]
+                changed.append(item)
+        removed = [item.id for pid, item in lines.items() if pid not in quantities]
+
+        CartItem.objects.bulk_create(created)
+        CartItem.objects.bulk_update(changed, ["quantity"])
+        if removed:
+            CartItem.objects.filter(id__in=removed).delete()
+
+        cart.item_count = sum(quantities.values())
+        cart.subtotal = sum((prices[pid] * q for pid, q in quantities.items()), Decimal("0"))
+        cart.save(update_fields=["user", "item_count", "subtotal", "modified_at"])
+    return cart.pk
+
+
+def merge_user_carts(user, cart_code=None):
+    """Combine the user's unpaid carts into one and return it (None if they have none).
+
+    The cart being used on this device (`cart_code`, claimed for the user
+    if it is a guest cart) is kept, otherwise the most recently modified
+    one. Quantities are summed per product with one aggregate query and
+    written with one bulk upsert; the other carts are deleted, or only
+    emptied when they carry failed payments, so those records survive.
+    Carts with a pending or completed payment are left out of the merge.
+    """
+    owned = Q(user=user)
+    if cart_code:
+        owned |= Q(cart_code=cart_code, user__isnull=True)
+    with transaction.atomic():
+        carts = list(
+            Cart.objects.select_for_update()
+            .filter(owned, paid=False)
+            .exclude(Exists(Transaction.objects.filter(
+                cart=OuterRef("pk"), status__in=[Transaction.PENDING, Transaction.COMPLETED]
+            )))
+            .annotate(has_payments=Exists(Transaction.objects.filter(cart=OuterRef("pk"))))
+            .order_by("-modified_at", "-id")
+        )
+        if not carts:
+            return None
+        target = next((cart for cart in carts if cart.cart_code == cart_code), carts[0])
+        merged = [cart for cart in carts if cart.pk != target.pk]
+
+        if merged:
+            lines = (
+                CartItem.objects.filter(cart__in=carts)
+                .values("product_id")
+                .annotate(quantity=Sum("quantity"), price=F("product__price"))
+                .order_by()
+            )
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(cart=target, product_id=line["product_id"], quantity=line["quantity"])
+                    for line in lines
+                ],
+                update_conflicts=True,
+                unique_fields=["cart", "product"],
+                update_fields=["quantity"],
+            )
+            Cart.objects.filter(pk__in=[cart.pk for cart in merged if not cart.has_payments]).delete()
+            emptied = [cart.pk for cart in merged if cart.has_payments]
+            if emptied:
+                CartItem.objects.filter(cart__in=emptied).delete()
+                Cart.objects.filter(pk__in=emptied).update(item_count=0, subtotal=0, modified_at=timezone.now())
+            invalidate_carts(*(cart.cart_code for cart in merged))
+            target.item_count = sum(line["quantity"] for line in lines)
+            target.subtotal = sum((line["quantity"] * line["price"] for line in lines), Decimal("0"))
+
+        target.user = user
+        target.save(update_fields=["user", "item_count", "subtotal", "modified_at"])
+    return target
+
+
+def confirm_transaction(ref):
+    """Mark the transaction completed and its cart paid, exactly once.
+
+    Both rows are updated in one transaction under a row lock on the
+    transaction, so replayed webhooks and racing redirect handlers are
+    harmless. Returns True if this call did the confirming.
+    """
+    with transaction.atomic():
+        txn = Transaction.objects.select_for_update().select_related("cart").get(ref=ref)
+        if txn.status == Transaction.COMPLETED:
+            return False
+        txn.status = Transaction.COMPLETED
+        txn.save(update_fields=["status", "modified_at"])
+
+        cart = txn.cart
+        cart.paid = True
+        cart.user_id = txn.user_id
+        cart.save(update_fields=["paid", "user", "modified_at"])
+    return True
+
+
+def fail_transaction(ref):
+    """Mark a still-pending transaction failed. Completed ones are left alone."""
+    return bool(
+        Transaction.objects.filter(ref=ref, status=Transaction.PENDING).update(
+            status=Transaction.FAILED, modified_at=timezone.now()
+        )
+    )
@@ -0,0 +1,58 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import bump_catalog_version, invalidate_carts, invalidate_products
+from .models import Cart, Products, ProductImage
+from .search import product_index
+
+
+@receiver(post_save, sender=Products)
+@receiver(post_delete, sender=Products)
+def invalidate_search_index(sender, **kwargs):
+    product_index.invalidate()
+
+
+@receiver(post_save, sender=Products)
+@receiver(post_delete, sender=Products)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_catalog_version(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(pre_save, sender=Products)
+def remember_cached_identity(sender, instance, **kwargs):
+    # A save can move a product to another slug or category; both the old
+    # and the new cache entries have to go.
+    instance._previous_identity = (
+        sender.objects.filter(pk=instance.pk).values_list("slug", "category").first()
+        if instance.pk
+        else None
+    )
+
+
+@receiver(post_save, sender=Products)
+@receiver(post_delete, sender=Products)
+def invalidate_product_detail(sender, instance, **kwargs):
+    slugs, categories = {instance.slug}, {instance.category}
+    previous = getattr(instance, "_previous_identity", None)
+    if previous:
+        slugs.add(previous[0])
+        categories.add(previous[1])
+    invalidate_products(slugs=slugs, categories=categories - {None})
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_product_images(sender, instance, **kwargs):
+    product = Products.objects.filter(pk=instance.product_id).values_list("slug", "category").first()
+    if product is not None:
+        slug, category = product
+        invalidate_products(slugs=[slug], categories=[category] if category else [])
+
+
+@receiver(post_save, sender=Cart)
+def invalidate_cached_cart(sender, instance, **kwargs):
+    # covers payment confirmation and admin edits; the cart views write
+    # through or invalidate themselves
+    invalidate_carts(instance.cart_code)
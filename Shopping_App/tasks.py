@@ -0,0 +1,146 @@
+import io
+import logging
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+
+from .cache import bump_catalog_version, invalidate_products
+from .jobs import job
+from .models import ImageUpload, ProductImage, Transaction
+from .payments import PaymentGatewayError, flutterwave_client, paypal_client
+from .services import confirm_transaction, fail_transaction
+from .utils import upload_images
+
+logger = logging.getLogger(__name__)
+
+PAYPAL_COMPLETED_EVENTS = {"PAYMENT.SALE.COMPLETED"}
+PAYPAL_FAILED_EVENTS = {"PAYMENT.SALE.DENIED"}
+
+
+@job
+def upload_product_images(image_ids):
+    """Upload the stored files of pending ProductImage rows and mark each ready or failed.
+
+    The files stay in ImageUpload rows until the outcome is saved, so a
+    worker that dies mid-upload leaves the job to be requeued and rerun.
+    """
+    uploads = list(
+        ImageUpload.objects.filter(image_id__in=image_ids, image__status=ProductImage.PENDING)
+        .select_related("image__product")
+    )
+    files = {}
+    for upload in uploads:
+        files[upload.image_id] = io.BytesIO(bytes(upload.data))
+        files[upload.image_id].name = upload.name
+    uploaded, failed = upload_images(list(files.values()))
+
+    images = [upload.image for upload in uploads]
+    for image in images:
+        source = files[image.id]
+        if source in uploaded:
+            image.image = uploaded[source]
+            image.status = ProductImage.READY
+        else:
+            image.status = ProductImage.FAILED
+    with transaction.atomic():
+        ProductImage.objects.bulk_update(images, ["image", "status"])
+        ImageUpload.objects.filter(id__in=[upload.id for upload in uploads]).delete()
+
+    # bulk_update skips the model signals
+    bump_catalog_version()
+    invalidate_products(
+        slugs={image.product.slug for image in images},
+        categories={image.product.category for image in images if image.product.category},
+    )
+    return len(uploaded), len(failed)
+
+
+def _pending(ref):
+    return Transaction.objects.filter(ref=ref, status=Transaction.PENDING).first()
+
+
+@job
+def verify_flutterwave_payment(ref, transaction_id):
+    """Verify a Flutterwave charge server-side and settle the matching transaction.
+
+    Safe to run any number of times for the same ref. Gateway errors are
+    raised so the job queue retries them.
+    """
+    txn = _pending(ref)
+    if txn is None:
+        return False
+    res_data = flutterwave_client().verify_transaction(transaction_id).json()
+    data = res_data.get("data") or {}
+    if res_data.get("status") != "success" or data.get("tx_ref") != ref:
+        logger.warning("Flutterwave could not verify %s for %s", transaction_id, ref)
+        return False
+    if data.get("status") == "failed":
+        return fail_transaction(ref)
+    if (
+        data.get("status") == "successful"
+        and Decimal(str(data.get("amount"))) == txn.amount
+        and data.get("currency") == txn.currency
+    ):
+        return confirm_transaction(ref)
+    logger.warning("Flutterwave charge %s does not match transaction %s", transaction_id, ref)
+    return False
+
+
+def _paypal_state(response, payment_id):
+    if response.status_code != 200:
+        raise PaymentGatewayError(f"PayPal answered {response.status_code} for payment {payment_id}")
+    return response.json().get("state")
+
+
+@job
+def execute_paypal_payment(ref, payment_id, payer_id):
+    """Execute an approved PayPal payment and settle the transaction.
+
+    The payment is looked up first, so a retry after an execute that timed
+    out settles from its state instead of executing again. Gateway errors
+    and unexpected states are raised so the job queue retries them.
+    """
+    txn = _pending(ref)
+    if txn is None or txn.provider_ref != payment_id:
+        return False
+    client = paypal_client()
+    state = _paypal_state(client.get_payment(payment_id), payment_id)
+    if state == "created":
+        response = client.execute_payment(payment_id, payer_id)
+        if response.status_code >= 500:
+            raise PaymentGatewayError(f"PayPal answered {response.status_code} executing {payment_id}")
+        if response.status_code == 200:
+            state = response.json().get("state")
+        else:
+            # refused, or PAYMENT_ALREADY_DONE from an earlier execute that went through
+            state = _paypal_state(client.get_payment(payment_id), payment_id)
+            if state == "created":
+                logger.warning("PayPal refused to execute %s (%s)", payment_id, response.status_code)
+                return False
+    if state == "approved":
+        return confirm_transaction(ref)
+    if state == "failed":
+        return fail_transaction(ref)
+    raise PaymentGatewayError(f"PayPal payment {payment_id} is {state!r}")
+
+
+@job
+def handle_paypal_webhook(headers, event):
+    """Check a PayPal webhook's signature with PayPal, then apply the sale event."""
+    if not paypal_client().verify_webhook_signature(settings.PAYPAL_WEBHOOK_ID, headers, event):
+        logger.warning("Rejected PayPal webhook %s", event.get("id"))
+        return False
+    event_type = event.get("event_type")
+    payment_id = (event.get("resource") or {}).get("parent_payment")
+    ref = (
+        Transaction.objects.filter(provider_ref=payment_id).values_list("ref", flat=True).first()
+        if payment_id else None
+    )
+    if ref is None:
+        return False
+    if event_type in PAYPAL_COMPLETED_EVENTS:
+        return confirm_transaction(ref)
+    if event_type in PAYPAL_FAILED_EVENTS:
+        return fail_transaction(ref)
+    return False
@@ -1,3 +1,1641 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from datetime import timedelta
+from itertools import count
+from unittest import mock
 
-# Create your tests here.
+import cloudinary
+from PIL import Image
+from prometheus_client import REGISTRY
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, OperationalError, connection, connections
+from django.db.utils import load_backend
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .cache import cart_cache
+from .checks import check_cart_cache, check_metrics_token, check_product_cache, check_replica_pin_cache
+from .benchmarks import api_scenarios, run_load, seed_carts, seed_products, seed_users, stub_gateway
+from .jobs import claim_job, enqueue, job, requeue_stale_jobs, supervise, work
+from .models import Products, ProductImage, Cart, CartItem, ImageUpload, Job, Transaction
+from .payments import CircuitBreaker, FlutterwaveClient, GatewayUnavailable, PayPalClient
+from .pricing import cart_subtotal, price_cart
+from .routers import reset_replica_health
+from .serializers import ProductsSerializer
+from .services import add_to_cart, confirm_transaction, merge_user_carts
+from .tasks import execute_paypal_payment
+from .utils import _build_image_url, image_url
+
+# URL building needs a cloud name even though nothing is uploaded in tests.
+cloudinary.config(cloud_name="shopwithdammy-test")
+
+
+_product_seq = count()
+
+
+def make_products(num, price="100.00", category="OTHERS"):
+    products = []
+    for _ in range(num):
+        i = next(_product_seq)
+        products.append(
+            Products(name=f"Product {i}", slug=f"product-{i}", price=Decimal(price), category=category)
+        )
+    return Products.objects.bulk_create(products)
+
+
+def fill_cart(cart, products, quantity=1):
+    CartItem.objects.bulk_create(
+        CartItem(cart=cart, product=product, quantity=quantity) for product in products
+    )
+
+
+class CartQueryCountTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def _get_cart_queries(self, num_items):
+        cart = Cart.objects.create(cart_code=f"c{num_items}")
+        products = make_products(num_items)
+        ProductImage.objects.bulk_create(
+            ProductImage(product=product, image="image/upload/v1/extra.jpg") for product in products
+        )
+        fill_cart(cart, products)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("get_cart"), {"cart_code": cart.cart_code})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["items"]), num_items)
+        self.assertEqual(response.data["num_of_items"], num_items)
+        return len(ctx.captured_queries)
+
+    def test_get_cart_query_count_is_flat(self):
+        baseline = self._get_cart_queries(1)
+        self.assertEqual(self._get_cart_queries(30), baseline)
+        self.assertEqual(self._get_cart_queries(200), baseline)
+
+    def test_add_item_query_count_is_flat(self):
+        counts = []
+        for num_items in (1, 200):
+            cart = Cart.objects.create(cart_code=f"a{num_items}")
+            products = make_products(num_items + 1)
+            fill_cart(cart, products[:-1])
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(
+                    reverse("add_item"),
+                    {"cart_code": cart.cart_code, "product_id": products[-1].id},
+                    format="json",
+                )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.data["cart"]["items"]), num_items + 1)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class CartTotalsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product, self.other = make_products(2, price="250.00")
+
+    def _add(self, product, quantity):
+        return self.client.post(
+            reverse("add_item"),
+            {"cart_code": "totals", "product_id": product.id, "quantity": quantity},
+            format="json",
+        )
+
+    def test_mutations_keep_stored_totals_in_step(self):
+        self._add(self.product, 2)
+        self._add(self.product, 1)
+        self._add(self.other, 4)
+        cart = Cart.objects.get(cart_code="totals")
+        self.assertEqual((cart.item_count, cart.subtotal), (7, Decimal("1750.00")))
+
+        item = CartItem.objects.get(cart=cart, product=self.other)
+        self.client.patch(reverse("update_quantity"), {"item_id": item.id, "quantity": 1}, format="json")
+        cart.refresh_from_db()
+        self.assertEqual((cart.item_count, cart.subtotal), (4, Decimal("1000.00")))
+
+        self.client.delete(reverse("delete_cartitem", args=[item.id]))
+        cart.refresh_from_db()
+        self.assertEqual((cart.item_count, cart.subtotal), (3, Decimal("750.00")))
+
+    def test_get_cart_stat_is_a_single_row_read(self):
+        self._add(self.product, 3)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("get_cart_stat"), {"cart_code": "totals"})
+        self.assertEqual(response.data["num_of_items"], 3)
+
+    def test_rebuild_command_detects_and_fixes_drift(self):
+        self._add(self.product, 2)
+        Cart.objects.filter(cart_code="totals").update(item_count=99)
+
+        with self.assertRaises(CommandError):
+            call_command("rebuild_cart_totals", "--check", stdout=StringIO())
+        call_command("rebuild_cart_totals", stdout=StringIO())
+
+        cart = Cart.objects.get(cart_code="totals")
+        self.assertEqual((cart.item_count, cart.subtotal), (2, Decimal("500.00")))
+        call_command("rebuild_cart_totals", "--check", stdout=StringIO())
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        Products.objects.create(name="Wireless Headphone", description="Black over-ear", price=10)
+        Products.objects.create(name="Desk Lamp", description="Works with any wireless charger", price=10)
+        Products.objects.create(name="Leather Bag", description="Brown", price=10, category="ACCESSORY")
+
+    def _search(self, term):
+        response = self.client.get(reverse("Products-list"), {"search": term})
+        self.assertEqual(response.status_code, 200)
+        return [p["name"] for p in response.data["results"]]
+
+    def test_results_are_ranked_by_field_weight(self):
+        self.assertEqual(self._search("wireless"), ["Wireless Headphone", "Desk Lamp"])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self._search("wireless lamp"), ["Desk Lamp"])
+        self.assertEqual(self._search("accessory"), ["Leather Bag"])
+        self.assertEqual(self._search("nothing"), [])
+
+    def test_index_follows_product_changes(self):
+        self.assertEqual(self._search("camera"), [])
+        Products.objects.create(name="Compact Camera", price=10)
+        self.assertEqual(self._search("camera"), ["Compact Camera"])
+
+    def test_search_document_is_written_with_the_row_on_postgres(self):
+        product = Products(name="Compact Camera", price=10, slug="compact-camera")
+        with mock.patch("Shopping_App.models.uses_postgres_search", return_value=True):
+            kwargs = {"update_fields": ["price"]}
+            self.assertFalse(product._set_search_document(kwargs))
+            self.assertEqual(kwargs, {"update_fields": ["price"]})
+
+            kwargs = {"update_fields": ["name"]}
+            self.assertTrue(product._set_search_document(kwargs))
+            self.assertEqual(kwargs["update_fields"], {"name", "search_vector"})
+            self.assertIn("SearchVector(Value('Compact Camera'))", str(product.search_vector))
+        # other databases leave the column empty
+        self.assertFalse(product._set_search_document({}))
+
+
+class ProductsCursorPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.products = make_products(25)
+
+    def _walk(self, params):
+        seen, url, pages = [], reverse("Products-list"), 0
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url, params)
+            self.assertFalse(any("COUNT(" in q["sql"].upper() for q in ctx.captured_queries))
+            seen.extend(p["id"] for p in response.data["results"])
+            url, params, pages = response.data["next"], None, pages + 1
+        return seen, pages
+
+    def test_cursor_mode_walks_catalog_without_count(self):
+        seen, pages = self._walk({"pagination": "cursor"})
+        self.assertEqual(seen, [p.id for p in self.products])
+        self.assertEqual(pages, 3)
+
+    def test_cursor_mode_by_price(self):
+        Products.objects.filter(id=self.products[0].id).update(price=Decimal("1.00"))
+        seen, _ = self._walk({"pagination": "cursor", "order": "-price", "page_size": 7})
+        self.assertEqual(seen[-1], self.products[0].id)
+        self.assertEqual(len(seen), 25)
+
+    def test_page_number_clients_keep_working(self):
+        response = self.client.get(reverse("Products-list"), {"page": 3})
+        self.assertEqual(response.data["count"], 25)
+        self.assertEqual(len(response.data["results"]), 5)
+
+
+class CatalogFeedTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+        self.products = make_products(3)
+        ProductImage.objects.create(product=self.products[0], image="image/upload/v1/extra.jpg")
+
+    def _body(self, response):
+        return b"".join(response.streaming_content).decode()
+
+    def test_streams_full_catalog_as_json_array(self):
+        response = self.client.get(reverse("Products"))
+        data = json.loads(self._body(response))
+        self.assertEqual([p["id"] for p in data], [p.id for p in self.products])
+        self.assertEqual(len(data[0]["extra_images"]), 1)
+
+    def test_streams_ndjson(self):
+        response = self.client.get(reverse("Products"), {"stream": "ndjson"})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = self._body(response).splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines], [p.id for p in self.products])
+
+    def test_unchanged_catalog_returns_304_after_one_version_read(self):
+        etag = self.client.get(reverse("Products"))["ETag"]
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("Products"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.products[1].name = "Renamed"
+        self.products[1].save()
+        response = self.client.get(reverse("Products"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_version_survives_a_cleared_cache(self):
+        # another process bumping the version is only visible through the database
+        etag = self.client.get(reverse("Products"))["ETag"]
+        cache.clear()
+        self.assertEqual(self.client.get(reverse("Products"), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Products.objects.bulk_create_with_slugs([Products(name="Bulk", price=Decimal("1.00"))])
+        cache.clear()
+        self.assertEqual(self.client.get(reverse("Products"), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(PRODUCT_CACHE_ALIAS="default")
+class ProductDetailCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+        self.product, *self.others = make_products(7, category="PHONES")
+
+    def _detail(self, slug):
+        response = self.client.get(reverse("product-detail", args=[slug]))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_repeat_views_are_served_from_cache(self):
+        data = self._detail(self.product.slug)
+        self.assertEqual([p["id"] for p in data["similar_products"]], [p.id for p in self.others[:5]])
+        with self.assertNumQueries(0):
+            self.assertEqual(self._detail(self.product.slug), data)
+
+    def test_product_change_invalidates_its_detail(self):
+        self._detail(self.product.slug)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.description = "Updated"
+            self.product.save()
+        self.assertEqual(self._detail(self.product.slug)["description"], "Updated")
+
+    def test_invalidation_waits_for_commit(self):
+        data = self._detail(self.product.slug)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.product.description = "Updated"
+            self.product.save()
+            # a read before commit sees the old version, so nothing it caches
+            # outlives the commit
+            self.assertEqual(self._detail(self.product.slug)["description"], data["description"])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self._detail(self.product.slug)["description"], "Updated")
+
+    def test_process_local_cache_is_rejected(self):
+        self.assertEqual([e.id for e in check_product_cache(None)], ["Shopping_App.E004"])
+        with self.settings(PRODUCT_CACHE_ALIAS=""):
+            self.assertEqual(check_product_cache(None), [])
+            self._detail(self.product.slug)
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.product.description = "Updated"
+                self.product.save()
+            self.assertEqual(callbacks, [])
+            self.assertEqual(self._detail(self.product.slug)["description"], "Updated")
+
+    def test_category_changes_refresh_similar_products(self):
+        self._detail(self.product.slug)
+        moved = self.others[0]
+        moved.category = "CARS"
+        with self.captureOnCommitCallbacks(execute=True):
+            moved.save()
+        ids = [p["id"] for p in self._detail(self.product.slug)["similar_products"]]
+        self.assertNotIn(moved.id, ids)
+        self.assertEqual(ids, [p.id for p in self.others[1:6]])
+
+    def test_extra_image_change_refreshes_similar_products(self):
+        self._detail(self.product.slug)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(product=self.others[0], image="image/upload/v1/new.jpg")
+        similar = self._detail(self.product.slug)["similar_products"]
+        self.assertEqual(len(similar[0]["extra_images"]), 1)
+
+
+class ProductSlugTests(TestCase):
+    def test_slugs_are_numbered_in_order(self):
+        slugs = [Products.objects.create(name="iPhone 15 Case", price=1).slug for _ in range(3)]
+        self.assertEqual(slugs, ["iphone-15-case", "iphone-15-case-1", "iphone-15-case-2"])
+
+    def test_slug_allocation_is_one_query_regardless_of_collisions(self):
+        for _ in range(20):
+            Products.objects.create(name="iPhone 15 Case", price=1)
+        Products.objects.create(name="iPhone 15 Case Pro", price=1)
+        with self.assertNumQueries(1):
+            slug = Products.objects.allocate_slugs(["iPhone 15 Case"])[0]
+        self.assertEqual(slug, "iphone-15-case-20")
+
+    def test_long_numeric_tails_are_not_suffixes(self):
+        # would overflow a 32-bit integer cast if read as a suffix
+        Products.objects.create(name="Watch 20240101123456", price=1)
+        Products.objects.create(name="Watch", price=1)
+        self.assertEqual(Products.objects.create(name="Watch", price=1).slug, "watch-1")
+
+    def test_bulk_create_with_slugs(self):
+        Products.objects.create(name="Mug", price=1)
+        created = Products.objects.bulk_create_with_slugs(
+            [Products(name="Mug", price=1) for _ in range(3)] + [Products(name="Lamp", price=1)]
+        )
+        self.assertEqual([p.slug for p in created], ["mug-1", "mug-2", "mug-3", "lamp"])
+
+    def test_duplicate_slug_is_rejected(self):
+        Products.objects.create(name="Mug", price=1)
+        with self.assertRaises(IntegrityError):
+            Products.objects.create(name="Other", slug="mug", price=1)
+
+
+class FakeUploader:
+    """Local stand-in for Cloudinary: fails sources containing "broken"."""
+
+    calls = []
+
+    def __call__(self, source):
+        name = str(getattr(source, "name", source))
+        FakeUploader.calls.append(name)
+        if "broken" in name:
+            raise ConnectionError("upload refused")
+        return f"image/upload/v1/{os.path.basename(name)}"
+
+
+@override_settings(PRODUCT_IMAGE_UPLOADER="Shopping_App.tests.FakeUploader")
+class ImportProductsCommandTests(TestCase):
+    def setUp(self):
+        FakeUploader.calls = []
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w") as handle:
+            handle.write(content)
+        return path
+
+    def _run(self, path, *args):
+        out = StringIO()
+        call_command("import_products", path, "--retries", "0", *args, stdout=out)
+        return out.getvalue()
+
+    def test_imports_csv_in_batches_with_images(self):
+        path = self._write(
+            "products.csv",
+            "name,price,category,image,extra_images\n"
+            "Mug,10.00,Accessory,mug.jpg,mug-2.jpg|mug-3.jpg\n"
+            "Mug,12.50,,mug.jpg,\n"
+            "Lamp,30,ELECTRONICS,,\n",
+        )
+        output = self._run(path, "--batch-size", "2")
+        self.assertIn("rows/sec", output)
+
+        mugs = Products.objects.filter(name="Mug").order_by("id")
+        self.assertEqual([p.slug for p in mugs], ["mug", "mug-1"])
+        self.assertEqual(mugs[0].category, "ACCESSORY")
+        self.assertEqual(mugs[0].extra_images.count(), 2)
+        self.assertEqual(Products.objects.get(name="Lamp").category, "ELECTRONICS")
+        # identical sources in a batch are uploaded once
+        self.assertEqual(sorted(FakeUploader.calls), ["mug-2.jpg", "mug-3.jpg", "mug.jpg"])
+
+    def test_failed_rows_are_reported_and_import_resumes(self):
+        rows = [
+            {"name": "Good", "price": "1"},
+            {"name": "Bad image", "price": "1", "image": "broken.jpg"},
+            {"name": "", "price": "1"},
+            {"name": "Later", "price": "1"},
+        ]
+        path = self._write("products.jsonl", "".join(json.dumps(r) + "\n" for r in rows[:3]))
+        self._run(path)
+        self.assertEqual(list(Products.objects.values_list("name", flat=True)), ["Good"])
+        with open(f"{path}.failed.jsonl") as handle:
+            self.assertEqual(len(handle.readlines()), 2)
+
+        with open(path, "a") as handle:
+            handle.write(json.dumps(rows[3]) + "\n")
+        output = self._run(path)
+        self.assertIn("Resuming after 3 row(s).", output)
+        self.assertEqual(sorted(Products.objects.values_list("name", flat=True)), ["Good", "Later"])
+
+    def test_malformed_json_lines_are_reported_not_fatal(self):
+        path = self._write("products.jsonl", '{"name": "Good", "price": "1"}\n\n{"name": "Bro\n[1, 2]\n'
+                                             '{"name": "After", "price": "2"}\n')
+        output = self._run(path)
+        self.assertIn("Imported 2 product(s)", output)
+        with open(f"{path}.failed.jsonl") as handle:
+            errors = [json.loads(line)["error"] for line in handle]
+        self.assertTrue(errors[0].startswith("line 3: invalid JSON"), errors)
+        self.assertEqual(errors[1], "line 4: expected a JSON object")
+
+    def test_catalog_version_is_bumped_once_per_run(self):
+        path = self._write("products.jsonl", "".join(
+            json.dumps({"name": f"P{i}", "price": "1"}) + "\n" for i in range(5)
+        ))
+        with mock.patch(
+            "Shopping_App.management.commands.import_products.bump_catalog_version"
+        ) as bump, mock.patch("Shopping_App.cache.bump_catalog_version") as inner_bump:
+            self._run(path, "--batch-size", "2")
+        self.assertEqual(bump.call_count, 1)
+        inner_bump.assert_not_called()
+
+
+def png_upload(name):
+    buffer = BytesIO()
+    Image.new("RGB", (2, 2)).save(buffer, format="PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+@override_settings(PRODUCT_IMAGE_UPLOADER="Shopping_App.tests.FakeUploader", IMAGE_UPLOAD_RETRIES=0)
+class ProductExtraImageUploadTests(TestCase):
+    def setUp(self):
+        FakeUploader.calls = []
+
+    def _create(self, *names):
+        serializer = ProductsSerializer(
+            data={"name": "Camera", "price": "10.00", "uploaded_images": [png_upload(n) for n in names]}
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        return serializer.save(), serializer
+
+    def test_rows_are_pending_until_the_upload_job_runs(self):
+        product, serializer = self._create("a.png", "b.png", "broken.png")
+        self.assertEqual(FakeUploader.calls, [])
+        self.assertEqual(
+            set(product.extra_images.values_list("status", flat=True)), {ProductImage.PENDING}
+        )
+        self.assertEqual(serializer.data["extra_images"], [])
+        self.assertEqual(ImageUpload.objects.count(), 3)
+
+        self.assertEqual(work(burst=True), 1)
+        statuses = sorted(product.extra_images.values_list("status", flat=True))
+        self.assertEqual(statuses, [ProductImage.FAILED, ProductImage.READY, ProductImage.READY])
+        uploaded = product.extra_images.exclude(image=None).values_list("image", flat=True)
+        self.assertEqual(sorted(image.public_id for image in uploaded), ["a", "b"])
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_uploads_survive_a_worker_dying_mid_upload(self):
+        self._create("a.png")
+        # a worker that died mid-upload: the job is requeued and the file is still stored
+        job_row = claim_job("gone")
+        Job.objects.filter(id=job_row.id).update(started_at=timezone.now() - timedelta(hours=1))
+        requeue_stale_jobs()
+        work(burst=True)
+        self.assertEqual(list(ProductImage.objects.values_list("status", flat=True)), [ProductImage.READY])
+
+    def test_pending_rows_are_inserted_in_one_query(self):
+        images = [png_upload(f"{i}.png") for i in range(8)]
+        serializer = ProductsSerializer(
+            data={"name": "Camera", "price": "10.00", "uploaded_images": images}
+        )
+        self.assertTrue(serializer.is_valid())
+        with CaptureQueriesContext(connection) as ctx:
+            serializer.save()
+        inserts = [q for q in ctx.captured_queries if 'INSERT INTO "Shopping_App_productimage"' in q["sql"]]
+        self.assertEqual(len(inserts), 1)
+
+
+class ImageUrlTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = Products.objects.create(name="Watch", price=5, image="image/upload/v7/watch.jpg")
+        ProductImage.objects.create(product=self.product, image="image/upload/v7/strap.jpg")
+
+    def test_thumbnail_preset_applies_to_list_pages(self):
+        response = self.client.get(reverse("Products-list"), {"image_preset": "thumbnail"})
+        product = response.data["results"][0]
+        self.assertIn("c_fill,f_auto,h_300,q_auto,w_300", product["image"])
+        self.assertIn("/v7/watch.jpg", product["image"])
+        self.assertIn("c_fill", product["extra_images"][0]["image"])
+
+        plain = self.client.get(reverse("Products-list"), {"image_preset": "bogus"}).data["results"][0]
+        self.assertTrue(plain["image"].endswith("/image/upload/v7/watch.jpg"))
+
+    def test_urls_are_memoized(self):
+        image_url(self.product.image, "detail")
+        hits = _build_image_url.cache_info().hits
+        image_url(Products.objects.get(pk=self.product.pk).image, "detail")
+        self.assertEqual(_build_image_url.cache_info().hits, hits + 1)
+
+
+class AddItemConcurrencyTests(TransactionTestCase):
+    def test_parallel_adds_do_not_lose_increments(self):
+        product = make_products(1, price="10.00")[0]
+        workers, adds_each = 8, 5
+        barrier = threading.Barrier(workers)
+        errors = []
+
+        def add_once():
+            # SQLite's shared-cache test database reports writer contention
+            # as "table is locked" instead of waiting; each add is atomic, so
+            # retrying it is safe and still catches lost increments.
+            for _ in range(200):
+                try:
+                    return add_to_cart("race", product, 1)
+                except OperationalError as exc:
+                    if "locked" not in str(exc):
+                        raise
+                    time.sleep(0.005)
+            raise AssertionError("add_to_cart never acquired the database")
+
+        def worker():
+            try:
+                barrier.wait()
+                for _ in range(adds_each):
+                    add_once()
+            except Exception as exc:  # pragma: no cover - surfaced below
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        cart = Cart.objects.get(cart_code="race")
+        self.assertEqual(CartItem.objects.get(cart=cart).quantity, workers * adds_each)
+        self.assertEqual((cart.item_count, cart.subtotal), (workers * adds_each, Decimal("400.00")))
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.a, self.b, self.c = make_products(3, price="10.00")
+
+    def _batch(self, operations, cart_code="batch"):
+        return self.client.post(
+            reverse("cart_batch"), {"cart_code": cart_code, "operations": operations}, format="json"
+        )
+
+    def test_operations_are_applied_in_order_and_cart_returned_once(self):
+        self._batch([{"op": "add", "product_id": self.a.id, "quantity": 2}])
+        response = self._batch([
+            {"op": "add", "product_id": self.a.id, "quantity": 1},
+            {"op": "add", "product_id": self.b.id, "quantity": 5},
+            {"op": "set", "product_id": self.b.id, "quantity": 2},
+            {"op": "add", "product_id": self.c.id},
+            {"op": "remove", "product_id": self.c.id},
+        ])
+        self.assertEqual(response.status_code, 200)
+        lines = {item["product"]["id"]: item["quantity"] for item in response.data["cart"]["items"]}
+        self.assertEqual(lines, {self.a.id: 3, self.b.id: 2})
+        cart = Cart.objects.get(cart_code="batch")
+        self.assertEqual((cart.item_count, cart.subtotal), (5, Decimal("50.00")))
+
+    def test_query_count_does_not_grow_with_operations(self):
+        counts = []
+        for code, products in (("small", make_products(2)), ("large", make_products(20))):
+            operations = [{"op": "add", "product_id": p.id, "quantity": 2} for p in products]
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self._batch(operations, cart_code=code).status_code, 200)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_unknown_product_rejects_whole_batch(self):
+        response = self._batch([
+            {"op": "add", "product_id": self.a.id},
+            {"op": "add", "product_id": 999999},
+        ])
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(CartItem.objects.filter(cart__cart_code="batch").exists())
+
+    def test_paid_carts_are_not_changed(self):
+        self._batch([{"op": "add", "product_id": self.a.id, "quantity": 2}])
+        Cart.objects.filter(cart_code="batch").update(paid=True)
+        response = self._batch([
+            {"op": "set", "product_id": self.a.id, "quantity": 9},
+            {"op": "remove", "product_id": self.a.id},
+        ])
+        self.assertEqual(response.status_code, 409)
+        cart = Cart.objects.get(cart_code="batch")
+        self.assertEqual((cart.item_count, cart.subtotal), (2, Decimal("20.00")))
+        self.assertEqual(list(cart.items.values_list("quantity", flat=True)), [2])
+
+
+class CheckProductInCartTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.products = make_products(24)
+        cart = Cart.objects.create(cart_code="grid")
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=3)
+        CartItem.objects.create(cart=cart, product=self.products[5], quantity=1)
+
+    def test_grid_membership_in_one_query(self):
+        ids = ",".join(str(p.id) for p in self.products)
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                reverse("check_product_in_cart"), {"cart_code": "grid", "product_ids": ids}
+            )
+        items = response.data["items"]
+        self.assertEqual(len(items), 24)
+        self.assertEqual(items[self.products[0].id], 3)
+        self.assertEqual(items[self.products[5].id], 1)
+        self.assertEqual(items[self.products[1].id], 0)
+
+    def test_single_product_keeps_exists_flag(self):
+        url = reverse("check_product_in_cart")
+        response = self.client.get(url, {"cart_code": "grid", "product_id": self.products[0].id})
+        self.assertTrue(response.data["exists"])
+        response = self.client.get(url, {"cart_code": "grid", "product_id": self.products[1].id})
+        self.assertFalse(response.data["exists"])
+
+    def test_missing_cart_or_product_is_not_an_error(self):
+        url = reverse("check_product_in_cart")
+        response = self.client.get(url, {"cart_code": "nope", "product_id": 999999})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"exists": False, "items": {999999: 0}})
+        self.assertEqual(self.client.get(url, {"cart_code": "grid", "product_id": "x"}).status_code, 400)
+
+
+class StubGateway:
+    """Local HTTP server answering with scripted (status, body, delay) replies per route.
+
+    A status of None drops the connection without answering.
+    """
+
+    def __init__(self, routes):
+        self.routes = {key: list(replies) for key, replies in routes.items()}
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                stub.requests.append((self.command, self.path, self.client_address[1], body))
+                replies = stub.routes.get((self.command, self.path), [(404, {}, 0)])
+                status, payload, delay = replies.pop(0) if len(replies) > 1 else replies[0]
+                time.sleep(delay)
+                if status is None:
+                    self.close_connection = True
+                    return
+                data = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    pass
+
+            do_GET = do_POST = _reply
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def hits(self, method, path):
+        return sum(1 for m, p, _, _ in self.requests if (m, p) == (method, path))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class PaymentClientTests(TestCase):
+    verify = "/v3/transactions/42/verify"
+
+    def gateway(self, routes):
+        stub = StubGateway(routes)
+        self.addCleanup(stub.close)
+        return stub
+
+    def client_for(self, stub, **options):
+        options = {"read_timeout": 1.0, "max_retries": 2, "backoff": 0, **options}
+        return FlutterwaveClient("sk-test", base_url=stub.url, **options)
+
+    def test_connection_is_kept_alive_between_calls(self):
+        stub = self.gateway({("GET", self.verify): [(200, {"status": "success"}, 0)]})
+        client = self.client_for(stub)
+        for _ in range(3):
+            self.assertEqual(client.verify_transaction(42).json(), {"status": "success"})
+        self.assertEqual(len({port for _, _, port, _ in stub.requests}), 1)
+
+    def test_idempotent_calls_retry_server_errors(self):
+        stub = self.gateway({("GET", self.verify): [(503, {}, 0), (502, {}, 0), (200, {"status": "success"}, 0)]})
+        response = self.client_for(stub).verify_transaction(42)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(stub.hits("GET", self.verify), 3)
+
+    def test_payment_creation_is_never_resent(self):
+        stub = self.gateway({("POST", "/v3/payments"): [(503, {}, 0)]})
+        client = self.client_for(stub)
+        self.assertEqual(client.create_payment({"tx_ref": "a"}).status_code, 503)
+        self.assertEqual(stub.hits("POST", "/v3/payments"), 1)
+
+        stub.routes[("POST", "/v3/payments")] = [(200, {}, 0.5)]
+        with self.assertRaises(GatewayUnavailable):
+            self.client_for(stub, read_timeout=0.1).create_payment({"tx_ref": "b"})
+        self.assertEqual(stub.hits("POST", "/v3/payments"), 2)
+
+    def test_payment_creation_is_not_resent_after_a_dropped_connection(self):
+        stub = self.gateway({
+            ("POST", "/v3/payments"): [(None, {}, 0)],
+            ("GET", self.verify): [(None, {}, 0), (200, {"status": "success"}, 0)],
+        })
+        client = self.client_for(stub)
+        with self.assertRaises(GatewayUnavailable):
+            client.create_payment({"tx_ref": "a"})
+        self.assertEqual(stub.hits("POST", "/v3/payments"), 1)
+        self.assertEqual(client.verify_transaction(42).status_code, 200)
+
+    def test_refused_connections_are_retried_for_any_method(self):
+        stub = self.gateway({})
+        stub.close()
+        client = self.client_for(stub)
+        with mock.patch.object(client.session, "request", wraps=client.session.request) as sent:
+            with self.assertRaises(GatewayUnavailable):
+                client.create_payment({"tx_ref": "a"})
+        self.assertEqual(sent.call_count, 3)
+
+    def test_breaker_opens_and_fails_fast(self):
+        stub = self.gateway({("GET", self.verify): [(500, {}, 0)]})
+        client = self.client_for(stub, max_retries=0, breaker=CircuitBreaker(failure_threshold=2))
+        client.verify_transaction(42)
+        client.verify_transaction(42)
+        with self.assertRaises(GatewayUnavailable):
+            client.verify_transaction(42)
+        self.assertEqual(stub.hits("GET", self.verify), 2)
+
+    def test_breaker_half_opens_after_reset_timeout(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        now[0] = 11
+        self.assertEqual(breaker.state, "half-open")
+        # one trial call at a time
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        now[0] = 22
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_async_variant(self):
+        stub = self.gateway({("GET", self.verify): [(200, {"status": "success"}, 0)]})
+        response = asyncio.run(self.client_for(stub).averify_transaction(42))
+        self.assertEqual(response.json(), {"status": "success"})
+
+    def test_paypal_token_is_reused(self):
+        stub = self.gateway({
+            ("POST", "/v1/oauth2/token"): [(200, {"access_token": "tok", "expires_in": 3600}, 0)],
+            ("POST", "/v1/payments/payment/PAY-1/execute"): [(200, {"state": "approved"}, 0)],
+        })
+        client = PayPalClient("id", "secret", base_url=stub.url, backoff=0)
+        client.execute_payment("PAY-1", "PAYER")
+        client.execute_payment("PAY-1", "PAYER")
+        self.assertEqual(stub.hits("POST", "/v1/oauth2/token"), 1)
+
+
+class PaymentViewTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="payer", email="p@example.com", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        cart = Cart.objects.create(cart_code="pay")
+        fill_cart(cart, make_products(2, price="10.00"))
+
+    def gateway(self, routes):
+        stub = StubGateway(routes)
+        self.addCleanup(stub.close)
+        return stub
+
+    def test_flutterwave_initiate_goes_through_the_client(self):
+        stub = self.gateway({("POST", "/v3/payments"): [(200, {"data": {"link": "https://pay/abc"}}, 0)]})
+        with self.settings(FLUTTERWAVE_BASE_URL=stub.url):
+            response = self.client.post(reverse("initiate_payment"), {"cart_code": "pay"})
+        self.assertEqual(response.data, {"payment_link": "https://pay/abc"})
+        self.assertEqual(json.loads(stub.requests[0][3])["amount"], "1520.00")
+
+    def test_unreachable_gateway_is_a_503(self):
+        stub = self.gateway({})
+        url = stub.url
+        stub.close()
+        with self.settings(FLUTTERWAVE_BASE_URL=url, PAYMENT_MAX_RETRIES=0):
+            response = self.client.post(reverse("initiate_payment"), {"cart_code": "pay"})
+        self.assertEqual(response.status_code, 503)
+
+    def test_paypal_create_and_execute(self):
+        stub = self.gateway({
+            ("POST", "/v1/oauth2/token"): [(200, {"access_token": "tok", "expires_in": 3600}, 0)],
+            ("POST", "/v1/payments/payment"): [
+                (201, {"id": "PAY-1", "links": [{"rel": "approval_url", "href": "https://pp/ok"}]}, 0)
+            ],
+            ("GET", "/v1/payments/payment/PAY-1"): [(200, {"state": "created"}, 0)],
+            ("POST", "/v1/payments/payment/PAY-1/execute"): [(200, {"state": "approved"}, 0)],
+        })
+        with self.settings(PAYPAL_BASE_URL=stub.url, BACKGROUND_TASKS_INLINE=True):
+            response = self.client.post(reverse("initiate_paypal_payment"), {"cart_code": "pay"})
+            self.assertEqual(response.data, {"approval_url": "https://pp/ok"})
+            txn = Transaction.objects.get(cart__cart_code="pay")
+            self.assertEqual(txn.provider_ref, "PAY-1")
+            url = reverse("paypal_payment_callback")
+            params = {"paymentId": "PAY-1", "PayerID": "X", "ref": txn.ref}
+            # execution is queued; the redirect only reports local state
+            self.assertEqual(self.client.post(url, params).status_code, 202)
+            self.assertTrue(Cart.objects.get(cart_code="pay").paid)
+            response = self.client.post(url, params)
+        self.assertEqual(response.data["message"], "Payment successful")
+        self.assertEqual(stub.hits("POST", "/v1/payments/payment/PAY-1/execute"), 1)
+
+    def paypal_job(self, routes):
+        stub = self.gateway({("POST", "/v1/oauth2/token"): [(200, {"access_token": "t", "expires_in": 3600}, 0)],
+                             **routes})
+        txn = Transaction.objects.create(
+            ref="ref-pp", provider_ref="PAY-2", cart=Cart.objects.get(cart_code="pay"), user=self.user,
+            amount=Decimal("1520.00"),
+        )
+        with self.settings(PAYPAL_BASE_URL=stub.url, PAYMENT_MAX_RETRIES=0):
+            queued = enqueue(execute_paypal_payment, txn.ref, "PAY-2", "X")
+            work(burst=True)
+        queued.refresh_from_db()
+        txn.refresh_from_db()
+        return stub, queued, txn
+
+    @override_settings(JOB_RETRY_BACKOFF=0)
+    def test_paypal_server_errors_are_retried_without_executing_twice(self):
+        # the first execute fails with a 503; the retry finds the payment already approved
+        stub, queued, txn = self.paypal_job({
+            ("GET", "/v1/payments/payment/PAY-2"): [(200, {"state": "created"}, 0), (200, {"state": "approved"}, 0)],
+            ("POST", "/v1/payments/payment/PAY-2/execute"): [(503, {}, 0)],
+        })
+        self.assertEqual((queued.status, queued.attempts), (Job.DONE, 2))
+        self.assertEqual(txn.status, Transaction.COMPLETED)
+        self.assertEqual(stub.hits("POST", "/v1/payments/payment/PAY-2/execute"), 1)
+
+    def test_paypal_payment_already_done_settles_from_its_state(self):
+        _, queued, txn = self.paypal_job({
+            ("GET", "/v1/payments/payment/PAY-2"): [(200, {"state": "created"}, 0), (200, {"state": "approved"}, 0)],
+            ("POST", "/v1/payments/payment/PAY-2/execute"): [(400, {"name": "PAYMENT_ALREADY_DONE"}, 0)],
+        })
+        self.assertEqual((queued.status, txn.status), (Job.DONE, Transaction.COMPLETED))
+
+    @override_settings(JOB_RETRY_BACKOFF=60)
+    def test_unknown_paypal_state_is_retried_later(self):
+        stub, queued, txn = self.paypal_job({
+            ("GET", "/v1/payments/payment/PAY-2"): [(500, {}, 0)],
+        })
+        self.assertEqual((queued.status, txn.status), (Job.QUEUED, Transaction.PENDING))
+        self.assertIn("PaymentGatewayError", queued.last_error)
+        self.assertEqual(stub.hits("POST", "/v1/payments/payment/PAY-2/execute"), 0)
+
+
+@override_settings(BACKGROUND_TASKS_INLINE=True, FLUTTERWAVE_WEBHOOK_HASH="hush", PAYPAL_WEBHOOK_ID="WH-1")
+class PaymentWebhookTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="hooked", password="x")
+        self.cart = Cart.objects.create(cart_code="hook")
+        self.txn = Transaction.objects.create(
+            ref="ref-1", provider_ref="PAY-9", cart=self.cart, user=self.user, amount=Decimal("1520.00")
+        )
+        self.client = APIClient()
+
+    def gateway(self, routes):
+        stub = StubGateway(routes)
+        self.addCleanup(stub.close)
+        return stub
+
+    def verify_route(self, **data):
+        charge = {"status": "successful", "tx_ref": "ref-1", "amount": 1520, "currency": "NGN", **data}
+        return {("GET", "/v3/transactions/77/verify"): [(200, {"status": "success", "data": charge}, 0)]}
+
+    def flutterwave_hook(self, secret="hush"):
+        return self.client.post(
+            reverse("flutterwave_webhook"),
+            {"event": "charge.completed", "data": {"id": 77, "tx_ref": "ref-1", "status": "successful"}},
+            format="json",
+            HTTP_VERIF_HASH=secret,
+        )
+
+    def test_flutterwave_webhook_confirms_once(self):
+        stub = self.gateway(self.verify_route())
+        with self.settings(FLUTTERWAVE_BASE_URL=stub.url):
+            self.assertEqual(self.flutterwave_hook().status_code, 200)
+            self.assertEqual(self.flutterwave_hook().status_code, 200)
+        self.txn.refresh_from_db()
+        self.cart.refresh_from_db()
+        self.assertEqual(self.txn.status, Transaction.COMPLETED)
+        self.assertTrue(self.cart.paid)
+        self.assertEqual(self.cart.user, self.user)
+        self.assertEqual(stub.hits("GET", "/v3/transactions/77/verify"), 1)
+
+    def test_flutterwave_webhook_rejects_bad_hash_and_mismatched_amount(self):
+        stub = self.gateway(self.verify_route(amount=1))
+        with self.settings(FLUTTERWAVE_BASE_URL=stub.url):
+            self.assertEqual(self.flutterwave_hook(secret="nope").status_code, 401)
+            self.assertEqual(stub.hits("GET", "/v3/transactions/77/verify"), 0)
+            self.flutterwave_hook()
+        self.txn.refresh_from_db()
+        self.assertEqual(self.txn.status, Transaction.PENDING)
+
+    def test_redirect_callback_reads_local_state(self):
+        confirm_transaction("ref-1")
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                reverse("payment_callback"), {"transaction_id": 77, "tx_ref": "ref-1", "status": "successful"}
+            )
+        self.assertEqual(response.data["status"], Transaction.COMPLETED)
+
+    def test_confirm_transaction_is_idempotent(self):
+        self.assertTrue(confirm_transaction("ref-1"))
+        self.assertFalse(confirm_transaction("ref-1"))
+
+    def paypal_hook(self, event, **headers):
+        signature = {
+            "HTTP_PAYPAL_AUTH_ALGO": "SHA256withRSA",
+            "HTTP_PAYPAL_CERT_URL": "https://api.paypal.com/cert",
+            "HTTP_PAYPAL_TRANSMISSION_ID": "t",
+            "HTTP_PAYPAL_TRANSMISSION_SIG": "sig",
+            "HTTP_PAYPAL_TRANSMISSION_TIME": "2026-10-18T12:00:00Z",
+            **headers,
+        }
+        return self.client.post(reverse("paypal_webhook"), event, format="json", **signature)
+
+    def test_paypal_webhook_refuses_unverifiable_requests_without_queueing(self):
+        event = {"id": "EV-1", "event_type": "PAYMENT.SALE.COMPLETED", "resource": {"parent_payment": "PAY-9"}}
+        self.assertEqual(self.paypal_hook(event, HTTP_PAYPAL_TRANSMISSION_SIG="").status_code, 400)
+        self.assertEqual(self.paypal_hook({**event, "event_type": "BILLING.PLAN.CREATED"}).status_code, 400)
+        with self.settings(PAYPAL_WEBHOOK_ID=""):
+            self.assertEqual(self.paypal_hook(event).status_code, 400)
+        self.assertFalse(Job.objects.exists())
+
+    def test_paypal_webhook_is_verified_with_paypal(self):
+        event = {"id": "EV-1", "event_type": "PAYMENT.SALE.COMPLETED", "resource": {"parent_payment": "PAY-9"}}
+        stub = self.gateway({
+            ("POST", "/v1/oauth2/token"): [(200, {"access_token": "tok", "expires_in": 3600}, 0)],
+            ("POST", "/v1/notifications/verify-webhook-signature"): [
+                (200, {"verification_status": "FAILURE"}, 0),
+                (200, {"verification_status": "SUCCESS"}, 0),
+            ],
+        })
+        with self.settings(PAYPAL_BASE_URL=stub.url):
+            self.paypal_hook(event)
+            self.txn.refresh_from_db()
+            self.assertEqual(self.txn.status, Transaction.PENDING)
+            self.paypal_hook(event)
+        self.txn.refresh_from_db()
+        self.assertEqual(self.txn.status, Transaction.COMPLETED)
+        sent = json.loads(stub.requests[-1][3])
+        self.assertEqual((sent["webhook_id"], sent["transmission_id"]), ("WH-1", "t"))
+
+
+class PricingTests(TestCase):
+    def setUp(self):
+        self.cart = Cart.objects.create(cart_code="big")
+        products = make_products(500, price="19.99")
+        CartItem.objects.bulk_create(
+            CartItem(cart=self.cart, product=product, quantity=i % 7 + 1) for i, product in enumerate(products)
+        )
+        self.expected = sum(Decimal("19.99") * (i % 7 + 1) for i in range(500))
+
+    def test_large_cart_is_priced_in_one_query(self):
+        with self.assertNumQueries(1):
+            price = price_cart(self.cart, "NGN")
+        self.assertEqual(price.subtotal, self.expected)
+        self.assertEqual(price.tax, Decimal("1500.00"))
+        self.assertEqual(price.total, self.expected + Decimal("1500.00"))
+        self.assertEqual(price_cart(self.cart, "USD").tax, Decimal("1000.00"))
+
+    def test_prefetched_items_are_reused(self):
+        cart = Cart.objects.with_items().get(pk=self.cart.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(cart_subtotal(cart), self.expected)
+
+    def test_empty_cart_and_unknown_currency(self):
+        empty = Cart.objects.create(cart_code="empty")
+        self.assertEqual(price_cart(empty, "NGN").total, Decimal("1500.00"))
+        with self.assertRaises(ValueError):
+            price_cart(empty, "EUR")
+
+    def test_payment_amount_uses_the_aggregate(self):
+        user = get_user_model().objects.create_user(username="bigspender", password="x")
+        client = APIClient()
+        client.force_authenticate(user)
+        stub = StubGateway({("POST", "/v3/payments"): [(200, {"data": {"link": "https://pay/x"}}, 0)]})
+        self.addCleanup(stub.close)
+        with self.settings(FLUTTERWAVE_BASE_URL=stub.url):
+            client.post(reverse("initiate_payment"), {"cart_code": "big"})
+        txn = Transaction.objects.get(cart=self.cart)
+        self.assertEqual(txn.amount, self.expected + Decimal("1500.00"))
+
+
+job_calls = []
+
+
+@job
+def record_call(value):
+    job_calls.append(value)
+
+
+@job(max_attempts=2)
+def always_fails():
+    raise RuntimeError("boom")
+
+
+@job
+def oversleeps():
+    time.sleep(5)
+
+
+class FakeProcess:
+    """Stands in for a worker process; `exitcode` is what it "died" with."""
+
+    def __init__(self, index, exitcode=None):
+        self.index, self.exitcode, self.terminated = index, exitcode, False
+
+    def is_alive(self):
+        return self.exitcode is None and not self.terminated
+
+    def join(self):
+        pass
+
+    def terminate(self):
+        self.terminated = True
+
+
+@override_settings(JOB_RETRY_BACKOFF=0)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        job_calls.clear()
+
+    def test_worker_runs_queued_jobs_and_records_timings(self):
+        enqueue(record_call, "a")
+        enqueue(record_call, "b")
+        self.assertEqual(job_calls, [])
+        self.assertEqual(work(burst=True), 2)
+        self.assertEqual(job_calls, ["a", "b"])
+        done = Job.objects.get(payload__args=["a"])
+        self.assertEqual((done.status, done.attempts), (Job.DONE, 1))
+        self.assertIsNotNone(done.duration_ms)
+        self.assertIsNotNone(done.wait_ms)
+
+    def test_a_job_is_claimed_once(self):
+        queued = enqueue(record_call, "x")
+        self.assertEqual(claim_job("w1").id, queued.id)
+        self.assertIsNone(claim_job("w2"))
+
+    def test_failures_retry_then_go_dead(self):
+        failing = enqueue(always_fails)
+        work(burst=True)
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts), (Job.DEAD, 2))
+        self.assertIn("boom", failing.last_error)
+
+        out = StringIO()
+        call_command("run_workers", retry_dead=True, stdout=out)
+        self.assertIn("Requeued 1", out.getvalue())
+        self.assertEqual(Job.objects.get(id=failing.id).status, Job.QUEUED)
+
+    def test_old_done_jobs_are_pruned(self):
+        for name in ("old", "recent"):
+            enqueue(record_call, name)
+        broken = enqueue(always_fails)
+        work(burst=True)
+        Job.objects.exclude(payload__args=["recent"]).update(finished_at=timezone.now() - timedelta(days=30))
+
+        out = StringIO()
+        call_command("run_workers", prune_done=True, stdout=out)
+        self.assertIn("Deleted 1 done job(s)", out.getvalue())
+        # recent and dead jobs are kept
+        self.assertEqual(Job.objects.count(), 2)
+        self.assertTrue(Job.objects.filter(id=broken.id, status=Job.DEAD).exists())
+
+        call_command("run_workers", prune_done=True, retention_days=0, stdout=StringIO())
+        self.assertEqual(list(Job.objects.values_list("id", flat=True)), [broken.id])
+
+    def test_backoff_delays_the_retry(self):
+        with self.settings(JOB_RETRY_BACKOFF=60):
+            failing = enqueue(always_fails)
+            work(burst=True)
+        failing.refresh_from_db()
+        self.assertEqual(failing.status, Job.QUEUED)
+        self.assertIsNone(claim_job("w"))
+
+    def test_orphaned_jobs_are_requeued(self):
+        stuck = enqueue(record_call, "late")
+        claim_job("gone")
+        Job.objects.filter(id=stuck.id).update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(work(burst=True), 1)
+
+    def test_jobs_that_keep_killing_their_worker_end_up_dead(self):
+        crasher = enqueue(record_call, "crash")
+        Job.objects.filter(id=crasher.id).update(max_attempts=2)
+        for _ in range(2):
+            claim_job("gone")
+            Job.objects.filter(id=crasher.id).update(started_at=timezone.now() - timedelta(hours=1))
+            requeue_stale_jobs()
+        crasher.refresh_from_db()
+        self.assertEqual((crasher.status, crasher.attempts), (Job.DEAD, 2))
+        self.assertIn("Worker stopped", crasher.last_error)
+        self.assertEqual(work(burst=True), 0)
+
+    @override_settings(JOB_RETRY_BACKOFF=60)
+    def test_jobs_over_the_time_limit_are_stopped_and_retried(self):
+        slow = enqueue(oversleeps)
+        started = time.monotonic()
+        work(burst=True, timeout=0.2)
+        self.assertLess(time.monotonic() - started, 2)
+        slow.refresh_from_db()
+        self.assertEqual((slow.status, slow.attempts), (Job.QUEUED, 1))
+        self.assertIn("JobTimeout", slow.last_error)
+
+    def test_worker_loop_requeues_orphaned_jobs_periodically(self):
+        stuck = enqueue(record_call, "late")
+        claim_job("gone")
+        Job.objects.filter(id=stuck.id).update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(work(burst=True, requeue_interval=60), 1)
+        self.assertEqual(job_calls, ["late"])
+
+    def test_supervisor_restarts_dead_workers_and_requeues_stale_jobs(self):
+        stuck = enqueue(record_call, "late")
+        claim_job("gone")
+        Job.objects.filter(id=stuck.id).update(started_at=timezone.now() - timedelta(hours=1))
+        spawned = []
+
+        def spawn(index):
+            # the first worker crashes straight away, its replacement stays up
+            process = FakeProcess(index, exitcode=-9 if not spawned else None)
+            spawned.append(process)
+            return process
+
+        rounds = iter(range(3))
+        restarts = supervise(
+            spawn, 1, should_stop=lambda: next(rounds, None) is None, check_interval=0, requeue_interval=0
+        )
+        self.assertEqual(restarts, 1)
+        self.assertEqual(len(spawned), 2)
+        self.assertTrue(spawned[1].terminated)
+        self.assertEqual(Job.objects.get(id=stuck.id).status, Job.QUEUED)
+
+    def test_supervisor_lets_burst_workers_finish(self):
+        spawned = []
+        restarts = supervise(
+            lambda index: spawned.append(FakeProcess(index, exitcode=0)) or spawned[-1], 2,
+            burst=True, check_interval=0,
+        )
+        self.assertEqual((restarts, len(spawned)), (0, 2))
+
+    def test_run_workers_command(self):
+        enqueue(record_call, "cmd")
+        out = StringIO()
+        call_command("run_workers", workers=1, burst=True, stdout=out)
+        self.assertIn("Processed 1 job(s)", out.getvalue())
+        out = StringIO()
+        call_command("run_workers", stats=True, stdout=out)
+        self.assertIn("record_call [done] count=1", out.getvalue())
+
+    @override_settings(FLUTTERWAVE_WEBHOOK_HASH="hush", PAYMENT_MAX_RETRIES=0, JOB_RETRY_BACKOFF=60)
+    def test_gateway_outage_leaves_verification_queued(self):
+        user = get_user_model().objects.create_user(username="queued", password="x")
+        Transaction.objects.create(
+            ref="q-1", cart=Cart.objects.create(cart_code="q"), user=user, amount=Decimal("10.00")
+        )
+        stub = StubGateway({})
+        stub.close()
+        with self.settings(FLUTTERWAVE_BASE_URL=stub.url):
+            response = APIClient().post(
+                reverse("flutterwave_webhook"), {"data": {"id": 5, "tx_ref": "q-1"}},
+                format="json", HTTP_VERIF_HASH="hush",
+            )
+            self.assertEqual(response.status_code, 200)
+            work(burst=True)
+        queued = Job.objects.get(name__endswith="verify_flutterwave_payment")
+        self.assertEqual(queued.status, Job.QUEUED)
+        self.assertIn("GatewayUnavailable", queued.last_error)
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="shopper", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        products = make_products(4)
+        ProductImage.objects.bulk_create(
+            ProductImage(product=product, image="image/upload/v1/extra.jpg") for product in products
+        )
+        for n in range(12):
+            cart = Cart.objects.create(cart_code=f"order{n}", user=self.user, paid=True)
+            fill_cart(cart, products, quantity=2)
+            Transaction.objects.create(
+                ref=f"order-ref-{n}", cart=cart, user=self.user, amount=Decimal("800.00"),
+                status=Transaction.COMPLETED,
+            )
+        Cart.objects.create(cart_code="open", user=self.user)
+
+    def test_history_is_paginated_in_constant_queries(self):
+        # count, carts, items + products, extra images, transactions
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse("order_history"))
+        self.assertEqual(response.data["count"], 12)
+        first = response.data["results"][0]
+        self.assertEqual(len(response.data["results"]), 10)
+        self.assertEqual(len(first["items"]), 4)
+        self.assertEqual(first["transaction"]["ref"], "order-ref-11")
+        self.assertEqual(len(first["items"][0]["product"]["extra_images"]), 1)
+
+        response = self.client.get(reverse("order_history"), {"page": 2})
+        self.assertEqual([o["order_id"] for o in response.data["results"]], ["order1", "order0"])
+
+    def test_user_info_is_profile_only(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("user_info"))
+        self.assertEqual(response.data["username"], "shopper")
+        self.assertNotIn("items", response.data)
+
+
+class RequestMetricsTests(TestCase):
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_requests_are_timed_and_queries_counted_per_view(self):
+        Cart.objects.create(cart_code="metered")
+        before = self.sample("shop_request_duration_seconds_count", view="get_cart", method="GET", status="200")
+        queries_before = self.sample("shop_request_db_queries_sum", view="get_cart")
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("get_cart"), {"cart_code": "metered"})
+        self.assertEqual(
+            self.sample("shop_request_duration_seconds_count", view="get_cart", method="GET", status="200"),
+            before + 1,
+        )
+        self.assertEqual(self.sample("shop_request_db_queries_sum", view="get_cart"), queries_before + len(queries))
+
+        with self.settings(DEBUG=True):
+            response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'shop_request_db_queries_bucket{le="1.0",view="get_cart"}', response.content)
+
+    def test_outbound_gateway_calls_are_timed(self):
+        stub = StubGateway({("GET", "/v3/transactions/1/verify"): [(200, {}, 0)]})
+        self.addCleanup(stub.close)
+        before = self.sample("shop_outbound_http_duration_seconds_count", service="flutterwave", outcome="2xx")
+        FlutterwaveClient("sk", base_url=stub.url).verify_transaction(1)
+        self.assertEqual(
+            self.sample("shop_outbound_http_duration_seconds_count", service="flutterwave", outcome="2xx"),
+            before + 1,
+        )
+
+    @override_settings(SLOW_REQUEST_LOG_MS=0.001)
+    def test_slow_requests_are_logged_with_sql(self):
+        with self.assertLogs("Shopping_App.metrics", "WARNING") as logs:
+            self.client.get(reverse("get_cart_stat"), {"cart_code": "none"})
+        self.assertIn("get_cart_stat", logs.output[0])
+        self.assertIn("SELECT", logs.output[0])
+
+    @override_settings(METRICS_TOKEN="scrape")
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape").status_code, 200)
+        self.assertEqual(check_metrics_token(None), [])
+
+    @override_settings(METRICS_TOKEN="", DEBUG=False)
+    def test_metrics_are_not_served_in_production_without_a_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+        self.assertEqual([w.id for w in check_metrics_token(None)], ["Shopping_App.W001"])
+
+
+@override_settings(PRODUCT_IMAGE_UPLOADER="Shopping_App.benchmarks.StubImageUploader")
+class ApiBenchmarkTests(TestCase):
+    def test_every_scenario_runs_against_seeded_data(self):
+        seed_products(40)
+        seed_carts(10, items_per_cart=3, paid_ratio=0, user_ids=seed_users(5))
+        with stub_gateway() as url, self.settings(FLUTTERWAVE_BASE_URL=url):
+            scenarios = api_scenarios()
+            for name, request in scenarios.items():
+                with self.subTest(name):
+                    result = run_load(request, 4)
+                    self.assertEqual(result["requests"], 4)
+                    self.assertEqual(result["errors"], 0, result["status_codes"])
+                    self.assertGreater(result["queries"]["mean"], 0)
+                    self.assertEqual(set(result["latency"]), {"count", "p50_ms", "p95_ms", "p99_ms", "mean_ms"})
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    """Primary is the test database; the replica is a second SQLite file with its own rows."""
+
+    replica_models = [Products, ProductImage, Cart, CartItem]
+
+    def add_database(self, alias, name):
+        # registered for this thread only, so the test runner leaves it alone
+        config = connections.configure_settings({"default": connections.settings["default"], alias: {
+            "ENGINE": "django.db.backends.sqlite3", "NAME": name,
+        }})[alias]
+        connections[alias] = load_backend(config["ENGINE"]).DatabaseWrapper(config, alias)
+
+        def remove():
+            connections[alias].close()
+            del connections[alias]
+        self.addCleanup(remove)
+
+    def setUp(self):
+        replica_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(replica_dir.cleanup)
+        self.add_database("replica_test", os.path.join(replica_dir.name, "replica.sqlite3"))
+        with connections["replica_test"].schema_editor() as editor:
+            for model in self.replica_models:
+                editor.create_model(model)
+        self.add_database("replica_down", os.path.join(replica_dir.name, "missing", "replica.sqlite3"))
+
+        reset_replica_health()
+        self.addCleanup(reset_replica_health)
+        cache.clear()
+        self.client = APIClient()
+        primary = Products.objects.create(name="On the primary", price=Decimal("5.00"))
+        # same row, renamed, so the tests can tell which database answered
+        Products.objects.using("replica_test").create(
+            id=primary.id, name="Only on the replica", price=Decimal("5.00")
+        )
+
+    def listed_names(self):
+        response = self.client.get(reverse("Products-list"))
+        return [product["name"] for product in response.data["results"]]
+
+    def test_catalog_reads_go_to_the_replica(self):
+        with self.settings(DATABASE_REPLICAS=["replica_test"]):
+            self.assertEqual(self.listed_names(), ["Only on the replica"])
+        self.assertEqual(self.listed_names(), ["On the primary"])
+
+    def test_client_reads_from_primary_after_writing_its_cart(self):
+        product = Products.objects.get(name="On the primary")
+        with self.settings(DATABASE_REPLICAS=["replica_test"]):
+            url = reverse("get_cart")
+            self.assertEqual(self.client.get(url, {"cart_code": "sticky"}).status_code, 404)
+            response = self.client.post(
+                reverse("add_item"), {"cart_code": "sticky", "product_id": product.id}, format="json"
+            )
+            # the read-back inside the same request already used the primary
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(self.client.get(url, {"cart_code": "sticky"}).status_code, 200)
+            # other clients keep reading from the replica
+            self.assertEqual(self.listed_names(), ["Only on the replica"])
+
+    def test_pins_are_kept_in_the_configured_cache(self):
+        product = Products.objects.get(name="On the primary")
+        pin_caches = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "default"},
+            "pins": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "pins"},
+        }
+        with self.settings(DATABASE_REPLICAS=["replica_test"], CACHES=pin_caches, REPLICA_PIN_CACHE_ALIAS="pins"):
+            self.client.post(reverse("add_item"), {"cart_code": "sticky", "product_id": product.id}, format="json")
+            self.assertTrue(caches["pins"].get("replica-pin:cart:sticky"))
+            self.assertIsNone(caches["default"].get("replica-pin:cart:sticky"))
+
+    def test_replicas_need_a_shared_pin_cache(self):
+        self.assertEqual(check_replica_pin_cache(None), [])
+        with self.settings(DATABASE_REPLICAS=["replica_test"]):
+            self.assertEqual([e.id for e in check_replica_pin_cache(None)], ["Shopping_App.E003"])
+        redis = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache"}}
+        with self.settings(DATABASE_REPLICAS=["replica_test"], CACHES=redis):
+            self.assertEqual(check_replica_pin_cache(None), [])
+
+    def test_unavailable_replica_falls_back_to_primary(self):
+        with self.settings(DATABASE_REPLICAS=["replica_down"]), self.assertLogs("Shopping_App.routers", "WARNING"):
+            self.assertEqual(self.listed_names(), ["On the primary"])
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        with self.settings(DATABASE_REPLICAS=["replica_test"], REPLICA_MAX_LAG_SECONDS=5):
+            with mock.patch("Shopping_App.routers.measure_lag", return_value=30.0), self.assertLogs(
+                "Shopping_App.routers", "WARNING"
+            ):
+                self.assertEqual(self.listed_names(), ["On the primary"])
+
+
+class PurgeCartsTests(TestCase):
+    def setUp(self):
+        self.product, = make_products(1)
+        user = get_user_model().objects.create_user(username="lapsed", password="x")
+        long_ago = timezone.now() - timedelta(days=45)
+
+        for code in ("old-1", "old-2", "old-3"):
+            fill_cart(Cart.objects.create(cart_code=code), [self.product], quantity=2)
+        Cart.objects.create(cart_code="fresh")
+        Cart.objects.create(cart_code="old-paid", paid=True)
+        pending = Cart.objects.create(cart_code="old-pending")
+        Transaction.objects.create(ref="ref-pending", cart=pending, user=user, amount=Decimal("200.00"))
+        Cart.objects.exclude(cart_code="fresh").update(modified_at=long_ago)
+
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        self.archive = os.path.join(archive_dir.name, "carts.jsonl.gz")
+
+    def remaining(self):
+        return set(Cart.objects.values_list("cart_code", flat=True))
+
+    def test_dry_run_only_counts(self):
+        out = StringIO()
+        call_command("purge_carts", dry_run=True, stdout=out)
+        self.assertIn("3 cart(s) with 3 item(s)", out.getvalue())
+        self.assertEqual(len(self.remaining()), 6)
+
+    def test_purges_idle_unpaid_carts_in_resumable_batches_with_archive(self):
+        out = StringIO()
+        call_command("purge_carts", batch_size=2, max_batches=1, archive_path=self.archive, stdout=out)
+        self.assertIn("Purged 2 cart(s) and 2 item(s) in 1 batch(es)", out.getvalue())
+        self.assertRegex(out.getvalue(), r"rows/s\)\. Reclaimed ~[0-9.]+ MB")
+
+        # a second run picks up where the first stopped
+        call_command("purge_carts", batch_size=2, archive_path=self.archive, stdout=StringIO())
+        self.assertEqual(self.remaining(), {"fresh", "old-paid", "old-pending"})
+        self.assertFalse(CartItem.objects.exists())
+
+        with gzip.open(self.archive, "rt") as archive:
+            records = [json.loads(line) for line in archive]
+        self.assertEqual(sorted(r["cart_code"] for r in records), ["old-1", "old-2", "old-3"])
+        self.assertEqual(records[0]["items"], [{"product_id": self.product.id, "quantity": 2}])
+
+    def test_ttl_is_configurable(self):
+        call_command("purge_carts", ttl_days=60, stdout=StringIO())
+        self.assertEqual(len(self.remaining()), 6)
+
+
+@override_settings(CART_CACHE_ALIAS="default")
+class CartCacheTests(TestCase):
+    def setUp(self):
+        cart_cache().clear()
+        self.client = APIClient()
+        self.product, self.other = make_products(2, price="100.00")
+        cart = Cart.objects.create(cart_code="cached")
+        fill_cart(cart, [self.product], quantity=2)
+        Cart.objects.filter(pk=cart.pk).update(item_count=2, subtotal=Decimal("200.00"))
+
+    def get_cart(self):
+        return self.client.get(reverse("get_cart"), {"cart_code": "cached"})
+
+    def lookups(self, kind, result):
+        value = REGISTRY.get_sample_value("shop_cart_cache_lookups_total", {"kind": kind, "result": result})
+        return value or 0
+
+    def test_reads_fill_the_cache_and_count_hits_and_misses(self):
+        misses, hits = self.lookups("cart", "miss"), self.lookups("cart", "hit")
+        first = self.get_cart()
+        with self.assertNumQueries(0):
+            second = self.get_cart()
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(self.lookups("cart", "miss"), misses + 1)
+        self.assertEqual(self.lookups("cart", "hit"), hits + 1)
+
+        self.client.get(reverse("get_cart_stat"), {"cart_code": "cached"})
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("get_cart_stat"), {"cart_code": "cached"})
+        self.assertEqual(response.data["num_of_items"], 2)
+
+    def test_mutations_write_through_or_invalidate(self):
+        self.get_cart()
+        self.client.post(
+            reverse("add_item"), {"cart_code": "cached", "product_id": self.other.id}, format="json"
+        )
+        with self.assertNumQueries(0):
+            response = self.get_cart()
+        self.assertEqual(response.data["num_of_items"], 3)
+
+        # invalidation waits for the commit, which TestCase never reaches
+        item = CartItem.objects.get(cart__cart_code="cached", product=self.other)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse("update_quantity"), {"item_id": item.id, "quantity": 5}, format="json")
+        self.assertEqual(self.get_cart().data["num_of_items"], 7)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse("delete_cartitem", args=[item.id]))
+        self.assertEqual(self.get_cart().data["num_of_items"], 2)
+
+    def test_process_local_cache_is_rejected(self):
+        self.assertEqual([e.id for e in check_cart_cache(None)], ["Shopping_App.E001"])
+        with self.settings(CART_CACHE_ALIAS=""):
+            self.assertEqual(check_cart_cache(None), [])
+            # no caching: both reads load the cart, its lines and their images
+            with self.assertNumQueries(6):
+                self.get_cart()
+                self.get_cart()
+
+    def test_product_changes_and_payment_refresh_the_cart(self):
+        self.get_cart()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.product.price = Decimal("150.00")
+            self.product.save()
+            # the new catalog version is published only once the price commits
+            self.assertEqual(self.get_cart().data["sum_total"], Decimal("200.00"))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.get_cart().data["sum_total"], Decimal("300.00"))
+
+        user = get_user_model().objects.create_user(username="cached", password="x")
+        Transaction.objects.create(
+            ref="ref-cached", cart=Cart.objects.get(cart_code="cached"), user=user, amount=Decimal("300.00")
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            confirm_transaction("ref-cached")
+        self.assertEqual(self.get_cart().status_code, 404)
+        self.assertEqual(
+            self.client.get(reverse("get_cart_stat"), {"cart_code": "cached"}).status_code, 404
+        )
+
+
+class CartMergeTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            username="returning", email="returning@example.com", password="secret-pass"
+        )
+        self.p1, self.p2, self.p3 = make_products(3, price="10.00")
+        self.saved = Cart.objects.create(cart_code="saved", user=self.user)
+        fill_cart(self.saved, [self.p1], quantity=2)
+        fill_cart(self.saved, [self.p2])
+        self.guest = Cart.objects.create(cart_code="guest")
+        fill_cart(self.guest, [self.p1])
+        fill_cart(self.guest, [self.p3], quantity=4)
+
+    def login(self, **extra):
+        return self.client.post(
+            reverse("token_obtain_pair"), {"username": "returning", "password": "secret-pass", **extra}, format="json"
+        )
+
+    def lines(self, cart):
+        return dict(cart.items.values_list("product_id", "quantity"))
+
+    def test_login_merges_carts_into_the_guest_cart(self):
+        response = self.login(cart_code="guest")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("access", response.data)
+        self.assertEqual(response.data["cart_code"], "guest")
+
+        self.assertFalse(Cart.objects.filter(cart_code="saved").exists())
+        cart = Cart.objects.get(cart_code="guest")
+        self.assertEqual(cart.user, self.user)
+        self.assertEqual(self.lines(cart), {self.p1.id: 3, self.p2.id: 1, self.p3.id: 4})
+        self.assertEqual((cart.item_count, cart.subtotal), (8, Decimal("80.00")))
+
+    def test_without_a_cart_code_the_latest_cart_is_kept(self):
+        response = self.login()
+        self.assertEqual(response.data["cart_code"], "saved")
+        self.assertEqual(self.lines(Cart.objects.get(cart_code="saved")), {self.p1.id: 2, self.p2.id: 1})
+        self.assertTrue(Cart.objects.filter(cart_code="guest", user=None).exists())
+
+    def test_other_users_carts_and_carts_being_paid_are_left_alone(self):
+        other = get_user_model().objects.create_user(username="other", email="other@example.com", password="x")
+        Cart.objects.filter(pk=self.guest.pk).update(user=other)
+        paying = Cart.objects.create(cart_code="paying", user=self.user)
+        Transaction.objects.create(ref="ref-paying", cart=paying, user=self.user, amount=Decimal("10.00"))
+
+        response = self.login(cart_code="guest")
+        self.assertEqual(response.data["cart_code"], "saved")
+        self.assertEqual(Cart.objects.get(cart_code="guest").user, other)
+        self.assertTrue(Cart.objects.filter(cart_code="paying").exists())
+
+    def test_a_failed_payment_does_not_keep_a_cart_out_of_the_merge(self):
+        Transaction.objects.create(
+            ref="ref-declined", cart=self.guest, user=self.user, amount=Decimal("50.00"),
+            status=Transaction.FAILED,
+        )
+        response = self.login(cart_code="guest")
+        self.assertEqual(response.data["cart_code"], "guest")
+        self.assertEqual(
+            self.lines(Cart.objects.get(cart_code="guest")), {self.p1.id: 3, self.p2.id: 1, self.p3.id: 4}
+        )
+        self.assertFalse(Cart.objects.filter(cart_code="saved").exists())
+
+    def test_merged_carts_with_failed_payments_are_emptied_not_deleted(self):
+        Transaction.objects.create(
+            ref="ref-declined", cart=self.saved, user=self.user, amount=Decimal("30.00"),
+            status=Transaction.FAILED,
+        )
+        self.login(cart_code="guest")
+        saved = Cart.objects.get(cart_code="saved")
+        self.assertEqual((self.lines(saved), saved.item_count), ({}, 0))
+        self.assertTrue(Transaction.objects.filter(ref="ref-declined").exists())
+        self.assertEqual(Cart.objects.get(cart_code="guest").item_count, 8)
+
+    def test_query_count_does_not_grow_with_the_number_of_lines(self):
+        fill_cart(Cart.objects.create(cart_code="tablet", user=self.user), make_products(40))
+        # lock, aggregate, upsert, delete the merged carts (4), save, plus the savepoint pair
+        with self.assertNumQueries(10):
+            cart = merge_user_carts(self.user, "guest")
+        self.assertEqual(cart.item_count, 48)
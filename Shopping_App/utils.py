@@ -1,24 +1,148 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+
 import cloudinary
 import cloudinary.uploader
+from cloudinary import CloudinaryResource
+from cloudinary.models import CloudinaryField
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.utils.module_loading import import_string
+
+from .constants import DEFAULT_IMAGE_PRESET, IMAGE_PRESETS, IMAGE_URL_CACHE_SIZE
+from .metrics import observe_outbound
+
+logger = logging.getLogger(__name__)
+# used when upload_images runs outside Django (upload_to_cloudinary.py)
+DEFAULT_UPLOAD_WORKERS = 4
+DEFAULT_UPLOAD_RETRIES = 3
 # import random
 # from django.utils import timezone
 # from datetime import timedelta
 
 def upload_file_to_cloudinary(file, folder="uploads", resource_type="auto"):
     try:
-        result = cloudinary.uploader.upload(
-            file,
-            folder=folder,
-            resource_type=resource_type,
-            use_filename=True,
-            unique_filename=True,
-            overwrite=False
-        )
+        with observe_outbound("cloudinary"):
+            result = cloudinary.uploader.upload(
+                file,
+                folder=folder,
+                resource_type=resource_type,
+                use_filename=True,
+                unique_filename=True,
+                overwrite=False
+            )
         return result.get("secure_url")
     except Exception as e:
         raise ValidationError(f"Cloudinary upload failed: {str(e)}")
-    
+
+
+_cloudinary_field = CloudinaryField("image")
+
+
+@lru_cache(maxsize=IMAGE_URL_CACHE_SIZE)
+def _build_image_url(public_id, version, format, type, resource_type, preset):
+    resource = CloudinaryResource(
+        public_id, format=format, version=version, type=type, resource_type=resource_type
+    )
+    return resource.build_url(**IMAGE_PRESETS[preset])
+
+
+def image_url(resource, preset=None):
+    """Delivery URL for a CloudinaryField value, memoized per image and preset.
+
+    Unknown presets fall back to the original rendition.
+    """
+    if isinstance(resource, str):
+        # unsaved or freshly assigned values are still "type/v1/public_id.fmt"
+        resource = _cloudinary_field.to_python(resource)
+    if not resource or not getattr(resource, "public_id", None):
+        return None
+    if preset not in IMAGE_PRESETS:
+        preset = DEFAULT_IMAGE_PRESET
+    return _build_image_url(
+        resource.public_id,
+        resource.version,
+        resource.format,
+        resource.type,
+        resource.resource_type,
+        preset,
+    )
+
+
+class CloudinaryImageUploader:
+    """Uploads one image and returns the value a CloudinaryField stores."""
+
+    def __init__(self, folder="products"):
+        self.folder = folder
+
+    def __call__(self, source):
+        if hasattr(source, "seek"):
+            source.seek(0)  # file-like sources are re-read on retry
+        with observe_outbound("cloudinary"):
+            result = cloudinary.uploader.upload(
+                source,
+                folder=self.folder,
+                resource_type="image",
+                use_filename=True,
+                unique_filename=True,
+                overwrite=False,
+            )
+        return CloudinaryResource(
+            result["public_id"],
+            version=result.get("version"),
+            format=result.get("format"),
+            type=result.get("type", "upload"),
+            resource_type=result.get("resource_type", "image"),
+        ).get_prep_value()
+
+
+def get_image_uploader():
+    return import_string(settings.PRODUCT_IMAGE_UPLOADER)()
+
+
+def upload_with_retries(uploader, source, retries=3, backoff=0.5):
+    for attempt in range(retries + 1):
+        try:
+            return uploader(source)
+        except Exception:
+            if attempt == retries:
+                raise
+            delay = backoff * (2 ** attempt)
+            logger.warning("Upload of %r failed, retrying in %.1fs", source, delay)
+            time.sleep(delay)
+
+
+def upload_images(sources, uploader=None, max_workers=None, retries=None, backoff=0.5):
+    """Upload `sources` through a bounded thread pool.
+
+    Returns {source: stored_value}, plus {source: exception} for uploads
+    that still failed after `retries` retries.
+    """
+    uploader = uploader or get_image_uploader()
+    if max_workers is None:
+        max_workers = settings.IMAGE_UPLOAD_WORKERS if settings.configured else DEFAULT_UPLOAD_WORKERS
+    if retries is None:
+        retries = settings.IMAGE_UPLOAD_RETRIES if settings.configured else DEFAULT_UPLOAD_RETRIES
+    uploaded, failed = {}, {}
+    unique_sources = list(dict.fromkeys(sources))
+    if not unique_sources:
+        return uploaded, failed
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_sources))) as pool:
+        futures = {
+            pool.submit(upload_with_retries, uploader, source, retries, backoff): source
+            for source in unique_sources
+        }
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                uploaded[source] = future.result()
+            except Exception as exc:
+                failed[source] = exc
+    return uploaded, failed
+
+
 # def generate_otp():
 #     return str(random.randint(100000, 999999))
 
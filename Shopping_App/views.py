@@ -1,18 +1,39 @@
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework import generics, filters
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework import generics
+from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework.utils.encoders import JSONEncoder
 from django.conf import settings
 from django.shortcuts import get_object_or_404
-from decimal import Decimal
+from django.http import StreamingHttpResponse
+from django.views.decorators.http import condition
+from django.db import transaction
+import hmac
 import uuid
-import requests
-import paypalrestsdk
-from django.conf import settings
 
 from .models import Products, Cart, CartItem, Transaction
+from .payments import GatewayUnavailable, flutterwave_client, paypal_client
+from .pricing import price_cart
+from .cache import (
+    cached_cart,
+    cached_product_detail,
+    catalog_etag,
+    catalog_last_modified,
+    invalidate_carts,
+    store_cart,
+)
+from .search import ProductSearchFilter
+from .services import CartAlreadyPaid, add_to_cart, apply_cart_operations
+from .tasks import (
+    PAYPAL_COMPLETED_EVENTS,
+    PAYPAL_FAILED_EVENTS,
+    execute_paypal_payment,
+    handle_paypal_webhook,
+    verify_flutterwave_payment,
+)
+from .jobs import enqueue
 from .serializers import (
     ProductsSerializer,
     DetailProductSerializer,
@@ -21,33 +42,66 @@ from .serializers import (
     SimpleCartSerializer,
     UserSerializer,
     CustomUsersSerializer,
+    CartMergingTokenObtainPairSerializer,
     ProductsPagination,
+    CartBatchSerializer,
+    OrderSerializer,
+    OrderHistoryPagination,
 )
 
 BASE_URL = settings.REACT_BASE_URL
-
-# Configure PayPal
-paypalrestsdk.configure({
-    "mode": settings.PAYPAL_MODE,
-    "client_id": settings.PAYPAL_CLIENT_ID,
-    "client_secret": settings.PAYPAL_SECRET_KEY
-})
+MAX_MEMBERSHIP_IDS = 100
+PAYPAL_SIGNATURE_HEADERS = [
+    "PAYPAL-AUTH-ALGO",
+    "PAYPAL-CERT-URL",
+    "PAYPAL-TRANSMISSION-ID",
+    "PAYPAL-TRANSMISSION-SIG",
+    "PAYPAL-TRANSMISSION-TIME",
+]
+
+
+def stream_catalog(ndjson=False, chunk_size=500, image_preset=None):
+    # Server-side cursor plus one extra_images query per chunk, so memory
+    # stays flat however large the catalog grows.
+    products = Products.objects.order_by("id").prefetch_related("extra_images")
+    serializer = ProductsSerializer(context={"image_preset": image_preset})
+    encoder = JSONEncoder()
+    if not ndjson:
+        yield "["
+    for index, product in enumerate(products.iterator(chunk_size=chunk_size)):
+        row = encoder.encode(serializer.to_representation(product))
+        if ndjson:
+            yield row + "\n"
+        else:
+            yield row if index == 0 else "," + row
+    if not ndjson:
+        yield "]"
 
 
+@condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def get_Products(request):
-    products = Products.objects.all()
-    parser_classes = [MultiPartParser, FormParser]
-    serializer = ProductsSerializer(products, many=True)
-    return Response(serializer.data)
+    ndjson = request.query_params.get("stream") == "ndjson"
+    response = StreamingHttpResponse(
+        stream_catalog(
+            ndjson=ndjson,
+            chunk_size=settings.CATALOG_STREAM_CHUNK_SIZE,
+            image_preset=request.query_params.get("image_preset"),
+        ),
+        content_type="application/x-ndjson" if ndjson else "application/json",
+    )
+    response["Cache-Control"] = "no-cache"
+    return response
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def get_product_detail(request, slug):
-    product = get_object_or_404(Products, slug=slug)
-    serializer = DetailProductSerializer(product)
-    return Response(serializer.data)
+    def build():
+        product = get_object_or_404(Products, slug=slug)
+        return DetailProductSerializer(product).data, product.category
+
+    return Response(cached_product_detail(slug, build))
 
 @api_view(["POST"])
 @permission_classes([AllowAny])
@@ -62,22 +116,16 @@ def add_item(request):
         if quantity < 1:
             return Response({"error": "Quantity must be at least 1."}, status=400)
 
-        product = get_object_or_404(Products, id=product_id)
-        cart, _ = Cart.objects.get_or_create(cart_code=cart_code)
+        product = get_object_or_404(Products.objects.only("id", "price"), id=product_id)
+        # Atomic upsert; also attaches the user if the cart has none yet
+        cart_id = add_to_cart(cart_code, product, quantity, user=request.user)
 
-        # Attach user if authenticated
-        if request.user.is_authenticated and not cart.user:
-            cart.user = request.user
-            cart.save()
-
-        cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product)
-        cart_item.quantity = quantity if created else cart_item.quantity + quantity
-        cart_item.save()
-
-        cart_serializer = CartSerializer(cart)
+        cart = Cart.objects.with_items().get(pk=cart_id)
+        cart_data = CartSerializer(cart).data
+        store_cart(cart.cart_code, cart_data, SimpleCartSerializer(cart).data)
         return Response({
             "message": "Item added to cart.",
-            "cart": cart_serializer.data
+            "cart": cart_data
         }, status=201)
 
     except ValueError:
@@ -85,19 +133,52 @@ def add_item(request):
     except Exception as e:
         return Response({"error": f"Server error: {str(e)}"}, status=500)
 
+@api_view(["POST"])
+@permission_classes([AllowAny])
+def cart_batch(request):
+    serializer = CartBatchSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({"error": serializer.errors}, status=400)
+
+    try:
+        cart_id = apply_cart_operations(
+            serializer.validated_data["cart_code"],
+            serializer.validated_data["operations"],
+            user=request.user,
+        )
+    except Products.DoesNotExist as e:
+        return Response({"error": str(e)}, status=404)
+    except CartAlreadyPaid as e:
+        return Response({"error": str(e)}, status=409)
+
+    cart = Cart.objects.with_items().get(pk=cart_id)
+    cart_data = CartSerializer(cart).data
+    store_cart(cart.cart_code, cart_data, SimpleCartSerializer(cart).data)
+    return Response({"message": "Cart updated.", "cart": cart_data})
+
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def check_product_in_cart(request):
-    
     cart_code = request.query_params.get("cart_code")
-    product_id = request.query_params.get("product_id")
-    
-    cart = Cart.objects.get(cart_code=cart_code)
-    product_id = Products.objects.get(id=product_id)
-    
-    product_exists_in_cart = CartItem.objects.filter(cart=cart, product=product_id).exists()
-    
-    return Response({"exists": product_exists_in_cart})
+    raw_ids = request.query_params.getlist("product_ids") or request.query_params.getlist("product_id")
+    raw_ids = [value for raw in raw_ids for value in raw.split(",") if value.strip()]
+    if not cart_code or not raw_ids:
+        return Response({"error": "cart_code and product_id(s) are required."}, status=400)
+    if len(raw_ids) > MAX_MEMBERSHIP_IDS:
+        return Response({"error": f"At most {MAX_MEMBERSHIP_IDS} product ids per request."}, status=400)
+    try:
+        product_ids = [int(value) for value in raw_ids]
+    except ValueError:
+        return Response({"error": "product ids must be numbers."}, status=400)
+
+    # one joined query; a missing cart simply has nothing in it
+    in_cart = dict(
+        CartItem.objects.filter(cart__cart_code=cart_code, product_id__in=product_ids)
+        .values_list("product_id", "quantity")
+    )
+    items = {pid: in_cart.get(pid, 0) for pid in product_ids}
+    return Response({"exists": any(items.values()), "items": items})
+
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def get_cart_stat(request):
@@ -105,12 +186,18 @@ def get_cart_stat(request):
     if not cart_code:
         return Response({"error": "cart_code is required."}, status=400)
 
-    cart = Cart.objects.filter(cart_code=cart_code, paid=False).first()
-    if not cart:
-        return Response({"error": "Cart not found or already paid."}, status=404)
+    def build():
+        cart = (
+            Cart.objects.filter(cart_code=cart_code, paid=False)
+            .only("id", "cart_code", "item_count")
+            .first()
+        )
+        return SimpleCartSerializer(cart).data if cart else None
 
-    serializer = SimpleCartSerializer(cart)
-    return Response(serializer.data)
+    data = cached_cart(cart_code, "stat", build)
+    if data is None:
+        return Response({"error": "Cart not found or already paid."}, status=404)
+    return Response(data)
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
@@ -119,12 +206,14 @@ def get_cart(request):
     if not cart_code:
         return Response({"error": "cart_code is required."}, status=400)
 
-    try:
-        cart = Cart.objects.get(cart_code=cart_code, paid=False)
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
-    except Cart.DoesNotExist:
+    def build():
+        cart = Cart.objects.with_items().filter(cart_code=cart_code, paid=False).first()
+        return CartSerializer(cart).data if cart else None
+
+    data = cached_cart(cart_code, "cart", build)
+    if data is None:
         return Response({"error": "Cart not found."}, status=404)
+    return Response(data)
 
 @api_view(["PATCH"])
 @permission_classes([AllowAny])
@@ -136,9 +225,19 @@ def update_quantity(request):
         if quantity < 1:
             return Response({"error": "Quantity must be at least 1."}, status=400)
 
-        cart_item = CartItem.objects.get(id=item_id)
-        cart_item.quantity = quantity
-        cart_item.save()
+        with transaction.atomic():
+            cart_item = (
+                # lock the line only: adjust_totals updates the cart with F(),
+                # and locking the product would serialize every cart holding it
+                CartItem.objects.select_for_update(of=("self",))
+                .select_related("cart", "product")
+                .get(id=item_id)
+            )
+            delta = quantity - cart_item.quantity
+            cart_item.quantity = quantity
+            cart_item.save(update_fields=["quantity"])
+            cart_item.cart.adjust_totals(delta, delta * cart_item.product.price)
+            invalidate_carts(cart_item.cart.cart_code)
 
         serializer = CartItemSerializer(cart_item)
         return Response({"data": serializer.data, "message": "Cart item updated successfully"})
@@ -151,8 +250,15 @@ def update_quantity(request):
 @permission_classes([AllowAny])
 def delete_cartitem(request, item_id):
     try:
-        item = CartItem.objects.get(id=item_id)
-        item.delete()
+        with transaction.atomic():
+            item = (
+                CartItem.objects.select_for_update(of=("self",))
+                .select_related("cart", "product")
+                .get(id=item_id)
+            )
+            item.cart.adjust_totals(-item.quantity, -item.quantity * item.product.price)
+            item.delete()
+            invalidate_carts(item.cart.cart_code)
         return Response(status=status.HTTP_204_NO_CONTENT)
     except CartItem.DoesNotExist:
         return Response({'error': 'Item not found'}, status=404)
@@ -168,6 +274,14 @@ def user_info(request):
     serializer = UserSerializer(request.user)
     return Response(serializer.data)
 
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def order_history(request):
+    paginator = OrderHistoryPagination()
+    page = paginator.paginate_queryset(Cart.objects.paid_orders(request.user), request)
+    context = {"request": request, "image_preset": request.query_params.get("image_preset")}
+    return paginator.get_paginated_response(OrderSerializer(page, many=True, context=context).data)
+
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def create_user(request):
@@ -181,11 +295,24 @@ def create_user(request):
     return Response({"error": serializer.errors}, status=400)
 
 class ProductsListView(generics.ListAPIView):
-    queryset = Products.objects.all()
+    queryset = Products.objects.order_by("id").prefetch_related("extra_images")
     serializer_class = ProductsSerializer
     pagination_class = ProductsPagination
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['name', 'description', 'category']
+    filter_backends = [ProductSearchFilter]
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["image_preset"] = self.request.query_params.get("image_preset")
+        return context
+
+class CartMergingTokenObtainPairView(TokenObtainPairView):
+    """Issues the JWT pair and folds the user's unpaid carts into one.
+
+    Send the guest `cart_code` along with the credentials; the response
+    carries the `cart_code` to use from now on.
+    """
+
+    serializer_class = CartMergingTokenObtainPairSerializer
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
@@ -198,10 +325,8 @@ def initiate_payment(request):
 
         cart = get_object_or_404(Cart, cart_code=cart_code)
 
-        subtotal = sum(item.quantity * item.product.price for item in cart.items.all())
-        tax = Decimal('1500.00')
-        total = subtotal + tax
         currency = "NGN"
+        total = price_cart(cart, currency).total
         tx_ref = str(uuid.uuid4())
         redirect_url = f"{BASE_URL}/payment-status/"
 
@@ -229,12 +354,7 @@ def initiate_payment(request):
             }
         }
 
-        headers = {
-            "Authorization": f"Bearer {settings.FLUTTERWAVE_SECRET_KEY}",
-            "Content-Type": "application/json"
-        }
-
-        response = requests.post("https://api.flutterwave.com/v3/payments", json=payload, headers=headers)
+        response = flutterwave_client().create_payment(payload)
 
         if response.status_code in [200, 201]:
             payment_link = response.json().get("data", {}).get("link")
@@ -243,9 +363,32 @@ def initiate_payment(request):
             return Response({"error": "Payment link not provided."}, status=500)
         return Response({"error": "Flutterwave API error", "details": response.json()}, status=response.status_code)
 
+    except GatewayUnavailable as e:
+        return Response({"error": str(e)}, status=503)
     except Exception as e:
         return Response({"error": str(e)}, status=500)
 
+def payment_status_response(status_value):
+    """What the redirect callbacks tell the browser, from local state only."""
+    if status_value == Transaction.COMPLETED:
+        return Response({
+            'message': 'Payment successful',
+            'subMessage': 'Your transaction has been completed successfully.',
+            'status': status_value,
+        })
+    if status_value == Transaction.FAILED:
+        return Response({
+            'message': 'Payment was not successful',
+            'subMessage': 'Try again or use another method.',
+            'status': status_value,
+        }, status=400)
+    return Response({
+        'message': 'Payment processing',
+        'subMessage': 'We are confirming your payment with the provider.',
+        'status': status_value,
+    }, status=202)
+
+
 @api_view(["GET", "POST"])
 def payment_callback(request):
     transaction_id = request.GET.get("transaction_id")
@@ -264,47 +407,53 @@ def payment_callback(request):
             "subMessage": "Try again or use another method."
         }, status=400)
 
-    headers = {
-        "Authorization": f"Bearer {settings.FLUTTERWAVE_SECRET_KEY}"
-    }
+    status_value = Transaction.objects.filter(ref=tx_ref).values_list("status", flat=True).first()
+    if status_value is None:
+        return Response({"error": "Transaction not found."}, status=404)
+    if status_value == Transaction.PENDING:
+        # the webhook normally settles it; verify too in case it is late
+        enqueue(verify_flutterwave_payment, tx_ref, transaction_id)
+    return payment_status_response(status_value)
 
-    try:
-        verify_url = f"https://api.flutterwave.com/v3/transactions/{transaction_id}/verify"
-        response = requests.get(verify_url, headers=headers)
-        res_data = response.json()
-
-        if res_data.get("status") == "success":
-            transaction = get_object_or_404(Transaction, ref=tx_ref)
-            data = res_data.get("data", {})
-
-            if (
-                data.get("status") == "successful"
-                and float(data.get("amount")) == float(transaction.amount)
-                and data.get("currency") == transaction.currency
-            ):
-                transaction.status = 'Completed'
-                transaction.save()
-
-                cart = transaction.cart
-                cart.paid = True
-                cart.user = request.user
-                cart.save()
-
-            return Response({
-            'message': 'Payment successful',
-            'subMessage': 'Your transaction has been completed successfully.'
-        })
 
-        return Response({
-            'message': 'Payment verification failed',
-            'subMessage': 'Could not verify with Flutterwave.'
-        }, status=400)
+@api_view(["POST"])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def flutterwave_webhook(request):
+    """Flutterwave charge notifications, authenticated by the verif-hash header.
+
+    The payload is not trusted: it only tells us which charge to verify.
+    """
+    secret_hash = settings.FLUTTERWAVE_WEBHOOK_HASH
+    if not secret_hash or not hmac.compare_digest(request.headers.get("verif-hash", ""), secret_hash):
+        return Response(status=401)
+
+    data = request.data.get("data") or {}
+    tx_ref, transaction_id = data.get("tx_ref"), data.get("id")
+    if tx_ref and transaction_id and Transaction.objects.filter(ref=tx_ref, status=Transaction.PENDING).exists():
+        enqueue(verify_flutterwave_payment, tx_ref, transaction_id)
+    return Response(status=200)
 
-    except Exception as e:
-        return Response({
-            'message': 'Verification error',
-            'subMessage': str(e)
-        }, status=500)
+
+@api_view(["POST"])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def paypal_webhook(request):
+    """PayPal sale notifications; the signature is checked with PayPal before acting.
+
+    Requests that could never verify are refused here, so they cost
+    neither a job row nor a call to PayPal.
+    """
+    headers = {name: request.headers.get(name, "") for name in PAYPAL_SIGNATURE_HEADERS}
+    event_type = request.data.get("event_type") if isinstance(request.data, dict) else None
+    if (
+        not settings.PAYPAL_WEBHOOK_ID
+        or not all(headers.values())
+        or event_type not in PAYPAL_COMPLETED_EVENTS | PAYPAL_FAILED_EVENTS
+    ):
+        return Response(status=400)
+    enqueue(handle_paypal_webhook, headers, request.data)
+    return Response(status=200)
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
@@ -317,11 +466,9 @@ def initiate_paypal_payment(request):
             return Response({"error": "cart_code is required."}, status=400)
 
         cart = get_object_or_404(Cart, cart_code=cart_code)
-        subtotal = sum(item.quantity * item.product.price for item in cart.items.all())
-        tax = Decimal("1000.00")
-        total_amount = subtotal + tax
+        total_amount = price_cart(cart, "USD").total
 
-        payment = paypalrestsdk.Payment({
+        response = paypal_client().create_payment({
             "intent": "sale",
             "payer": {"payment_method": "paypal"},
             "redirect_urls": {
@@ -346,22 +493,25 @@ def initiate_paypal_payment(request):
             }]
         })
 
-        if payment.create():
+        if response.status_code == 201:
             Transaction.objects.create(
                 ref=tx_ref,
+                provider_ref=response.json().get("id"),
                 cart=cart,
                 user=user,
                 amount=total_amount,
                 currency="USD",
                 status='pending'
             )
-            for link in payment.links:
-                if link.rel == "approval_url":
-                    return Response({"approval_url": str(link.href)})
+            for link in response.json().get("links", []):
+                if link.get("rel") == "approval_url":
+                    return Response({"approval_url": link["href"]})
             return Response({"error": "No approval URL found."}, status=400)
         else:
-            return Response({"error": "PayPal payment creation failed.", "details": payment.error}, status=400)
+            return Response({"error": "PayPal payment creation failed.", "details": response.json()}, status=400)
 
+    except GatewayUnavailable as e:
+        return Response({"error": str(e)}, status=503)
     except Exception as e:
         return Response({"error": str(e)}, status=500)
 
@@ -371,20 +521,12 @@ def paypal_payment_callback(request):
     payer_id = request.data.get("PayerID") or request.query_params.get("PayerID")
     ref = request.data.get("ref") or request.query_params.get("ref")
 
-    transaction = get_object_or_404(Transaction, ref=ref)
-
-    if payment_id and payer_id:
-        payment = paypalrestsdk.Payment.find(payment_id)
-        if payment.execute({"payer_id": payer_id}):
-            transaction.status = "completed"
-            transaction.save()
-            
-            cart = transaction.cart
-            cart.paid = True
-            cart.user = request.user
-            cart.save()
-
-            return Response({"message": "Payment successful"})
-        return Response({"error": "Payment execution failed"}, status=400)
+    if not (payment_id and payer_id):
+        return Response({"error": "Invalid callback parameters"}, status=400)
 
-    return Response({"error": "Invalid callback parameters"}, status=400)
+    status_value = Transaction.objects.filter(ref=ref).values_list("status", flat=True).first()
+    if status_value is None:
+        return Response({"error": "Transaction not found."}, status=404)
+    if status_value == Transaction.PENDING:
+        enqueue(execute_paypal_payment, ref, payment_id, payer_id)
+    return payment_status_response(status_value)
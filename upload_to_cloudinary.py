@@ -1,8 +1,11 @@
 import os
+import sys
 import cloudinary
 import cloudinary.uploader
 from dotenv import load_dotenv
 
+from Shopping_App.utils import upload_images
+
 # Load environment variables
 load_dotenv()
 
@@ -13,28 +16,40 @@ cloudinary.config(
     api_secret=os.getenv("API_SECRET")
 )
 
-# Paths
-LOCAL_IMAGE_FOLDER = r"C:\Users\user\Desktop\Ecommerce\media\img"
+# Paths: python upload_to_cloudinary.py <folder> (or LOCAL_IMAGE_FOLDER in .env)
+LOCAL_IMAGE_FOLDER = sys.argv[1] if len(sys.argv) > 1 else os.getenv("LOCAL_IMAGE_FOLDER", "media/img")
 CLOUDINARY_FOLDER = "ecommerce_media"
 VALID_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg')
+UPLOAD_WORKERS = int(os.getenv("IMAGE_UPLOAD_WORKERS", "4"))
+UPLOAD_RETRIES = int(os.getenv("IMAGE_UPLOAD_RETRIES", "3"))
+
+
+def upload(local_path):
+    relative_path = os.path.relpath(local_path, LOCAL_IMAGE_FOLDER)
+    cloudinary_path = os.path.join(CLOUDINARY_FOLDER, os.path.dirname(relative_path)).replace("\\", "/")
+    result = cloudinary.uploader.upload(
+        local_path,
+        folder=cloudinary_path,
+        use_filename=True,
+        unique_filename=False
+    )
+    return result["secure_url"]
+
+
+# Collect all valid images recursively, then upload them in parallel
+local_paths = [
+    os.path.join(root, filename)
+    for root, _, files in os.walk(LOCAL_IMAGE_FOLDER)
+    for filename in files
+    if filename.lower().endswith(VALID_EXTENSIONS)
+]
+print(f"🔼 Uploading {len(local_paths)} image(s) from {LOCAL_IMAGE_FOLDER}...")
+uploaded, failed = upload_images(
+    local_paths, uploader=upload, max_workers=UPLOAD_WORKERS, retries=UPLOAD_RETRIES
+)
 
-# Upload all valid images recursively
-for root, _, files in os.walk(LOCAL_IMAGE_FOLDER):
-    for filename in files:
-        if filename.lower().endswith(VALID_EXTENSIONS):
-            local_path = os.path.join(root, filename)
-            relative_path = os.path.relpath(local_path, LOCAL_IMAGE_FOLDER)
-            cloudinary_path = os.path.join(CLOUDINARY_FOLDER, os.path.dirname(relative_path)).replace("\\", "/")
-
-            try:
-                print(f"🔼 Uploading: {relative_path}...")
-                result = cloudinary.uploader.upload(
-                    local_path,
-                    folder=cloudinary_path,
-                    use_filename=True,
-                    unique_filename=False
-                )
-                print(f"✅ Uploaded: {filename}")
-                print(f"📸 URL: {result['secure_url']}\n")
-            except Exception as e:
-                print(f"❌ Failed to upload {filename}: {e}")
+for local_path, url in uploaded.items():
+    print(f"✅ Uploaded: {os.path.basename(local_path)}")
+    print(f"📸 URL: {url}\n")
+for local_path, error in failed.items():
+    print(f"❌ Failed to upload {os.path.basename(local_path)}: {error}")